@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Pipeline benchmarks
+Runs every pipeline stage and the preview on synthetic DEMs, each stage in a
+fresh process so wall time, CPU time and peak memory are its own. Results are
+appended to a JSON history; a stage slower (or bigger) than the median of its
+recent runs on this machine by more than --threshold fails the run.
+
+    python benchmarks/bench.py [--sizes 512 2048] [--crs projected] [--threshold 0.25]
+
+Needs the GDAL Python bindings.
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+try:
+    import resource
+except ImportError:  # Windows: no per-process rusage; CPU and memory are not recorded
+    resource = None
+
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+DEFAULT_HISTORY = os.path.join(RESULTS_DIR, 'history.json')
+DEFAULT_DATA_DIR = os.path.join(RESULTS_DIR, 'data')
+
+# In dependency order: each stage reads what the previous ones wrote
+STAGES = ['hillshade', 'greyscale', 'warp', 'tiling', 'tiling_gdal',
+          'verification', 'preview', 'convert']
+# Compared against the history; CPU time is recorded but too noisy to gate on
+GATED_METRICS = ['wall_s', 'peak_rss_mb']
+# Differences below these are noise regardless of the relative threshold
+NOISE_FLOOR = {'wall_s': 0.05, 'peak_rss_mb': 16.0}
+
+WEB_MERCATOR_PIXEL_Z0 = 156543.03392804097
+
+
+def quiet(message):
+    pass
+
+
+# ── Child process: run one stage and measure it ──
+
+def _rusage():
+    if resource is None:
+        return None
+    scale = 1 if sys.platform == 'darwin' else 1024  # ru_maxrss is KB on Linux
+    usage = []
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        r = resource.getrusage(who)
+        usage.append((r.ru_utime + r.ru_stime, r.ru_maxrss * scale))
+    return usage
+
+
+def _count_tiles(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM tiles").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def run_stage(stage, dem, work, min_zoom, max_zoom):
+    """Run one stage; return the number of tiles it produced (or None)"""
+    from hillshade import engine, pipeline, tiler
+    gdal = engine.require_gdal()
+    hillshade_path = os.path.join(work, 'hillshade.tif')
+    grey_path = os.path.join(work, 'hillshade_grey.tif')
+    mercator_path = os.path.join(work, 'hillshade_mercator.tif')
+    native_path = os.path.join(work, 'native.mbtiles')
+    # No stage cache: every run must measure the work, not a cache hit
+    options = pipeline.ConversionOptions(min_zoom=min_zoom, max_zoom=max_zoom,
+                                         resumable=False, stage_cache=False)
+
+    if stage == 'hillshade':
+        engine.hillshade_file(dem, hillshade_path, compute_edges=True, **options.shading())
+    elif stage == 'greyscale':
+        gdal.Translate(grey_path, hillshade_path, outputType=gdal.GDT_Byte,
+                       creationOptions=['TILED=YES', 'PHOTOMETRIC=MINISBLACK'])
+    elif stage == 'warp':
+        gdal.Warp(mercator_path, grey_path, dstSRS='EPSG:3857', resampleAlg='bilinear',
+                  creationOptions=['TILED=YES', 'COMPRESS=DEFLATE'])
+    elif stage == 'tiling':
+        return tiler.build_mbtiles(grey_path, native_path, min_zoom, max_zoom, log=quiet)
+    elif stage == 'tiling_gdal':
+        output = os.path.join(work, 'gdal.mbtiles')
+        gdal.Translate(output, mercator_path, format='MBTiles',
+                       creationOptions=pipeline.mbtiles_creation_options(min_zoom, max_zoom))
+        return _count_tiles(output)
+    elif stage == 'verification':
+        pipeline.Pipeline(log=quiet).verify_output(native_path, options)
+    elif stage == 'preview':
+        for _ in pipeline.Pipeline(log=quiet).preview(dem, options):
+            pass
+    elif stage == 'convert':
+        output = os.path.join(work, 'convert.mbtiles')
+        pipeline.Pipeline(log=quiet).convert(dem, output, options)
+        return _count_tiles(output)
+    else:
+        raise ValueError(f"Unknown stage: {stage}")
+    return None
+
+
+def child_main(args):
+    # Import everything up front so stage timings exclude module loading
+    from hillshade import engine, pipeline, tiler  # noqa: F401
+    engine.require_gdal()
+    before = _rusage()
+    started = time.perf_counter()
+    tiles = run_stage(args.child, args.dem, args.work, args.min_zoom, args.max_zoom)
+    wall = time.perf_counter() - started
+    after = _rusage()
+    result = {'wall_s': round(wall, 4), 'tiles': tiles,
+              'tiles_per_s': round(tiles / wall, 1) if tiles and wall > 0 else None}
+    if after is not None:
+        result['cpu_s'] = round(sum(a[0] - b[0] for a, b in zip(after, before)), 4)
+        result['peak_rss_mb'] = round(max(after[0][1], after[1][1]) / 1048576.0, 1)
+    print(json.dumps(result))
+    return 0
+
+
+# ── Parent process: generate inputs, run stages, compare with history ──
+
+def zoom_range(pixel_metres):
+    """Zoom whose pixels best match the DEM resolution, and three levels below"""
+    max_zoom = max(0, int(round(math.log2(WEB_MERCATOR_PIXEL_Z0 / pixel_metres))))
+    return max(0, max_zoom - 3), max_zoom
+
+
+def measure(stage, dem, work, min_zoom, max_zoom):
+    cmd = [sys.executable, os.path.abspath(__file__), '--child', stage, '--dem', dem,
+           '--work', work, '--min-zoom', str(min_zoom), '--max-zoom', str(max_zoom)]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Stage {stage} failed:\n{result.stderr.strip()}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def load_history(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def save_history(path, history):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(history, f, indent=1)
+    os.replace(tmp, path)
+
+
+def baseline(history, host, key, metric, runs):
+    """Median of metric over the last `runs` recorded runs of key on this host"""
+    values = [run['results'][key][metric] for run in history
+              if run.get('host') == host and key in run['results']
+              and run['results'][key].get(metric) is not None]
+    values = values[-runs:]
+    return statistics.median(values) if values else None
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the hillshade pipeline")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[512, 2048])
+    parser.add_argument('--crs', nargs='+', default=['geographic', 'projected'],
+                        choices=['geographic', 'projected'])
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="allowed relative slowdown before failing (default: %(default)s)")
+    parser.add_argument('--baseline-runs', type=int, default=5,
+                        help="recent runs whose median is the baseline (default: %(default)s)")
+    parser.add_argument('--history', default=DEFAULT_HISTORY)
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR,
+                        help="where generated DEMs are cached")
+    parser.add_argument('--no-record', action='store_true',
+                        help="compare only; do not append this run to the history")
+    parser.add_argument('--child', choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument('--dem', help=argparse.SUPPRESS)
+    parser.add_argument('--work', help=argparse.SUPPRESS)
+    parser.add_argument('--min-zoom', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--max-zoom', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        return child_main(args)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import synthetic
+    from hillshade import engine
+
+    gdal = engine.load_gdal()
+    if gdal is None:
+        print("The benchmarks need the GDAL Python bindings (osgeo)", file=sys.stderr)
+        return 2
+
+    host = socket.gethostname()
+    history = load_history(args.history)
+    results = {}
+    regressions = []
+    print(f"{'dem':<24} {'stage':<13} {'wall':>8} {'cpu':>8} {'peak MB':>8} "
+          f"{'tiles/s':>9}  vs baseline")
+    for size in args.sizes:
+        for crs in args.crs:
+            dem = synthetic.synthetic_dem(args.data_dir, size, crs, args.seed)
+            min_zoom, max_zoom = zoom_range(30.0)
+            dem_name = f'{size}_{crs}'
+            work = tempfile.mkdtemp(prefix='hillshade_bench_')
+            try:
+                for stage in args.stages:
+                    result = measure(stage, dem, work, min_zoom, max_zoom)
+                    key = f'{dem_name}/{stage}'
+                    results[key] = result
+                    notes = []
+                    for metric in GATED_METRICS:
+                        value = result.get(metric)
+                        base = baseline(history, host, key, metric, args.baseline_runs)
+                        if value is None or base is None:
+                            continue
+                        change = (value - base) / base if base else 0.0
+                        notes.append(f"{metric} {change:+.0%}")
+                        if (change > args.threshold
+                                and value - base > NOISE_FLOOR[metric]):
+                            regressions.append(f"{key}: {metric} {base} -> {value} "
+                                               f"({change:+.0%})")
+                    print(f"{dem_name:<24} {stage:<13} {result['wall_s']:>7.2f}s "
+                          f"{result.get('cpu_s') or 0:>7.2f}s "
+                          f"{result.get('peak_rss_mb') or 0:>8.0f} "
+                          f"{result.get('tiles_per_s') or 0:>9.0f}  "
+                          f"{', '.join(notes) or 'no baseline'}")
+            finally:
+                shutil.rmtree(work, ignore_errors=True)
+
+    if not args.no_record:
+        history.append({
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'host': host,
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'gdal': gdal.__version__,
+            'cpu_count': os.cpu_count(),
+            'results': results,
+        })
+        save_history(args.history, history)
+
+    if regressions:
+        print(f"\nRegressions beyond {args.threshold:.0%}:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
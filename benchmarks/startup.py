@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Startup time budget
+Times cold imports and `--help` in fresh interpreters, checks that the
+CLI/library path does not load GUI or raster modules, and exits non-zero
+when a measurement exceeds its budget.
+
+    python benchmarks/startup.py [--runs 7] [--scale 1.0] [--json]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules the CLI and library entry points must not import eagerly
+HEAVY_MODULES = ['tkinter', 'PIL', 'numpy', 'osgeo',
+                 'hillshade.engine', 'hillshade.tiler']
+
+# (name, python code, budget in seconds); budgets include interpreter startup
+CHECKS = [
+    ('import hillshade.cli', 'import hillshade.cli', 0.25),
+    ('import hillshade.pipeline', 'import hillshade.pipeline', 0.25),
+    ('import hillshade_converter', 'import hillshade_converter', 0.30),
+    ('cli --help',
+     'import sys; from hillshade import cli; sys.argv[0] = "hillshade-converter"; '
+     'cli.main(["--help"])', 0.30),
+    ('gdal discovery (warm cache)',
+     'from hillshade import discovery; discovery.find_gdaldem()', 0.30),
+]
+
+
+def run_python(code, env):
+    started = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def leaked_modules(module, env):
+    """Heavy modules that importing `module` pulls in"""
+    code = (f"import sys, json, {module}; "
+            f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))")
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, check=True,
+                         capture_output=True, text=True).stdout
+    return json.loads(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help="multiply every budget, e.g. 2 on slow CI machines")
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONPATH=ROOT, PYTHONDONTWRITEBYTECODE='1')
+    # Keep the discovery cache out of the user's real cache directory
+    env['HILLSHADE_CACHE_DIR'] = tempfile.mkdtemp(prefix='hillshade_startup_')
+
+    baseline = statistics.median(run_python('pass', env) for _ in range(args.runs))
+    results = []
+    failed = False
+    for name, code, budget in CHECKS:
+        run_python(code, env)  # Warm the page cache, bytecode and discovery cache
+        median = statistics.median(run_python(code, env) for _ in range(args.runs))
+        limit = budget * args.scale
+        ok = median <= limit
+        failed |= not ok
+        results.append({'check': name, 'median_s': round(median, 4),
+                        'over_interpreter_s': round(median - baseline, 4),
+                        'budget_s': round(limit, 4), 'ok': ok})
+
+    for module in ('hillshade.cli', 'hillshade.pipeline', 'hillshade_converter'):
+        leaked = leaked_modules(module, env)
+        failed |= bool(leaked)
+        results.append({'check': f'{module} imports', 'leaked': leaked, 'ok': not leaked})
+
+    if args.json:
+        print(json.dumps({'interpreter_s': round(baseline, 4), 'results': results}, indent=1))
+    else:
+        print(f"Interpreter startup: {baseline * 1000:.0f} ms")
+        for r in results:
+            status = 'ok  ' if r['ok'] else 'FAIL'
+            if 'median_s' in r:
+                print(f"{status} {r['check']:<32} {r['median_s'] * 1000:6.0f} ms "
+                      f"(+{r['over_interpreter_s'] * 1000:.0f} ms, "
+                      f"budget {r['budget_s'] * 1000:.0f} ms)")
+            else:
+                leaked = ', '.join(r['leaked']) or 'none'
+                print(f"{status} {r['check']:<32} heavy modules: {leaked}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
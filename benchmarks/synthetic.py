@@ -0,0 +1,86 @@
+"""
+Synthetic DEMs for benchmarks
+Fractal (spectral synthesis) terrain with nodata holes, written as GeoTIFF in
+a geographic or a projected CRS. Generated once per (size, crs, seed) and
+reused from the data directory.
+"""
+
+import os
+
+import numpy as np
+
+from hillshade import engine
+
+NODATA = -9999.0
+
+# name -> (EPSG code, origin x, origin y, pixel size); both about 30 m pixels
+CRS = {
+    'geographic': (4326, 10.0, 47.5, 1.0 / 3600),
+    'projected': (32633, 500000.0, 5300000.0, 30.0),
+}
+
+
+def fractal_terrain(size, seed=0, beta=2.4, relief=2500.0):
+    """size x size float32 heights with a 1/f**beta power spectrum"""
+    rng = np.random.default_rng(seed)
+    noise = rng.standard_normal((size, size), dtype=np.float32)
+    spectrum = np.fft.rfft2(noise)
+    del noise
+    ky = np.fft.fftfreq(size).astype(np.float32)[:, np.newaxis]
+    kx = np.fft.rfftfreq(size).astype(np.float32)[np.newaxis, :]
+    k = np.sqrt(kx * kx + ky * ky)
+    k[0, 0] = 1.0
+    spectrum *= k ** np.float32(-beta / 2.0)
+    spectrum[0, 0] = 0
+    del k
+    terrain = np.fft.irfft2(spectrum, s=(size, size)).astype(np.float32)
+    del spectrum
+    terrain -= terrain.min()
+    terrain *= np.float32(relief / max(float(terrain.max()), 1e-6))
+    return terrain
+
+
+def punch_holes(terrain, seed=0, count=6, max_radius=0.08):
+    """Set a few random discs to NODATA, like voids in SRTM or lidar gaps"""
+    rng = np.random.default_rng(seed + 1)
+    size = terrain.shape[0]
+    for _ in range(count):
+        cy, cx = rng.integers(0, size, 2)
+        radius = max(2, int(rng.uniform(0.01, max_radius) * size))
+        y0, y1 = max(cy - radius, 0), min(cy + radius + 1, size)
+        x0, x1 = max(cx - radius, 0), min(cx + radius + 1, size)
+        yy, xx = np.ogrid[y0:y1, x0:x1]
+        disc = (yy - cy) ** 2 + (xx - cx) ** 2 <= radius * radius
+        terrain[y0:y1, x0:x1][disc] = NODATA
+    return terrain
+
+
+def write_dem(path, terrain, crs):
+    gdal = engine.require_gdal()
+    from osgeo import osr
+    epsg, x0, y0, pixel = CRS[crs]
+    height, width = terrain.shape
+    ds = gdal.GetDriverByName('GTiff').Create(
+        path, width, height, 1, gdal.GDT_Float32,
+        options=['TILED=YES', 'BLOCKXSIZE=256', 'BLOCKYSIZE=256'])
+    ds.SetGeoTransform((x0, pixel, 0.0, y0, 0.0, -pixel))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(epsg)
+    ds.SetProjection(srs.ExportToWkt())
+    band = ds.GetRasterBand(1)
+    band.SetNoDataValue(NODATA)
+    band.WriteArray(terrain)
+    ds.FlushCache()
+    ds = None
+
+
+def synthetic_dem(data_dir, size, crs, seed=0):
+    """Path of a cached synthetic DEM, generating it on first use"""
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f'fractal_{size}_{crs}_{seed}.tif')
+    if not os.path.exists(path):
+        terrain = punch_holes(fractal_terrain(size, seed), seed)
+        tmp = path + '.tmp.tif'
+        write_dem(tmp, terrain, crs)
+        os.replace(tmp, path)
+    return path
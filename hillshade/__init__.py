@@ -0,0 +1,4 @@
+"""
+Hillshade processing package
+In-process building blocks used by the Hillshade to MBTiles Converter
+"""
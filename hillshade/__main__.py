@@ -0,0 +1,7 @@
+"""Allow `python -m hillshade convert ...`"""
+
+import sys
+
+from hillshade.cli import main
+
+sys.exit(main())
@@ -0,0 +1,110 @@
+"""
+Resumable conversions
+A job manifest next to the output records finished stages and tile blocks
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+MANIFEST_VERSION = 1
+
+
+def input_identity(paths):
+    """Identity of the input files: changes whenever their contents might"""
+    if isinstance(paths, (str, os.PathLike)):
+        paths = [paths]
+    identity = []
+    for path in paths:
+        st = os.stat(path)
+        identity.append([os.path.realpath(path), st.st_size, st.st_mtime_ns])
+    return identity
+
+
+def job_key(input_paths, params):
+    """Hash of the input identity and every parameter that affects the output"""
+    payload = json.dumps({'input': input_identity(input_paths), 'params': params},
+                         sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class JobManifest:
+    """Checkpoint state for one conversion, stored at <output>.job.json
+
+    A manifest whose key does not match the current input and parameters is
+    discarded, so a rerun only resumes when it would produce the same output.
+    """
+
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+        self.stages = {}
+        self.blocks = set()
+        self.resumed = False
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') == MANIFEST_VERSION and data.get('key') == key:
+            self.stages = data.get('stages', {})
+            self.blocks = {tuple(b) for b in data.get('blocks', [])}
+            self.resumed = bool(self.stages or self.blocks)
+
+    @classmethod
+    def for_output(cls, output_path, input_paths, params):
+        return cls(output_path + '.job.json', job_key(input_paths, params))
+
+    @property
+    def work_dir(self):
+        """Persistent scratch directory for stage outputs of this job"""
+        return os.path.splitext(self.path)[0] + '.work'
+
+    def stage_done(self, name):
+        info = self.stages.get(name)
+        if info is None:
+            return False
+        # A stage that produced a file is only done if the file survived
+        output = info.get('output')
+        return output is None or os.path.exists(output)
+
+    def complete_stage(self, name, output=None):
+        self.stages[name] = {'output': output}
+        self.save()
+
+    def block_done(self, block):
+        return tuple(block) in self.blocks
+
+    def complete_blocks(self, blocks):
+        self.blocks.update(tuple(b) for b in blocks)
+        self.save()
+
+    def reset(self):
+        self.stages = {}
+        self.blocks = set()
+        self.resumed = False
+
+    def save(self):
+        """Write the manifest atomically so a crash never leaves it torn"""
+        tmp = self.path + '.tmp'
+        data = {
+            'version': MANIFEST_VERSION,
+            'key': self.key,
+            'stages': self.stages,
+            'blocks': sorted(self.blocks),
+        }
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def discard(self):
+        """Remove the manifest and work directory after a successful run"""
+        for path in (self.path, self.path + '.tmp'):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        shutil.rmtree(self.work_dir, ignore_errors=True)
@@ -0,0 +1,693 @@
+"""
+Headless command line interface
+Usage: hillshade-converter convert INPUT OUTPUT.mbtiles|OUTPUT.pmtiles [options]
+       hillshade-converter preview INPUT OUTPUT.png [options]
+       hillshade-converter pmtiles INPUT.mbtiles OUTPUT.pmtiles
+       hillshade-converter inspect INPUT.mbtiles [--finalize] [--vacuum]
+       hillshade-converter serve INPUT [--port PORT] [--seed W,S,E,N] [options]
+       hillshade-converter queue add|list|cancel|remove|clear|run ...
+       hillshade-converter cache info|clear|limit ...
+       hillshade-converter tune show|set|reset|calibrate ...
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from dataclasses import asdict
+
+from hillshade import (discovery, encoding, gdalprofile, mbtiles, pipeline, pmtiles, stagecache,
+                       userdirs)
+from hillshade.lazy import lazy_import
+from hillshade.progress import format_update
+
+engine = lazy_import('hillshade.engine')
+tileserver = lazy_import('hillshade.tileserver')
+
+COMMANDS = ('convert', 'update', 'queue', 'cache', 'tune', 'inspect', 'serve', 'preview',
+            'pmtiles')
+
+# Exit codes
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_INPUT_NOT_FOUND = 3
+EXIT_PERMISSION = 4
+EXIT_INTERRUPTED = 130
+
+
+class Reporter:
+    """Emit log and progress either as text or as JSON lines on stdout"""
+
+    def __init__(self, json_mode=False, quiet=False, stream=None):
+        self.json_mode = json_mode
+        self.quiet = quiet
+        self.stream = stream or sys.stdout
+        self._last_percent = None
+
+    def emit(self, event, **fields):
+        fields = dict(event=event, time=round(time.time(), 3), **fields)
+        self.stream.write(json.dumps(fields) + '\n')
+        self.stream.flush()
+
+    def log(self, message):
+        if self.json_mode:
+            for line in message.strip('\n').split('\n'):
+                if line:
+                    self.emit('log', message=line)
+        elif not self.quiet:
+            print(message, file=self.stream, flush=True)
+
+    def progress(self, percent):
+        # Whole percent steps are plenty for a pipeline that runs for minutes
+        percent = int(percent)
+        if percent == self._last_percent:
+            return
+        self._last_percent = percent
+        if self.json_mode:
+            self.emit('progress', percent=percent)
+
+    def status(self, update):
+        """Stage throughput and ETA (a progress.ProgressUpdate)"""
+        if self.json_mode:
+            self.emit('status', stage=update.stage,
+                      percent=round(update.percent, 1),
+                      stage_percent=round(update.stage_percent, 1),
+                      rate=None if update.rate is None else round(update.rate, 3),
+                      unit=update.unit,
+                      eta=None if update.eta is None else round(update.eta, 1))
+        elif not self.quiet and sys.stderr.isatty():
+            # Overwritten in place; interleaved log lines simply push it down
+            print(f"\r{format_update(update):<60}", end='', file=sys.stderr, flush=True)
+
+    def result(self, **fields):
+        if self.json_mode:
+            self.emit('result', **fields)
+
+    def error(self, message, exit_code):
+        if self.json_mode:
+            self.emit('error', message=message, exit_code=exit_code)
+        else:
+            print(f"ERROR: {message}", file=sys.stderr, flush=True)
+
+
+def add_shading_arguments(parser):
+    defaults = pipeline.ConversionOptions()
+    parser.add_argument('-z', '--z-factor', type=float, default=defaults.z_factor,
+                        help="vertical exaggeration (default: %(default)s)")
+    parser.add_argument('--azimuth', type=float, default=defaults.azimuth,
+                        help="light direction in degrees (default: %(default)s)")
+    parser.add_argument('--altitude', type=float, default=defaults.altitude,
+                        help="light angle above the horizon (default: %(default)s)")
+    parser.add_argument('--light', type=light_source, action='append', dest='lights',
+                        metavar='AZ[,ALT[,WEIGHT]]',
+                        help="add a weighted light; repeat to blend several (replaces "
+                             "--azimuth, ALT defaults to --altitude, WEIGHT to 1)")
+    parser.add_argument('--multidirectional', action='store_true',
+                        help="blend four lights from 225 to 360 degrees at --altitude")
+    parser.add_argument('--slope-weight', type=float, default=defaults.slope_weight,
+                        metavar='WEIGHT',
+                        help="blend in slope shading with this weight (default: %(default)s)")
+
+
+def light_source(text):
+    """AZ[,ALT[,WEIGHT]] -> [azimuth, altitude or None, weight]"""
+    parts = text.split(',')
+    try:
+        if not 1 <= len(parts) <= 3:
+            raise ValueError
+        azimuth = float(parts[0])
+        altitude = float(parts[1]) if len(parts) > 1 and parts[1] else None
+        weight = float(parts[2]) if len(parts) > 2 else 1.0
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid light {text!r} (expected AZ[,ALT[,WEIGHT]])")
+    return [azimuth, altitude, weight]
+
+
+def add_output_arguments(parser, default=False):
+    # Accepted before or after the subcommand; SUPPRESS keeps the subcommand
+    # parser from overwriting a value given before it
+    parser.add_argument('--json', action='store_true', default=default,
+                        help="write JSON lines (log/progress/result/error) to stdout")
+    parser.add_argument('-q', '--quiet', action='store_true', default=default,
+                        help="suppress log output in text mode")
+
+
+def memory_size(text):
+    try:
+        return pipeline.parse_memory(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def tile_format(text):
+    try:
+        return encoding.spec(encoding.parse_encoding(text))
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def positive_int(text):
+    try:
+        value = int(text)
+        if value < 1:
+            raise ValueError
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected a positive whole number, got {text!r}")
+    return value
+
+
+def auto_or(parse):
+    """Argument type accepting 'auto' (returned as is) besides what parse accepts"""
+    def parse_setting(text):
+        return 'auto' if text.strip().lower() == 'auto' else parse(text)
+    return parse_setting
+
+
+def add_gdal_arguments(parser, saved=False):
+    """GDAL performance settings; saved=True for `tune set`, where 'auto' clears one"""
+    memory, count = (auto_or(memory_size), auto_or(positive_int)) if saved else \
+        (memory_size, positive_int)
+    scope = "saved for later runs; 'auto' reverts" if saved else \
+        "this run only; default: the saved or detected profile"
+    parser.add_argument('--gdal-cache', type=memory, default=None, metavar='SIZE',
+                        help=f"GDAL block cache (GDAL_CACHEMAX), e.g. 2G ({scope})")
+    parser.add_argument('--gdal-threads', type=count, default=None, metavar='N',
+                        help=f"threads for GDAL compression and warping ({scope})")
+    parser.add_argument('--warp-memory', type=memory, default=None, metavar='SIZE',
+                        help=f"gdalwarp working memory (-wm), e.g. 512M ({scope})")
+
+
+def page_size(text):
+    try:
+        size = int(text)
+    except ValueError:
+        size = 0
+    if size not in mbtiles.PAGE_SIZES:
+        raise argparse.ArgumentTypeError(
+            f"Invalid page size {text!r} (expected a power of two from 512 to 65536)")
+    return size
+
+
+def add_finalize_arguments(parser):
+    parser.add_argument('--vacuum', action='store_true',
+                        help="rewrite the finished MBTiles compactly (needs free space "
+                             "for a second copy)")
+    parser.add_argument('--page-size', type=page_size, default=None, metavar='BYTES',
+                        help="SQLite page size to VACUUM to, e.g. 65536 (implies --vacuum)")
+
+
+def lonlat_bbox(text):
+    """WEST,SOUTH,EAST,NORTH in degrees"""
+    try:
+        values = [float(v) for v in text.split(',')]
+        if len(values) != 4 or values[0] >= values[2] or values[1] >= values[3]:
+            raise ValueError
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"Invalid bounding box {text!r} (expected WEST,SOUTH,EAST,NORTH)")
+    return tuple(values)
+
+
+def add_conversion_arguments(parser):
+    """Zoom, mode and output options of `convert` (and `queue add`)"""
+    defaults = pipeline.ConversionOptions()
+    parser.add_argument('--min-zoom', type=int, default=defaults.min_zoom)
+    parser.add_argument('--max-zoom', type=int, default=defaults.max_zoom)
+    parser.add_argument('--staged', action='store_true',
+                        help="write full-size intermediate GeoTIFFs instead of streaming")
+    parser.add_argument('--gdal-tiler', action='store_true',
+                        help="tile with GDAL's MBTiles driver instead of the built-in tiler")
+    parser.add_argument('--no-coverage-index', action='store_true',
+                        help="tile the whole bounding box instead of skipping tiles "
+                             "the DEM's nodata mask shows are empty")
+    parser.add_argument('--no-resume', action='store_true',
+                        help="do not checkpoint progress or resume a previous run")
+    parser.add_argument('--no-stage-cache', action='store_true',
+                        help="neither reuse nor keep intermediate rasters in the stage cache")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="tiler worker processes (default: one per core)")
+    parser.add_argument('--max-memory', type=memory_size, default=None, metavar='SIZE',
+                        help="cap peak memory, e.g. 2G or 512M; large DEMs are "
+                             "processed in strips and blocks that fit")
+    parser.add_argument('--tile-format', type=tile_format, default=defaults.tile_format,
+                        metavar='FORMAT',
+                        help="png[:ZLIB_LEVEL], webp (lossless), webp:QUALITY or "
+                             "jpeg[:QUALITY] (default: %(default)s)")
+    add_gdal_arguments(parser)
+    add_finalize_arguments(parser)
+    parser.add_argument('--profile', action='store_true',
+                        help="profile the in-process work with cProfile into OUTPUT.pstats")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='hillshade-converter',
+        description="Convert GeoTIFF DEMs to hillshade MBTiles without the GUI.")
+    add_output_arguments(parser)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    defaults = pipeline.ConversionOptions()
+    conv = sub.add_parser('convert', help="convert a DEM, folder or glob to MBTiles")
+    add_output_arguments(conv, default=argparse.SUPPRESS)
+    conv.add_argument('input', help="DEM file, folder of DEM tiles, or glob")
+    conv.add_argument('output', help="output .mbtiles or .pmtiles path")
+    add_shading_arguments(conv)
+    add_conversion_arguments(conv)
+
+    upd = sub.add_parser('update', help="re-render the part of an existing MBTiles "
+                                        "that a changed DEM region touches")
+    add_output_arguments(upd, default=argparse.SUPPRESS)
+    upd.add_argument('input', help="the current DEM file, folder of DEM tiles, or glob")
+    upd.add_argument('output', help="existing .mbtiles path, updated in place")
+    change = upd.add_mutually_exclusive_group(required=True)
+    change.add_argument('--region', metavar='DEM',
+                        help="the changed DEM file, folder or glob; each file's "
+                             "footprint is updated")
+    change.add_argument('--bbox', type=lonlat_bbox, metavar='W,S,E,N',
+                        help="changed area in degrees")
+    add_shading_arguments(upd)
+    upd.add_argument('--workers', type=int, default=None,
+                     help="tiler worker processes (default: one per core)")
+    upd.add_argument('--max-memory', type=memory_size, default=None, metavar='SIZE',
+                     help="cap peak memory, e.g. 2G or 512M; blocks, workers and "
+                          "GDAL caches are sized to fit")
+    upd.add_argument('--tile-format', type=tile_format, default=defaults.tile_format,
+                     metavar='FORMAT',
+                     help="quality or zlib level for the updated tiles; the format "
+                          "always follows the existing file (default: %(default)s)")
+    add_gdal_arguments(upd)
+
+    que = sub.add_parser('queue', help="queue conversions and run them concurrently")
+    add_output_arguments(que, default=argparse.SUPPRESS)
+    actions = que.add_subparsers(dest='action', required=True)
+    add = actions.add_parser('add', help="queue a conversion")
+    add.add_argument('input', help="DEM file, folder of DEM tiles, or glob")
+    add.add_argument('output', help="output .mbtiles or .pmtiles path")
+    add.add_argument('--priority', type=int, default=0,
+                     help="higher runs first (default: %(default)s)")
+    add_shading_arguments(add)
+    add_conversion_arguments(add)
+    actions.add_parser('list', help="show queued, running and finished jobs")
+    for action, text in (('cancel', "cancel queued or running jobs"),
+                         ('remove', "remove queued or finished jobs")):
+        actions.add_parser(action, help=text).add_argument('ids', nargs='+', metavar='ID')
+    actions.add_parser('clear', help="remove finished jobs")
+    run_queue = actions.add_parser('run', help="run queued jobs until none are left")
+    run_queue.add_argument('--cores', type=int, default=None,
+                           help="cores shared by all jobs (default: all; saved for later runs)")
+    run_queue.add_argument('--max-memory', type=memory_size, default=None, metavar='SIZE',
+                           help="memory shared by all jobs (default: 75%% of RAM; saved)")
+    run_queue.add_argument('--max-scratch', type=memory_size, default=None, metavar='SIZE',
+                           help="disk space for outputs and intermediates (saved)")
+
+    cache = sub.add_parser('cache', help="inspect or clear the cache of intermediate rasters")
+    add_output_arguments(cache, default=argparse.SUPPRESS)
+    cache_actions = cache.add_subparsers(dest='action', required=True)
+    cache_actions.add_parser('info', help="show the cache location, size and entries")
+    cache_actions.add_parser('clear', help="remove every entry not in use")
+    limit = cache_actions.add_parser('limit', help="set the cache size cap (saved)")
+    limit.add_argument('size', type=memory_size, metavar='SIZE', help="e.g. 50G")
+
+    srv = sub.add_parser('serve', help="render tiles on demand and serve them on localhost")
+    add_output_arguments(srv, default=argparse.SUPPRESS)
+    srv.add_argument('input', help="DEM file, folder of DEM tiles, or glob")
+    srv.add_argument('--port', type=int, default=None,
+                     help="port on 127.0.0.1 (default: 8765; 0 picks a free one)")
+    add_shading_arguments(srv)
+    srv.add_argument('--min-zoom', type=int, default=0)
+    srv.add_argument('--max-zoom', type=int, default=defaults.max_zoom)
+    srv.add_argument('--tile-format', type=tile_format, default=defaults.tile_format,
+                     metavar='FORMAT', help="as for convert (default: %(default)s)")
+    srv.add_argument('--workers', type=int, default=None,
+                     help="render processes (default: one per core)")
+    srv.add_argument('--memory-cache', type=memory_size, default=None, metavar='SIZE',
+                     help="in-memory tile cache (default: 256M)")
+    srv.add_argument('--seed', type=lonlat_bbox, action='append', metavar='W,S,E,N',
+                     help="render this area in the background; repeat for several")
+    srv.add_argument('--seed-zooms', metavar='MIN-MAX', default=None,
+                     help="zoom levels to seed (default: all served)")
+
+    tune = sub.add_parser('tune', help="show, override or calibrate the GDAL performance "
+                                       "profile (block cache, threads, warp memory)")
+    add_output_arguments(tune, default=argparse.SUPPRESS)
+    tune_actions = tune.add_subparsers(dest='action', required=True)
+    tune_actions.add_parser('show', help="show the machine and the profile conversions use")
+    add_gdal_arguments(tune_actions.add_parser('set', help="save overrides of the profile"),
+                       saved=True)
+    tune_actions.add_parser('reset', help="forget the overrides and the calibration")
+    calibrate = tune_actions.add_parser('calibrate', help="time a test warp with different "
+                                                          "settings and keep the fastest")
+    calibrate.add_argument('--scratch', default=None, metavar='DIR',
+                           help="directory on the disk conversions use (default: temp)")
+    calibrate.add_argument('--size', type=positive_int, default=gdalprofile.CALIBRATION_SIZE,
+                           help="test raster width and height (default: %(default)s)")
+
+    prev = sub.add_parser('preview', help="render a decimated preview PNG")
+    add_output_arguments(prev, default=argparse.SUPPRESS)
+    prev.add_argument('input', help="DEM file, folder of DEM tiles, or glob")
+    prev.add_argument('output', help="output .png path")
+    add_shading_arguments(prev)
+    prev.add_argument('--no-stage-cache', action='store_true',
+                      help="do not keep a full-resolution preview for the next conversion")
+    prev.add_argument('--size', type=int, default=pipeline.PREVIEW_MAX_SIZE,
+                      help="longest edge of the preview in pixels (default: %(default)s)")
+
+    ins = sub.add_parser('inspect', help="report tiles, bytes, coverage and corrupt tiles "
+                                         "per zoom of an MBTiles file")
+    add_output_arguments(ins, default=argparse.SUPPRESS)
+    ins.add_argument('input', help="input .mbtiles path")
+    ins.add_argument('--finalize', action='store_true',
+                     help="first add the tile index, ANALYZE and complete the metadata")
+    ins.add_argument('--sizes', action='store_true',
+                     help="also sum tile bytes and find empty tiles (reads every tile)")
+    add_finalize_arguments(ins)
+
+    pmt = sub.add_parser('pmtiles', help="convert an existing MBTiles file to PMTiles")
+    add_output_arguments(pmt, default=argparse.SUPPRESS)
+    pmt.add_argument('input', help="input .mbtiles path")
+    pmt.add_argument('output', help="output .pmtiles path")
+    return parser
+
+
+def options_from_args(args):
+    options = pipeline.ConversionOptions(
+        z_factor=args.z_factor, azimuth=args.azimuth, altitude=args.altitude,
+        slope_weight=args.slope_weight)
+    lights = [(az, args.altitude if alt is None else alt, weight)
+              for az, alt, weight in args.lights or ()]
+    if args.multidirectional:
+        lights += engine.multidirectional_lights(args.altitude)
+    options.lights = lights or None
+    if args.command in ('convert', 'queue'):
+        options.min_zoom = args.min_zoom
+        options.max_zoom = args.max_zoom
+        options.stream = not args.staged
+        options.native_tiler = not args.gdal_tiler
+        options.coverage_index = not args.no_coverage_index
+        options.resumable = not args.no_resume
+        options.stage_cache = not args.no_stage_cache
+        options.workers = args.workers
+        options.max_memory = args.max_memory
+        options.profile = args.profile
+        options.tile_format = args.tile_format
+        options.gdal_cache = args.gdal_cache
+        options.gdal_threads = args.gdal_threads
+        options.warp_memory = args.warp_memory
+        options.vacuum = args.vacuum
+        options.page_size = args.page_size
+    elif args.command == 'update':
+        options.workers = args.workers
+        options.max_memory = args.max_memory
+        options.tile_format = args.tile_format
+        options.gdal_cache = args.gdal_cache
+        options.gdal_threads = args.gdal_threads
+        options.warp_memory = args.warp_memory
+    elif args.command == 'serve':
+        options.min_zoom = args.min_zoom
+        options.max_zoom = args.max_zoom
+        options.workers = args.workers
+        options.tile_format = args.tile_format
+    elif args.command == 'preview':
+        options.stage_cache = not args.no_stage_cache
+    return options
+
+
+def convert_arguments(input_spec, output_path, options):
+    """`convert` arguments reproducing options; the inverse of options_from_args"""
+    args = ['convert', input_spec, output_path,
+            '--z-factor', repr(options.z_factor),
+            '--azimuth', repr(options.azimuth),
+            '--altitude', repr(options.altitude),
+            '--slope-weight', repr(options.slope_weight),
+            '--min-zoom', str(options.min_zoom),
+            '--max-zoom', str(options.max_zoom),
+            '--tile-format', options.tile_format]
+    for azimuth, altitude, weight in options.lights or ():
+        args += ['--light', f'{azimuth!r},{altitude!r},{weight!r}']
+    if not options.stream:
+        args.append('--staged')
+    if not options.native_tiler:
+        args.append('--gdal-tiler')
+    if not options.coverage_index:
+        args.append('--no-coverage-index')
+    if not options.resumable:
+        args.append('--no-resume')
+    if not options.stage_cache:
+        args.append('--no-stage-cache')
+    if options.workers:
+        args += ['--workers', str(options.workers)]
+    if options.max_memory:
+        args += ['--max-memory', str(options.max_memory)]
+    if options.gdal_cache:
+        args += ['--gdal-cache', str(options.gdal_cache)]
+    if options.gdal_threads:
+        args += ['--gdal-threads', str(options.gdal_threads)]
+    if options.warp_memory:
+        args += ['--warp-memory', str(options.warp_memory)]
+    if options.vacuum:
+        args.append('--vacuum')
+    if options.page_size:
+        args += ['--page-size', str(options.page_size)]
+    if options.profile:
+        args.append('--profile')
+    return args
+
+
+def convert_pmtiles(args, reporter):
+    if not os.path.isfile(args.input):
+        raise FileNotFoundError(f"MBTiles file not found: {args.input}")
+    pipeline.check_output_location(args.output, reporter.log)
+    started = time.time()
+    tiles = pmtiles.mbtiles_to_pmtiles(args.input, args.output, log=reporter.log,
+                                       progress=reporter.progress)
+    reporter.log(f"PMTiles written to: {args.output}")
+    reporter.result(output=args.output, tiles=tiles, bytes=os.path.getsize(args.output),
+                    elapsed=round(time.time() - started, 3))
+
+
+def run_queue(args, reporter):
+    from hillshade import jobqueue
+    queue = jobqueue.JobQueue()
+    if args.action == 'add':
+        job = queue.add(args.input, args.output, options_from_args(args), args.priority)
+        reporter.log(f"Queued job {job.id}: {job.input} -> {job.output}")
+        reporter.result(id=job.id)
+    elif args.action == 'list':
+        jobs = queue.jobs()
+        for job in jobs:
+            reporter.log(f"{job.id}  {job.state:<9}  priority {job.priority:<3}  "
+                         f"{job.input} -> {job.output}"
+                         + (f"  ({job.error})" if job.error else ""))
+        reporter.result(jobs=[asdict(job) for job in jobs])
+    elif args.action == 'cancel':
+        for job_id in args.ids:
+            job = queue.cancel(job_id)
+            reporter.log(f"Job {job_id}: {'cancelling' if job.cancel_requested else job.state}")
+    elif args.action == 'remove':
+        queue.remove(set(args.ids))
+    elif args.action == 'clear':
+        queue.clear_finished()
+    else:
+        limits = {name: value for name, value in (('cores', args.cores),
+                                                  ('memory', args.max_memory),
+                                                  ('scratch', args.max_scratch))
+                  if value is not None}
+        if limits:
+            queue.set_limits(**limits)
+        started = time.time()
+        scheduler = jobqueue.Scheduler(queue, log=reporter.log)
+        scheduler.start()
+        try:
+            scheduler.wait()
+        finally:
+            scheduler.shutdown()
+        jobs = queue.jobs()
+        failed = [job.id for job in jobs
+                  if job.state == jobqueue.FAILED and job.finished >= started]
+        reporter.result(jobs=[asdict(job) for job in jobs])
+        if failed:
+            raise RuntimeError(f"{len(failed)} job(s) failed: {', '.join(failed)}")
+
+
+def run_cache(args, reporter):
+    cache = stagecache.StageCache()
+    if args.action == 'clear':
+        freed = cache.clear()
+        reporter.log(f"Removed {freed / (1 << 20):.1f} MB from {cache.root}")
+        reporter.result(freed=freed)
+        return
+    if args.action == 'limit':
+        freed = cache.set_max_bytes(args.size)
+        reporter.log(f"Cache size cap set to {args.size / (1 << 30):.1f} GB"
+                     + (f"; removed {freed / (1 << 20):.1f} MB" if freed else ""))
+    entries = cache.entries()
+    total = sum(size for _, size, _, _ in entries)
+    reporter.log(f"{cache.root}: {len(entries)} entries, {total / (1 << 20):.1f} MB "
+                 f"of {cache.max_bytes / (1 << 30):.1f} GB")
+    for key, size, used, leased in reversed(entries):
+        stage = userdirs.read_json(os.path.join(cache.root, key, stagecache.ENTRY_FILE),
+                                   {}).get('stage', '?')
+        reporter.log(f"{key[:12]}  {stage:<9}  {size / (1 << 20):9.1f} MB  "
+                     f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(used))}"
+                     + ("  (in use)" if leased else ""))
+    reporter.result(root=cache.root, bytes=total, max_bytes=cache.max_bytes,
+                    entries=len(entries))
+
+
+def run_tune(args, reporter):
+    if args.action == 'reset':
+        gdalprofile.reset()
+        reporter.log("GDAL profile overrides and calibration removed")
+    elif args.action == 'set':
+        values = {name: (None if value == 'auto' else value) for name, value in (
+            ('cache_max', args.gdal_cache), ('threads', args.gdal_threads),
+            ('warp_memory', args.warp_memory)) if value is not None}
+        if not values:
+            raise ValueError("Nothing to set: give --gdal-cache, --gdal-threads "
+                             "and/or --warp-memory")
+        gdalprofile.save_overrides(**values)
+    elif args.action == 'calibrate':
+        gdalprofile.calibrate(args.scratch, args.size, log=reporter.log,
+                              progress=reporter.progress)
+    summary = gdalprofile.summary()
+    machine = gdalprofile.Machine(**summary['machine'])
+    profile = gdalprofile.GdalProfile(**summary['profile'])
+    reporter.log(f"Machine: {machine.describe()}")
+    reporter.log(f"Profile: {profile.describe()}")
+    if summary['overrides']:
+        reporter.log("Overrides: " + ', '.join(f"{name}={value}" for name, value
+                                               in sorted(summary['overrides'].items())))
+    calibrated = summary['calibrated']
+    if calibrated:
+        when = time.strftime('%Y-%m-%d %H:%M', time.localtime(calibrated['time']))
+        reporter.log(f"Calibrated {when} on {calibrated['cores']} cores: "
+                     f"{calibrated['seconds']} s per test warp")
+    reporter.log(f"Settings file: {gdalprofile.profile_path()}")
+    reporter.result(**summary)
+
+
+def run_serve(args, options, reporter):
+    if args.seed_zooms is not None:
+        try:
+            seed_zooms = tileserver.parse_zooms(args.seed_zooms)
+        except ValueError as e:
+            raise ValueError(f"--seed-zooms: {e}")
+    else:
+        seed_zooms = (None, None)
+    runner = pipeline.Pipeline(log=reporter.log)
+    service = runner.tile_service(args.input, options, memory_bytes=args.memory_cache)
+    port = tileserver.DEFAULT_PORT if args.port is None else args.port
+    try:
+        server = tileserver.TileServer(service, port)
+    except BaseException:
+        service.close()
+        raise
+    try:
+        # Seeding runs one area at a time; later areas wait for the earlier ones
+        if args.seed:
+            areas = list(args.seed)
+
+            def seed_areas():
+                for area in areas:
+                    seeding = service.seed(area, *seed_zooms)
+                    while seeding.finished is None:
+                        time.sleep(0.5)
+                    if seeding.cancel.is_set():
+                        return
+
+            threading.Thread(target=seed_areas, daemon=True).start()
+        reporter.log(f"Serving tiles at {server.url}/{{z}}/{{x}}/{{y}}."
+                     f"{service.tile_encoding.format} (TileJSON: {server.url}/tilejson.json); "
+                     "Ctrl-C stops")
+        reporter.result(url=server.url, tilejson=f'{server.url}/tilejson.json',
+                        cache=service.disk.path)
+        server.serve_forever()
+    finally:
+        server.stop()
+        status = service.status()
+        reporter.log(f"Served {status['requests']} tile requests ({status['memory_hits']} from "
+                     f"memory); {status['rendered']} tiles rendered, {status['disk_hits']} "
+                     "read from the tile cache")
+
+
+def run(args, reporter):
+    if args.command == 'pmtiles':
+        convert_pmtiles(args, reporter)
+        return
+    if args.command == 'queue':
+        run_queue(args, reporter)
+        return
+    if args.command == 'cache':
+        run_cache(args, reporter)
+        return
+    if args.command == 'tune':
+        run_tune(args, reporter)
+        return
+    if args.command == 'inspect':
+        options = None
+        if args.finalize or args.vacuum or args.page_size:
+            options = pipeline.ConversionOptions(vacuum=args.vacuum, page_size=args.page_size)
+        summary = pipeline.Pipeline(log=reporter.log).inspect(args.input, options, args.sizes)
+        reporter.result(**summary)
+        return
+    options = options_from_args(args)
+    if not engine.is_available():
+        # The fallback shells out to gdaldem & co; find them like the GUI does
+        discovery.ensure_gdal_cli()
+    if args.command == 'serve':
+        run_serve(args, options, reporter)
+        return
+    runner = pipeline.Pipeline(log=reporter.log, progress=reporter.progress,
+                               status=reporter.status)
+    if args.command == 'convert':
+        started = time.time()
+        summary = runner.convert(args.input, args.output, options)
+        reporter.result(elapsed=round(time.time() - started, 3), **summary)
+    elif args.command == 'update':
+        started = time.time()
+        summary = runner.update(args.input, args.output, options,
+                                region=args.region, bbox=args.bbox)
+        reporter.result(elapsed=round(time.time() - started, 3), **summary)
+    else:
+        from PIL import Image
+        shaded = None
+        full_size = None
+        for _, _, shaded, full_size in runner.preview(
+                args.input, options, display_size=args.size, max_size=args.size):
+            pass
+        Image.fromarray(shaded, mode='L').save(args.output, format='PNG')
+        reporter.log(f"Preview written to: {args.output}")
+        reporter.result(output=args.output, size=list(shaded.shape[::-1]),
+                        source_size=list(full_size))
+
+
+def main(argv=None):
+    """Entry point of the `hillshade-converter` command; returns an exit code"""
+    parser = build_parser()
+    try:
+        args = parser.parse_args(argv)
+    except SystemExit as e:
+        return EXIT_USAGE if e.code else EXIT_OK
+    reporter = Reporter(json_mode=args.json, quiet=args.quiet)
+    try:
+        run(args, reporter)
+        return EXIT_OK
+    except KeyboardInterrupt:
+        reporter.error("Interrupted", EXIT_INTERRUPTED)
+        return EXIT_INTERRUPTED
+    except FileNotFoundError as e:
+        reporter.error(str(e), EXIT_INPUT_NOT_FOUND)
+        return EXIT_INPUT_NOT_FOUND
+    except PermissionError as e:
+        reporter.error(str(e), EXIT_PERMISSION)
+        return EXIT_PERMISSION
+    except Exception as e:
+        reporter.error(str(e), EXIT_FAILED)
+        return EXIT_FAILED
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,179 @@
+"""
+Coverage index
+Per-zoom bitmaps of the XYZ tiles that can contain data, built once from a
+low-resolution read of the DEM's validity mask (nodata, alpha or mask band)
+so the tiler never warps or encodes blocks that are all nodata
+"""
+
+import math
+import os
+
+import numpy as np
+
+from hillshade import engine, mbtiles
+from hillshade.tiler import (SOURCE_MARGIN, WEB_MERCATOR_HALF, _srs, mercator_bounds,
+                             tile_range, tile_span)
+
+# Mask cells per max-zoom tile edge; finer cells make a tighter index
+CELLS_PER_TILE = 2
+# Cap on mask cells read (and cell corners reprojected)
+MAX_CELLS = 1 << 20
+
+
+class CoverageIndex:
+    """Tile bitmaps for min_zoom..max_zoom
+
+    masks maps zoom to (x0, y0, bool array indexed [y - y0, x - x0]). The
+    index is conservative: a tile it marks may still render empty, but a
+    tile it leaves out has no valid source pixel within the bilinear and
+    hillshade halo.
+    """
+
+    def __init__(self, masks, valid_fraction=1.0):
+        self.masks = masks
+        self.valid_fraction = valid_fraction
+
+    @property
+    def min_zoom(self):
+        return min(self.masks)
+
+    @property
+    def max_zoom(self):
+        return max(self.masks)
+
+    def count(self, zoom):
+        return int(self.masks[zoom][2].sum())
+
+    def counts(self):
+        return {z: self.count(z) for z in sorted(self.masks)}
+
+    def box_count(self, zoom):
+        """Tiles in the bounding box the tiler would otherwise cover"""
+        return self.masks[zoom][2].size
+
+    def contains(self, zoom, x, y):
+        x0, y0, mask = self.masks[zoom]
+        return (0 <= y - y0 < mask.shape[0] and 0 <= x - x0 < mask.shape[1]
+                and bool(mask[y - y0, x - x0]))
+
+    def extent(self, zoom, x0, y0, x1, y1):
+        """Inclusive (x0, y0, x1, y1) of the indexed tiles in a range, or None"""
+        ox, oy, mask = self.masks[zoom]
+        cx0, cy0 = max(x0 - ox, 0), max(y0 - oy, 0)
+        window = mask[cy0:max(y1 - oy + 1, 0), cx0:max(x1 - ox + 1, 0)]
+        if not window.any():
+            return None
+        rows = np.flatnonzero(window.any(axis=1))
+        cols = np.flatnonzero(window.any(axis=0))
+        return (ox + cx0 + int(cols[0]), oy + cy0 + int(rows[0]),
+                ox + cx0 + int(cols[-1]), oy + cy0 + int(rows[-1]))
+
+    def compare(self, conn):
+        """Per zoom: tiles indexed, tiles written, and written tiles outside the index"""
+        table = 'map' if mbtiles.has_dedup_schema(conn) else 'tiles'
+        result = {}
+        for zoom in sorted(self.masks):
+            ox, oy, mask = self.masks[zoom]
+            rows = np.array(conn.execute(
+                f"SELECT tile_column, tile_row FROM {table} WHERE zoom_level = ?",
+                (zoom,)).fetchall(), dtype=np.int64).reshape(-1, 2)
+            xs = rows[:, 0] - ox
+            ys = (1 << zoom) - 1 - rows[:, 1] - oy  # TMS rows
+            inside = (xs >= 0) & (ys >= 0) & (xs < mask.shape[1]) & (ys < mask.shape[0])
+            inside[inside] = mask[ys[inside], xs[inside]]
+            result[zoom] = {'indexed': self.count(zoom), 'written': len(rows),
+                            'outside': int(len(rows) - inside.sum())}
+        return result
+
+
+def _reduce(x0, y0, mask):
+    """Parent-zoom bitmap of a tile bitmap"""
+    pad_left, pad_top = x0 % 2, y0 % 2
+    width, height = mask.shape[1] + pad_left, mask.shape[0] + pad_top
+    padded = np.zeros((height + height % 2, width + width % 2), bool)
+    padded[pad_top:pad_top + mask.shape[0], pad_left:pad_left + mask.shape[1]] = mask
+    parent = padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2).any(axis=(1, 3))
+    return x0 // 2, y0 // 2, parent
+
+
+def _cell_grid(ds, max_zoom, bounds):
+    """Mask read size (columns, rows) giving about CELLS_PER_TILE cells per tile"""
+    width, height = ds.RasterXSize, ds.RasterYSize
+    pixel = (bounds[2] - bounds[0]) / float(width)
+    pixels_per_cell = max(1.0, tile_span(max_zoom) / CELLS_PER_TILE / pixel)
+    columns = max(1, int(math.ceil(width / pixels_per_cell)))
+    rows = max(1, int(math.ceil(height / pixels_per_cell)))
+    if columns * rows > MAX_CELLS:
+        shrink = math.sqrt(columns * rows / float(MAX_CELLS))
+        columns = max(1, int(columns / shrink))
+        rows = max(1, int(rows / shrink))
+    return columns, rows
+
+
+def _read_valid(ds, columns, rows):
+    """(rows, columns) bool array: True where a cell holds any valid pixel"""
+    gdal = engine.require_gdal()
+    band = ds.GetRasterBand(1)
+    if band.GetMaskFlags() & gdal.GMF_ALL_VALID:
+        return np.ones((rows, columns), bool)
+    # Averaged as Float32 so a single valid pixel in a cell does not round away
+    fraction = band.GetMaskBand().ReadAsArray(
+        0, 0, ds.RasterXSize, ds.RasterYSize, buf_xsize=columns, buf_ysize=rows,
+        buf_type=gdal.GDT_Float32, resample_alg=gdal.GRIORA_Average)
+    return fraction > 0
+
+
+def _cell_corners(ds, columns, rows):
+    """Web Mercator x, y of the (rows + 1, columns + 1) cell corners"""
+    from osgeo import osr
+    gt = ds.GetGeoTransform()
+    i = np.linspace(0, ds.RasterXSize, columns + 1)
+    j = np.linspace(0, ds.RasterYSize, rows + 1)
+    ii, jj = np.meshgrid(i, j)
+    xs = gt[0] + ii * gt[1] + jj * gt[2]
+    ys = gt[3] + ii * gt[4] + jj * gt[5]
+    transform = osr.CoordinateTransformation(_srs(ds.GetProjection()), _srs('EPSG:3857'))
+    points = transform.TransformPoints(np.column_stack([xs.ravel(), ys.ravel()]).tolist())
+    merc = np.array(points, dtype=np.float64)[:, :2].reshape(rows + 1, columns + 1, 2)
+    merc = np.where(np.isfinite(merc), merc, 0.0)
+    return (np.clip(merc[..., 0], -WEB_MERCATOR_HALF, WEB_MERCATOR_HALF),
+            np.clip(merc[..., 1], -WEB_MERCATOR_HALF, WEB_MERCATOR_HALF))
+
+
+def build_index(source_path, min_zoom, max_zoom):
+    """Coverage index of a DEM (or shaded raster) for a zoom range"""
+    gdal = engine.require_gdal()
+    ds = gdal.Open(os.fspath(source_path))
+    bounds, _ = mercator_bounds(source_path)
+    columns, rows = _cell_grid(ds, max_zoom, bounds)
+    valid = _read_valid(ds, columns, rows)
+    tx0, ty0, tx1, ty1 = tile_range(bounds, max_zoom)
+    mask = np.zeros((ty1 - ty0 + 1, tx1 - tx0 + 1), bool)
+    if valid.any():
+        xs, ys = _cell_corners(ds, columns, rows)
+        quad = lambda a, reduce: reduce(reduce(a[:-1, :-1], a[:-1, 1:]),
+                                        reduce(a[1:, :-1], a[1:, 1:]))[valid]
+        # Grow each cell by the source pixels a bilinear, Horn-windowed tile reads
+        margin = SOURCE_MARGIN * (bounds[2] - bounds[0]) / float(ds.RasterXSize)
+        span = tile_span(max_zoom)
+        col0 = np.floor((quad(xs, np.minimum) - margin + WEB_MERCATOR_HALF) / span)
+        col1 = np.floor((quad(xs, np.maximum) + margin + WEB_MERCATOR_HALF) / span)
+        row0 = np.floor((WEB_MERCATOR_HALF - quad(ys, np.maximum) - margin) / span)
+        row1 = np.floor((WEB_MERCATOR_HALF - quad(ys, np.minimum) + margin) / span)
+        height, width = mask.shape
+        col0 = np.clip(col0 - tx0, 0, width - 1).astype(np.int64)
+        col1 = np.clip(col1 - tx0, 0, width - 1).astype(np.int64)
+        row0 = np.clip(row0 - ty0, 0, height - 1).astype(np.int64)
+        row1 = np.clip(row1 - ty0, 0, height - 1).astype(np.int64)
+        # Paint every cell's tile rectangle at once with a 2-D difference array
+        paint = np.zeros((height + 1, width + 1), np.int32)
+        np.add.at(paint, (row0, col0), 1)
+        np.add.at(paint, (row0, col1 + 1), -1)
+        np.add.at(paint, (row1 + 1, col0), -1)
+        np.add.at(paint, (row1 + 1, col1 + 1), 1)
+        mask = paint.cumsum(axis=0).cumsum(axis=1)[:height, :width] > 0
+
+    masks = {max_zoom: (tx0, ty0, mask)}
+    for zoom in range(max_zoom - 1, min_zoom - 1, -1):
+        masks[zoom] = _reduce(*masks[zoom + 1])
+    return CoverageIndex(masks, float(valid.mean()))
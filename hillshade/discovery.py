@@ -0,0 +1,117 @@
+"""
+GDAL command line discovery
+Probing `gdaldem --version` costs a subprocess per candidate, so results are
+remembered on disk and only re-probed when the executable's path or mtime changes
+"""
+
+import os
+import shutil
+import subprocess
+from collections import namedtuple
+
+from hillshade import userdirs
+
+CACHE_VERSION = 1
+CACHE_FILE = 'gdal_discovery.json'
+
+# Common GDAL installation paths, system PATH last
+CANDIDATES = [
+    '/opt/homebrew/bin/gdaldem',  # Apple Silicon
+    '/usr/local/bin/gdaldem',     # Intel Mac
+    '/opt/homebrew/opt/gdal/bin/gdaldem',
+    '/usr/local/opt/gdal/bin/gdaldem',
+    'gdaldem',
+]
+
+GdalInstall = namedtuple('GdalInstall', ['path', 'version', 'cached'])
+
+
+def cache_path():
+    return os.path.join(userdirs.cache_dir(), CACHE_FILE)
+
+
+def _resolve(candidate):
+    """Absolute path of a candidate executable, or None if it does not exist"""
+    if os.path.isabs(candidate):
+        return candidate if os.path.isfile(candidate) else None
+    return shutil.which(candidate)
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def probe(path, timeout=5):
+    """Run `gdaldem --version`; return its version text, or None if unusable"""
+    try:
+        result = subprocess.run([path, '--version'],
+                                capture_output=True, text=True, timeout=timeout)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    # Check if output contains "GDAL" (check both stdout and stderr)
+    output = (result.stdout + result.stderr).strip()
+    if result.returncode in (0, 1) or "GDAL" in output:
+        return output or "GDAL"
+    return None
+
+
+def _load_cache():
+    data = userdirs.read_json(cache_path(), {})
+    if not isinstance(data, dict) or data.get('version') != CACHE_VERSION:
+        return {}
+    return data.get('entries', {})
+
+
+def _save_cache(entries):
+    try:
+        userdirs.write_json(cache_path(), {'version': CACHE_VERSION, 'entries': entries})
+    except OSError:
+        pass  # A read-only home directory only costs the next launch a probe
+
+
+def find_gdaldem(candidates=CANDIDATES, use_cache=True):
+    """Return the first working gdaldem as a GdalInstall, or None
+
+    Failed probes are cached too, so a broken install is not re-run on every
+    launch either; replacing or upgrading it changes the mtime and re-probes.
+    """
+    entries = _load_cache() if use_cache else {}
+    changed = False
+    found = None
+    for candidate in candidates:
+        path = _resolve(candidate)
+        if path is None:
+            continue
+        try:
+            stamp = _stamp(path)
+        except OSError:
+            continue
+        entry = entries.get(path)
+        cached = entry is not None and entry.get('stamp') == stamp
+        if not cached:
+            entry = {'stamp': stamp, 'version': probe(path)}
+            entries[path] = entry
+            changed = True
+        if entry['version'] is not None:
+            found = GdalInstall(path, entry['version'], cached)
+            break
+    if changed:
+        _save_cache(entries)
+    return found
+
+
+def add_to_path(path):
+    """Put the directory of an executable first on PATH for child processes"""
+    gdal_dir = os.path.dirname(os.path.abspath(path))
+    paths = os.environ.get('PATH', '').split(os.pathsep)
+    if gdal_dir not in paths:
+        os.environ['PATH'] = gdal_dir + os.pathsep + os.environ.get('PATH', '')
+
+
+def ensure_gdal_cli():
+    """Find gdaldem, make its directory visible on PATH and return the install"""
+    install = find_gdaldem()
+    if install is not None:
+        add_to_path(install.path)
+    return install
@@ -0,0 +1,462 @@
+"""
+In-process hillshade engine
+Vectorized NumPy port of `gdaldem hillshade` (Horn algorithm)
+"""
+
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+# Loaded by load_gdal() on first use; osgeo is slow to import and optional
+_gdal = None
+_gdal_checked = False
+_gdal_lock = threading.Lock()
+
+# gdaldem writes Byte output with 0 reserved for nodata
+HILLSHADE_NODATA = 0
+
+# Peak working set of compute_gradients + shade per DEM pixel: float32 input,
+# padded copy, nodata substitutes, x/y/inv_norm temporaries and Byte output
+WORKING_BYTES_PER_PIXEL = 64
+# Rows above and below a strip that the 3x3 Horn window needs
+HALO_ROWS = 1
+
+Dem = namedtuple('Dem', ['elevation', 'geotransform', 'projection', 'nodata'])
+
+# Per-pixel terms of the illumination equation that do not depend on the light:
+#   inv_norm = 1 / sqrt(1 + z^2 (x^2 + y^2)), px = z*x*inv_norm, py = z*y*inv_norm
+# valid is False wherever gdaldem would write nodata.
+Gradients = namedtuple('Gradients', ['inv_norm', 'px', 'py', 'valid'])
+
+# One weighted light of a blended hillshade (see shade)
+Light = namedtuple('Light', ['azimuth', 'altitude', 'weight'])
+
+# Azimuths of the multidirectional preset, spread around the usual north-west light
+MULTIDIRECTIONAL_AZIMUTHS = (225.0, 270.0, 315.0, 360.0)
+
+
+def load_gdal():
+    """Return the osgeo.gdal module, or None if the bindings are not installed"""
+    global _gdal, _gdal_checked
+    if not _gdal_checked:
+        with _gdal_lock:
+            if not _gdal_checked:
+                try:
+                    from osgeo import gdal
+                    gdal.UseExceptions()
+                    _gdal = gdal
+                except ImportError:  # Optional; callers fall back to the CLI
+                    _gdal = None
+                _gdal_checked = True
+    return _gdal
+
+
+def require_gdal():
+    gdal = load_gdal()
+    if gdal is None:
+        raise RuntimeError("GDAL Python bindings (osgeo) are not installed")
+    return gdal
+
+
+def is_available():
+    """Return True if the in-process engine can read and write rasters"""
+    return load_gdal() is not None
+
+
+def _open(path):
+    return require_gdal().Open(os.fspath(path))
+
+
+def raster_size(path):
+    """Return (width, height) of a raster without reading any pixels"""
+    ds = _open(path)
+    return ds.RasterXSize, ds.RasterYSize
+
+
+def georeference(path):
+    """Return (geotransform, projection WKT) of a raster"""
+    ds = _open(path)
+    return ds.GetGeoTransform(), ds.GetProjection()
+
+
+def decimated_size(width, height, max_size):
+    """Fit (width, height) inside max_size x max_size, never upsampling"""
+    if max_size is None or (width <= max_size and height <= max_size):
+        return width, height
+    factor = max(width, height) / float(max_size)
+    return max(1, int(round(width / factor))), max(1, int(round(height / factor)))
+
+
+def preview_levels(width, height, display_size, max_size):
+    """Ascending preview sizes: coarse first, then display, then detail"""
+    levels = []
+    for target in (max(32, display_size // 4), display_size, max_size):
+        size = decimated_size(width, height, target)
+        if size not in levels:
+            levels.append(size)
+    return levels
+
+
+def strip_rows(width, height, max_memory=None, block_height=1):
+    """Rows per strip so one strip's working set stays within max_memory
+
+    Strips are a multiple of the band's block height where the budget allows,
+    so every strip read touches whole blocks.
+    """
+    if max_memory is None:
+        return height
+    rows = int(max_memory // (width * WORKING_BYTES_PER_PIXEL)) - 2 * HALO_ROWS
+    if rows > block_height:
+        rows -= rows % block_height
+    return max(1, min(rows, height))
+
+
+def iter_strips(height, rows, halo=HALO_ROWS):
+    """Yield (read_start, read_stop, out_start, out_stop) row ranges
+
+    The read range adds halo rows on each side (clipped to the raster), so
+    shading each strip and keeping only its out rows matches shading the
+    whole raster at once.
+    """
+    for start in range(0, height, rows):
+        stop = min(start + rows, height)
+        yield max(start - halo, 0), min(stop + halo, height), start, stop
+
+
+def read_dem(path, band=1, max_size=None):
+    """Read a DEM band into a float32 array with its georeferencing
+
+    With max_size the band is read decimated (averaged, using overviews when
+    present) so the full-resolution raster is never materialised.
+    """
+    ds = _open(path)
+    try:
+        src_band = ds.GetRasterBand(band)
+        gt = ds.GetGeoTransform()
+        width, height = decimated_size(ds.RasterXSize, ds.RasterYSize, max_size)
+        if (width, height) == (ds.RasterXSize, ds.RasterYSize):
+            elevation = src_band.ReadAsArray()
+        else:
+            elevation = src_band.ReadAsArray(
+                buf_xsize=width, buf_ysize=height,
+                resample_alg=load_gdal().GRIORA_Average)
+            sx = ds.RasterXSize / float(width)
+            sy = ds.RasterYSize / float(height)
+            gt = (gt[0], gt[1] * sx, gt[2] * sy, gt[3], gt[4] * sx, gt[5] * sy)
+        return Dem(elevation.astype(np.float32, copy=False), gt,
+                   ds.GetProjection(), src_band.GetNoDataValue())
+    finally:
+        ds = None
+
+
+def _nodata_mask(elevation, nodata):
+    if nodata is None:
+        return None
+    if np.isnan(nodata):
+        mask = np.isnan(elevation)
+    else:
+        mask = elevation == np.float32(nodata)
+    return mask if mask.any() else None
+
+
+def _pad_edges(values, mask):
+    """Pad by one pixel the way gdaldem -compute_edges does (2*a - b)"""
+    if values.shape[0] > 1:
+        top = 2 * values[0] - values[1]
+        bottom = 2 * values[-1] - values[-2]
+    else:
+        top = bottom = values[0]
+    values = np.vstack([top[np.newaxis], values, bottom[np.newaxis]])
+    if values.shape[1] > 1:
+        left = 2 * values[:, 0] - values[:, 1]
+        right = 2 * values[:, -1] - values[:, -2]
+    else:
+        left = right = values[:, 0]
+    values = np.hstack([left[:, np.newaxis], values, right[:, np.newaxis]])
+
+    if mask is not None:
+        # An extrapolated value is nodata if either of its sources is
+        if mask.shape[0] > 1:
+            mtop, mbottom = mask[0] | mask[1], mask[-1] | mask[-2]
+        else:
+            mtop = mbottom = mask[0]
+        mask = np.vstack([mtop[np.newaxis], mask, mbottom[np.newaxis]])
+        if mask.shape[1] > 1:
+            mleft, mright = mask[:, 0] | mask[:, 1], mask[:, -1] | mask[:, -2]
+        else:
+            mleft = mright = mask[:, 0]
+        mask = np.hstack([mleft[:, np.newaxis], mask, mright[:, np.newaxis]])
+    return values, mask
+
+
+def compute_gradients(elevation, geotransform, nodata=None, z_factor=1.0,
+                      scale=1.0, compute_edges=True):
+    """Compute the light-independent Horn gradient terms for a DEM array"""
+    elevation = np.asarray(elevation, dtype=np.float32)
+    height, width = elevation.shape
+    mask = _nodata_mask(elevation, nodata)
+
+    if compute_edges:
+        padded, padded_mask = _pad_edges(elevation, mask)
+    else:
+        # Edge pixels are nodata without -compute_edges; pad with anything
+        padded = np.pad(elevation, 1, mode='edge')
+        padded_mask = None if mask is None else np.pad(mask, 1, mode='edge')
+
+    def window(dy, dx):
+        return padded[dy:dy + height, dx:dx + width]
+
+    center = elevation
+    neighbours = {}
+    for dy in range(3):
+        for dx in range(3):
+            if (dy, dx) == (1, 1):
+                continue
+            values = window(dy, dx)
+            if padded_mask is not None:
+                nd = padded_mask[dy:dy + height, dx:dx + width]
+                if compute_edges:
+                    # gdaldem substitutes the centre value for nodata neighbours
+                    values = np.where(nd, center, values)
+            neighbours[(dy, dx)] = values
+
+    a, b, c = neighbours[(0, 0)], neighbours[(0, 1)], neighbours[(0, 2)]
+    d, f = neighbours[(1, 0)], neighbours[(1, 2)]
+    g, h, i = neighbours[(2, 0)], neighbours[(2, 1)], neighbours[(2, 2)]
+
+    # Same sign conventions as GDALHillshadeAlg (nsres is normally negative)
+    x = ((a + d + d + g) - (c + f + f + i)) * np.float32(1.0 / (8.0 * geotransform[1]))
+    y = ((g + h + h + i) - (a + b + b + c)) * np.float32(1.0 / (8.0 * geotransform[5]))
+    if compute_edges and height > 1 and width > 1:
+        # In its first and last rows gdaldem repeats the centre column at the
+        # corners instead of extrapolating it; patch those four pixels
+        kx = 1.0 / (8.0 * geotransform[1])
+        ky = 1.0 / (8.0 * geotransform[5])
+        for p in ((0, 0), (height - 1, 0)):
+            x[p] += ((b[p] - a[p]) + 2 * (center[p] - d[p]) + (h[p] - g[p])) * kx
+            y[p] += ((h[p] - g[p]) - (b[p] - a[p])) * ky
+        for p in ((0, width - 1), (height - 1, width - 1)):
+            x[p] -= ((b[p] - c[p]) + 2 * (center[p] - f[p]) + (h[p] - i[p])) * kx
+            y[p] += ((h[p] - i[p]) - (b[p] - c[p])) * ky
+    del a, b, c, d, f, g, h, i, neighbours
+
+    z = np.float32(z_factor / scale)
+    x *= z
+    y *= z
+    inv_norm = 1.0 / np.sqrt(1.0 + x * x + y * y)
+    x *= inv_norm
+    y *= inv_norm
+
+    valid = np.ones(elevation.shape, dtype=bool)
+    if mask is not None:
+        valid &= ~mask
+        if not compute_edges:
+            for dy in range(3):
+                for dx in range(3):
+                    valid &= ~padded_mask[dy:dy + height, dx:dx + width]
+    if not compute_edges:
+        valid[0, :] = valid[-1, :] = False
+        valid[:, 0] = valid[:, -1] = False
+
+    return Gradients(inv_norm.astype(np.float32, copy=False),
+                     x.astype(np.float32, copy=False),
+                     y.astype(np.float32, copy=False), valid)
+
+
+def multidirectional_lights(altitude=45.0):
+    """Equally weighted lights from MULTIDIRECTIONAL_AZIMUTHS"""
+    return [Light(azimuth, altitude, 1.0) for azimuth in MULTIDIRECTIONAL_AZIMUTHS]
+
+
+def _illumination(gradients, azimuth, altitude, scale, out):
+    """out = max(cos(angle to the light), 0) * scale"""
+    az = np.radians(azimuth)
+    alt = np.radians(altitude)
+    sin_alt = np.float32(np.sin(alt) * scale)
+    cos_az = np.float32(np.cos(az) * np.cos(alt) * scale)
+    sin_az = np.float32(np.sin(az) * np.cos(alt) * scale)
+
+    np.multiply(gradients.inv_norm, sin_alt, out=out)
+    out -= gradients.py * cos_az
+    out += gradients.px * sin_az
+    np.maximum(out, 0.0, out=out)
+    return out
+
+
+def shade(gradients, azimuth=315.0, altitude=45.0, lights=None, slope_weight=0.0):
+    """Evaluate the illumination and return Byte values
+
+    With lights (a sequence of Light or (azimuth, altitude, weight)) the
+    weighted mean of their illuminations is used instead of the single
+    azimuth/altitude light, and slope_weight mixes in slope shading (cosine
+    of the slope: flat is bright, steep is dark). All of them reuse the same
+    gradients, so each extra light costs a few array operations.
+    """
+    if not lights:
+        lights = [Light(azimuth, altitude, 1.0)]
+    total = sum(float(light[2]) for light in lights) + slope_weight
+    if total <= 0:
+        raise ValueError("Light and slope weights must add up to more than zero")
+
+    cang = np.empty_like(gradients.inv_norm)
+    _illumination(gradients, lights[0][0], lights[0][1], 254.0 * lights[0][2] / total, cang)
+    if len(lights) > 1:
+        term = np.empty_like(cang)
+        for light in lights[1:]:
+            cang += _illumination(gradients, light[0], light[1],
+                                  254.0 * light[2] / total, term)
+        del term
+    if slope_weight:
+        cang += gradients.inv_norm * np.float32(254.0 * slope_weight / total)
+    # gdaldem returns 1 + 254*cos(angle) and GDAL rounds when writing Byte
+    cang += 1.5
+    out = cang.astype(np.uint8)
+    out[~gradients.valid] = HILLSHADE_NODATA
+    return out
+
+
+def gradients_nbytes(gradients):
+    """Memory held by a Gradients tuple"""
+    return sum(arr.nbytes for arr in gradients)
+
+
+class GradientCache:
+    """Byte-bounded LRU of gradient fields keyed by input file and z-factor
+
+    Changing only the azimuth or altitude then costs a single `shade` pass
+    instead of re-reading the DEM and recomputing the 3x3 derivatives.
+    """
+
+    def __init__(self, max_bytes=1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(paths, z_factor, scale=1.0, compute_edges=True, *extra):
+        """Key on file identity so an edited DEM is never served stale
+
+        paths is the DEM file or the list of source files behind it. For a
+        mosaic that is the member DEMs, not the VRT each process rebuilds.
+        """
+        if isinstance(paths, (str, os.PathLike)):
+            paths = [paths]
+        identity = []
+        for path in paths:
+            st = os.stat(path)
+            identity.append((os.path.realpath(path), st.st_size, st.st_mtime_ns))
+        return (tuple(identity), float(z_factor), float(scale), bool(compute_edges)) + extra
+
+    def get(self, key):
+        with self._lock:
+            gradients = self._entries.get(key)
+            if gradients is not None:
+                self._entries.move_to_end(key)
+            return gradients
+
+    def put(self, key, gradients):
+        size = gradients_nbytes(gradients)
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= gradients_nbytes(self._entries.pop(key))
+            if size > self.max_bytes:
+                return
+            self._entries[key] = gradients
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= gradients_nbytes(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def gradients_for_file(self, path, z_factor=1.0, scale=1.0, compute_edges=True,
+                           max_size=None, source_files=None):
+        """Return (gradients, hit) for a DEM file, computing on a miss
+
+        source_files (the files path is built from) are keyed instead of path.
+        """
+        key = self.make_key(source_files or path, z_factor, scale, compute_edges, max_size)
+        gradients = self.get(key)
+        if gradients is not None:
+            return gradients, True
+        dem = read_dem(path, max_size=max_size)
+        gradients = compute_gradients(dem.elevation, dem.geotransform, dem.nodata,
+                                      z_factor, scale, compute_edges)
+        self.put(key, gradients)
+        return gradients, False
+
+
+def hillshade(elevation, geotransform, nodata=None, z_factor=1.0, azimuth=315.0,
+              altitude=45.0, scale=1.0, compute_edges=True, lights=None, slope_weight=0.0):
+    """Compute a gdaldem-compatible (or blended, see shade) hillshade for a DEM array"""
+    gradients = compute_gradients(elevation, geotransform, nodata, z_factor,
+                                  scale, compute_edges)
+    return shade(gradients, azimuth, altitude, lights, slope_weight)
+
+
+def create_hillshade(path, width, height, geotransform, projection, driver='GTiff',
+                     creation_options=None):
+    """Create an empty single-band Byte greyscale raster for a hillshade"""
+    gdal = require_gdal()
+    if creation_options is None:
+        creation_options = ['TILED=YES', 'PHOTOMETRIC=MINISBLACK']
+    ds = gdal.GetDriverByName(driver).Create(
+        os.fspath(path), width, height, 1, gdal.GDT_Byte, options=creation_options)
+    ds.SetGeoTransform(geotransform)
+    if projection:
+        ds.SetProjection(projection)
+    ds.GetRasterBand(1).SetNoDataValue(HILLSHADE_NODATA)
+    return ds
+
+
+def write_hillshade(path, shaded, geotransform, projection, driver='GTiff',
+                    creation_options=None):
+    """Write a Byte hillshade array as a single-band greyscale raster"""
+    height, width = shaded.shape
+    ds = create_hillshade(path, width, height, geotransform, projection, driver,
+                          creation_options)
+    ds.GetRasterBand(1).WriteArray(shaded)
+    return ds
+
+
+def hillshade_file(src_path, dst_path, z_factor=1.0, azimuth=315.0, altitude=45.0,
+                   scale=1.0, compute_edges=True, creation_options=None,
+                   max_memory=None, progress=None, lights=None, slope_weight=0.0):
+    """In-process equivalent of `gdaldem hillshade` + Byte greyscale conversion
+
+    The DEM is processed in row strips (with halo rows) sized to max_memory
+    bytes, so peak memory is independent of the raster size; without a
+    budget the whole raster is one strip. progress receives 0-100.
+    """
+    ds = _open(src_path)
+    band = ds.GetRasterBand(1)
+    width, height = ds.RasterXSize, ds.RasterYSize
+    gt = ds.GetGeoTransform()
+    nodata = band.GetNoDataValue()
+    rows = strip_rows(width, height, max_memory, band.GetBlockSize()[1])
+
+    out = create_hillshade(dst_path, width, height, gt, ds.GetProjection(),
+                           creation_options=creation_options)
+    out_band = out.GetRasterBand(1)
+    for read_start, read_stop, out_start, out_stop in iter_strips(height, rows):
+        elevation = band.ReadAsArray(0, read_start, width, read_stop - read_start)
+        strip_gt = (gt[0] + read_start * gt[2], gt[1], gt[2],
+                    gt[3] + read_start * gt[5], gt[4], gt[5])
+        shaded = hillshade(elevation.astype(np.float32, copy=False), strip_gt, nodata,
+                           z_factor, azimuth, altitude, scale, compute_edges,
+                           lights, slope_weight)
+        del elevation
+        out_band.WriteArray(shaded[out_start - read_start:out_stop - read_start], 0, out_start)
+        del shaded
+        if progress:
+            progress(100.0 * out_stop / height)
+    out.FlushCache()
+    out = None
+    ds = None
+    return dst_path
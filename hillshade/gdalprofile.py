@@ -0,0 +1,398 @@
+"""
+GDAL performance profile
+Block cache, thread counts and warp memory for every GDAL call of a conversion,
+derived from the machine's cores, RAM and scratch disk, overridable, saved in
+the user config directory, and tunable by a short calibration run
+"""
+
+import os
+import plistlib
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, replace
+
+from hillshade import userdirs
+from hillshade.lazy import lazy_import
+
+np = lazy_import('numpy')
+engine = lazy_import('hillshade.engine')
+
+PROFILE_FILE = 'gdal_profile.json'
+PROFILE_VERSION = 1
+# Settings a user can override; calibration picks threads and warp_memory
+SETTINGS = ('cache_max', 'threads', 'warp_memory')
+
+SSD = 'ssd'
+HDD = 'hdd'
+UNKNOWN = 'unknown'
+
+# GDAL's own default block cache is 5% of RAM; a conversion is the only big
+# user of the machine, so it gets more, but never so much that tools swap
+CACHE_SHARE = 1 / 8.0
+# A spinning disk pays a seek for every block read twice, so cache more
+HDD_CACHE_SHARE = 1 / 5.0
+MAX_CACHE = 4 << 30
+MIN_CACHE = 64 << 20
+# gdalwarp -wm: chunks beyond ~1 GB only cost memory, below 64 MB cost passes
+WARP_MEMORY_SHARE = 1 / 16.0
+MAX_WARP_MEMORY = 1 << 30
+MIN_WARP_MEMORY = 64 << 20
+# Interleaved writes of many compression threads make a spinning disk seek
+HDD_MAX_THREADS = 4
+# Fallback when RAM cannot be determined
+ASSUMED_MEMORY = 8 << 30
+
+# Calibration: a Byte raster this many pixels square, warped to Web Mercator
+CALIBRATION_SIZE = 4096
+CALIBRATION_SRS = 'EPSG:32632'
+CALIBRATION_PIXEL = 2.0
+# Fewer threads win unless more are at least this much faster: leaves cores free
+CALIBRATION_TOLERANCE = 0.05
+CALIBRATION_WARP_MEMORY = (64 << 20, 256 << 20, 1 << 30)
+
+
+def physical_memory():
+    """Installed RAM in bytes, or None where it cannot be determined"""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        pass
+    if sys.platform == 'win32':
+        import ctypes
+
+        class MemoryStatus(ctypes.Structure):
+            _fields_ = [('length', ctypes.c_ulong), ('load', ctypes.c_ulong),
+                        ('total', ctypes.c_ulonglong), ('available', ctypes.c_ulonglong),
+                        ('page_total', ctypes.c_ulonglong), ('page_free', ctypes.c_ulonglong),
+                        ('virtual_total', ctypes.c_ulonglong),
+                        ('virtual_free', ctypes.c_ulonglong),
+                        ('extended_free', ctypes.c_ulonglong)]
+        status = MemoryStatus()
+        status.length = ctypes.sizeof(MemoryStatus)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.total
+    return None
+
+
+def _mount_point(path):
+    path = os.path.abspath(path)
+    while not os.path.ismount(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+def disk_type(path):
+    """SSD, HDD or UNKNOWN for the disk holding path
+
+    Linux reads the block device's rotational flag from sysfs and macOS asks
+    diskutil; elsewhere (and for network or RAM file systems) it is UNKNOWN.
+    """
+    try:
+        if sys.platform.startswith('linux'):
+            st = os.stat(path)
+            device = os.path.realpath(
+                f'/sys/dev/block/{os.major(st.st_dev)}:{os.minor(st.st_dev)}')
+            # A partition has no queue of its own; its disk does
+            for directory in (device, os.path.dirname(device)):
+                flag = os.path.join(directory, 'queue', 'rotational')
+                if os.path.exists(flag):
+                    with open(flag) as f:
+                        return HDD if f.read().strip() == '1' else SSD
+        elif sys.platform == 'darwin':
+            result = subprocess.run(['diskutil', 'info', '-plist', _mount_point(path)],
+                                    capture_output=True, timeout=10)
+            if result.returncode == 0:
+                solid = plistlib.loads(result.stdout).get('SolidState')
+                if solid is not None:
+                    return SSD if solid else HDD
+    except (OSError, ValueError, subprocess.SubprocessError):
+        pass
+    return UNKNOWN
+
+
+@dataclass
+class Machine:
+    """What the profile is derived from"""
+    cores: int
+    memory: int
+    disk: str
+
+    def describe(self):
+        return (f"{self.cores} cores, {self.memory / (1 << 30):.1f} GB RAM, "
+                f"{self.disk} scratch disk")
+
+
+def detect_machine(scratch_dir=None):
+    """Cores, RAM and the disk type of scratch_dir (default: the temp directory)"""
+    return Machine(os.cpu_count() or 1, physical_memory() or ASSUMED_MEMORY,
+                   disk_type(scratch_dir or tempfile.gettempdir()))
+
+
+@dataclass
+class GdalProfile:
+    """GDAL settings applied to one conversion
+
+    cache_max and warp_memory are bytes; threads drives GDAL_NUM_THREADS
+    (multithreaded compression and decoding) and gdalwarp's NUM_THREADS.
+    source says where the values came from, for the log and run report.
+    """
+    cache_max: int
+    threads: int
+    warp_memory: int
+    source: str = 'auto'
+
+    @property
+    def cache_mb(self):
+        return max(16, self.cache_max >> 20)
+
+    @property
+    def warp_memory_mb(self):
+        return max(16, self.warp_memory >> 20)
+
+    def env(self, base=None):
+        """Environment for GDAL command line tools"""
+        return dict(os.environ if base is None else base,
+                    GDAL_CACHEMAX=str(self.cache_mb), GDAL_NUM_THREADS=str(self.threads))
+
+    def warp_args(self):
+        """gdalwarp options; a VRT output keeps NUM_THREADS and -wm for its readers"""
+        args = ['-wo', f'NUM_THREADS={self.threads}', '-wm', str(self.warp_memory_mb)]
+        # -multi overlaps reading and computing, which only pays with threads to spare
+        return (['-multi'] if self.threads > 1 else []) + args
+
+    def creation_args(self):
+        """-co for a compressed GeoTIFF output: compress blocks on every thread"""
+        return ['-co', f'NUM_THREADS={self.threads}']
+
+    def warp_kwargs(self):
+        """gdal.Warp keyword arguments matching warp_args()"""
+        return {'multithread': self.threads > 1,
+                'warpOptions': [f'NUM_THREADS={self.threads}'],
+                'warpMemoryLimit': self.warp_memory}
+
+    @contextmanager
+    def applied(self):
+        """Apply the block cache and thread count to in-process GDAL, then restore them"""
+        gdal = engine.require_gdal()
+        previous_cache = gdal.GetCacheMax()
+        previous_threads = gdal.GetConfigOption('GDAL_NUM_THREADS')
+        gdal.SetCacheMax(self.cache_max)
+        gdal.SetConfigOption('GDAL_NUM_THREADS', str(self.threads))
+        try:
+            yield self
+        finally:
+            gdal.SetCacheMax(previous_cache)
+            gdal.SetConfigOption('GDAL_NUM_THREADS', previous_threads)
+
+    def describe(self):
+        return (f"block cache {self.cache_mb} MB, {self.threads} threads, "
+                f"warp memory {self.warp_memory_mb} MB ({self.source})")
+
+
+def auto_profile(machine):
+    """Settings derived from the machine alone"""
+    hdd = machine.disk == HDD
+    cache = machine.memory * (HDD_CACHE_SHARE if hdd else CACHE_SHARE)
+    threads = min(machine.cores, HDD_MAX_THREADS) if hdd else machine.cores
+    return GdalProfile(
+        cache_max=int(min(max(cache, MIN_CACHE), MAX_CACHE)),
+        threads=max(1, threads),
+        warp_memory=int(min(max(machine.memory * WARP_MEMORY_SHARE, MIN_WARP_MEMORY),
+                            MAX_WARP_MEMORY)))
+
+
+# ── Saved settings ──
+
+def profile_path():
+    return os.path.join(userdirs.config_dir(), PROFILE_FILE)
+
+
+def load_settings():
+    """{'overrides': {...}, 'calibrated': {...} or None} from the config directory"""
+    data = userdirs.read_json(profile_path(), {})
+    if data.get('version') != PROFILE_VERSION:
+        data = {}
+    return {'overrides': data.get('overrides') or {}, 'calibrated': data.get('calibrated')}
+
+
+def _save(settings):
+    userdirs.write_json(profile_path(), dict(settings, version=PROFILE_VERSION))
+
+
+def save_overrides(**values):
+    """Persist overrides of SETTINGS; None removes one. Returns the saved overrides"""
+    settings = load_settings()
+    overrides = settings['overrides']
+    for name, value in values.items():
+        if name not in SETTINGS:
+            raise ValueError(f"Unknown GDAL setting: {name}")
+        if value is None:
+            overrides.pop(name, None)
+        elif int(value) < 1:
+            raise ValueError(f"{name} must be positive")
+        else:
+            overrides[name] = int(value)
+    _save(settings)
+    return overrides
+
+
+def reset():
+    """Forget overrides and calibration"""
+    _save({'overrides': {}, 'calibrated': None})
+
+
+def resolve(options=None, scratch_dir=None, machine=None):
+    """The profile for a conversion
+
+    Later sources win: derived from the machine, calibrated on it, saved
+    overrides, then the options' gdal_cache/gdal_threads/warp_memory. The
+    options' max_memory and workers (e.g. a queued job's share) cap what
+    was not set for this run explicitly.
+    """
+    machine = machine or detect_machine(scratch_dir)
+    profile = auto_profile(machine)
+    settings = load_settings()
+    calibrated = settings['calibrated']
+    # A calibration on other hardware (e.g. a config copied across) is stale
+    if calibrated and calibrated.get('cores') == machine.cores:
+        profile = replace(profile, source='calibrated', **{
+            name: calibrated[name] for name in SETTINGS if calibrated.get(name)})
+    if settings['overrides']:
+        profile = replace(profile, source='saved', **settings['overrides'])
+    if options is None:
+        return profile
+    if options.max_memory is not None:
+        # A quarter each, like the in-process budget; the tool itself needs the rest
+        quarter = max(16 << 20, options.max_memory // 4)
+        profile = replace(profile, cache_max=min(profile.cache_max, quarter),
+                          warp_memory=min(profile.warp_memory, quarter))
+    if options.workers:
+        profile = replace(profile, threads=min(profile.threads, options.workers))
+    explicit = {name: getattr(options, option) for name, option in (
+        ('cache_max', 'gdal_cache'), ('threads', 'gdal_threads'),
+        ('warp_memory', 'warp_memory')) if getattr(options, option)}
+    if explicit:
+        profile = replace(profile, source='options', **explicit)
+    return profile
+
+
+# ── Calibration ──
+
+def write_test_raster(path, size=CALIBRATION_SIZE):
+    """A compressed Byte raster with hillshade-like texture in a UTM projection"""
+    from osgeo import osr
+    srs = osr.SpatialReference()
+    srs.SetFromUserInput(CALIBRATION_SRS)
+    geotransform = (500000.0, CALIBRATION_PIXEL, 0.0, 5200000.0, 0.0, -CALIBRATION_PIXEL)
+    ds = engine.create_hillshade(path, size, size, geotransform, srs.ExportToWkt(),
+                                 creation_options=['TILED=YES', 'COMPRESS=DEFLATE',
+                                                   'PHOTOMETRIC=MINISBLACK'])
+    band = ds.GetRasterBand(1)
+    rng = np.random.default_rng(0)
+    columns = np.arange(size, dtype=np.float32)
+    for top in range(0, size, 512):
+        rows = np.arange(top, min(top + 512, size), dtype=np.float32)[:, None]
+        relief = 127 + 60 * np.sin(columns / 97.0) * np.cos(rows / 131.0)
+        relief += rng.normal(0, 12, relief.shape)
+        band.WriteArray(np.clip(relief, 1, 255).astype(np.uint8), 0, top)
+    ds.FlushCache()
+    ds = None
+
+
+def _thread_candidates(cores):
+    return sorted({1, 2, max(1, cores // 2), cores} & set(range(1, cores + 1)))
+
+
+def calibrate(scratch_dir=None, size=CALIBRATION_SIZE, log=print, progress=None):
+    """Time a test warp across thread counts and warp memory; save and return the best
+
+    The test raster is written to scratch_dir (default: the temp directory)
+    so the disk it measures is the one conversions use. Takes well under a
+    minute on current hardware at the default size.
+    """
+    gdal = engine.require_gdal()
+    machine = detect_machine(scratch_dir)
+    log(f"Calibrating GDAL on {machine.describe()}...")
+    base = auto_profile(machine)
+    work = tempfile.mkdtemp(prefix='hillshade_calibrate_', dir=scratch_dir)
+    try:
+        source = os.path.join(work, 'source.tif')
+        write_test_raster(source, size)
+        target = os.path.join(work, 'warped.tif')
+
+        def timed(profile):
+            started = time.perf_counter()
+            with profile.applied():
+                gdal.Warp(target, source, dstSRS='EPSG:3857', resampleAlg='bilinear',
+                          creationOptions=['TILED=YES', 'COMPRESS=DEFLATE'],
+                          **profile.warp_kwargs())
+            elapsed = time.perf_counter() - started
+            os.remove(target)
+            return elapsed
+
+        # Warm-up: loads drivers and puts the source in the OS file cache
+        timed(base)
+        memories = sorted({m for m in CALIBRATION_WARP_MEMORY + (base.warp_memory,)
+                           if m <= machine.memory // 8} or {MIN_WARP_MEMORY})
+        thread_counts = _thread_candidates(machine.cores)
+        total = len(thread_counts) + len(memories)
+        results = []
+
+        def measure(profile):
+            seconds = timed(profile)
+            results.append((seconds, profile))
+            log(f"  {profile.threads:>3} threads, warp memory {profile.warp_memory_mb:>5} MB: "
+                f"{seconds:.2f} s")
+            if progress is not None:
+                progress(100.0 * len(results) / total)
+
+        for threads in thread_counts:
+            measure(replace(base, threads=threads))
+        # Then warp memory, at the best thread count
+        fastest = _fastest(results)
+        for memory in memories:
+            if memory != fastest.warp_memory:
+                measure(replace(fastest, warp_memory=memory))
+        best = _fastest(results)
+        best_seconds = min(seconds for seconds, profile in results if profile == best)
+        slowest = max(seconds for seconds, _ in results)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    if progress is not None:
+        progress(100)
+
+    settings = load_settings()
+    # The block cache is left to the machine-derived value: a single warp
+    # reads each block once, so timing it says nothing about the cache
+    settings['calibrated'] = dict(threads=best.threads, warp_memory=best.warp_memory,
+                                  cores=machine.cores, memory=machine.memory,
+                                  disk=machine.disk, seconds=round(best_seconds, 3),
+                                  size=size, time=round(time.time()))
+    _save(settings)
+    best = replace(best, source='calibrated')
+    log(f"Best: {best.describe()}, {best_seconds:.2f} s vs {slowest:.2f} s slowest")
+    if settings['overrides']:
+        log("Note: saved overrides still take precedence over the calibration")
+    return best
+
+
+def _fastest(results):
+    """Quickest profile, preferring fewer threads and less memory when nearly as quick"""
+    quickest = min(seconds for seconds, _ in results)
+    close = [profile for seconds, profile in results
+             if seconds <= quickest * (1 + CALIBRATION_TOLERANCE)]
+    return min(close, key=lambda profile: (profile.threads, profile.warp_memory))
+
+
+def summary(options=None, scratch_dir=None):
+    """Machine, effective profile and saved settings, e.g. for `tune show`"""
+    machine = detect_machine(scratch_dir)
+    profile = resolve(options, machine=machine)
+    return {'machine': asdict(machine), 'profile': asdict(profile), **load_settings()}
@@ -0,0 +1,156 @@
+"""
+Run instrumentation
+Per-stage wall time, CPU time, peak memory, block I/O and scratch space,
+collected into a JSON run report written next to the output
+"""
+
+import json
+import os
+import platform
+import socket
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows: only wall time and sizes are recorded
+    resource = None
+
+REPORT_VERSION = 1
+# getrusage block counts are in 512-byte units
+BLOCK_BYTES = 512
+# ru_maxrss is in KB on Linux and bytes on macOS
+MAXRSS_BYTES = 1 if sys.platform == 'darwin' else 1024
+
+
+def report_path(output_path):
+    return output_path + '.report.json'
+
+
+def profile_path(output_path):
+    return output_path + '.pstats'
+
+
+def _snapshot(who):
+    if resource is None:
+        return None
+    r = resource.getrusage(who)
+    return {'cpu': r.ru_utime + r.ru_stime, 'maxrss': r.ru_maxrss * MAXRSS_BYTES,
+            'read': r.ru_inblock * BLOCK_BYTES, 'written': r.ru_oublock * BLOCK_BYTES}
+
+
+def exit_code(wait_status):
+    """Popen-style return code from an os.wait4() status"""
+    if os.WIFSIGNALED(wait_status):
+        return -os.WTERMSIG(wait_status)
+    return os.WEXITSTATUS(wait_status)
+
+
+def tree_bytes(path):
+    """Total size of the files under path (0 if it does not exist)"""
+    if not path or not os.path.exists(path):
+        return 0
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+def _mb(nbytes):
+    return None if nbytes is None else round(nbytes / 1048576.0, 1)
+
+
+class RunReport:
+    """Stages and metadata of one conversion, serialisable as JSON
+
+    Child processes are accounted twice over: RUSAGE_CHILDREN deltas give the
+    CPU time and block I/O of every child reaped during a stage (GDAL tools
+    and tiler workers alike), and record_child() adds the per-process peak RSS
+    that os.wait4 reports for the GDAL tools.
+    """
+
+    def __init__(self, **info):
+        self.info = dict(info)
+        self.info.setdefault('started', time.strftime('%Y-%m-%dT%H:%M:%S'))
+        self.stages = []
+        self._current = None
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name, temp_dir=None):
+        """Measure the enclosed block as one stage; yields its record dict"""
+        record = {'name': name, 'skipped': False, 'commands': 0,
+                  'child_peak_rss_mb': None}
+        self_before = _snapshot(resource.RUSAGE_SELF) if resource else None
+        children_before = _snapshot(resource.RUSAGE_CHILDREN) if resource else None
+        started = time.perf_counter()
+        self._current = record
+        try:
+            yield record
+        finally:
+            self._current = None
+            record['wall_s'] = round(time.perf_counter() - started, 3)
+            if resource is not None:
+                self_after = _snapshot(resource.RUSAGE_SELF)
+                children_after = _snapshot(resource.RUSAGE_CHILDREN)
+                record['cpu_s'] = round(self_after['cpu'] - self_before['cpu'], 3)
+                record['child_cpu_s'] = round(
+                    children_after['cpu'] - children_before['cpu'], 3)
+                record['bytes_read'] = (self_after['read'] - self_before['read']
+                                        + children_after['read'] - children_before['read'])
+                record['bytes_written'] = (
+                    self_after['written'] - self_before['written']
+                    + children_after['written'] - children_before['written'])
+                # The process peak so far; it only rises in the stage that set it
+                record['peak_rss_mb'] = _mb(self_after['maxrss'])
+                if children_after['maxrss'] > children_before['maxrss']:
+                    record['child_peak_rss_mb'] = max(
+                        record['child_peak_rss_mb'] or 0, _mb(children_after['maxrss']))
+            if temp_dir:
+                record['temp_bytes'] = tree_bytes(temp_dir)
+            self.stages.append(record)
+
+    def skip(self, name, reason='resumed'):
+        self.stages.append({'name': name, 'skipped': True, 'reason': reason, 'wall_s': 0.0})
+
+    def record_child(self, rusage):
+        """Account one finished child process (the rusage from os.wait4)"""
+        if self._current is None or rusage is None:
+            return
+        record = self._current
+        record['commands'] += 1
+        peak = _mb(rusage.ru_maxrss * MAXRSS_BYTES)
+        record['child_peak_rss_mb'] = max(record['child_peak_rss_mb'] or 0, peak)
+
+    def annotate(self, **fields):
+        """Add fields to the running stage, e.g. tiles written"""
+        if self._current is not None:
+            self._current.update(fields)
+
+    def as_dict(self):
+        data = {'version': REPORT_VERSION}
+        data.update(self.info)
+        data['wall_s'] = round(time.perf_counter() - self._started, 3)
+        data['machine'] = {
+            'host': socket.gethostname(),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+        }
+        data['stages'] = self.stages
+        return data
+
+    def write(self, path):
+        self.info['finished'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.as_dict(), f, indent=1, default=str)
+        os.replace(tmp, path)
+        return path
@@ -0,0 +1,464 @@
+"""
+Conversion job queue
+A persistent queue of conversions, and a scheduler that runs them concurrently
+as CLI subprocesses within limits on cores, memory and scratch disk
+"""
+
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field, fields, replace
+from typing import Optional
+
+from hillshade import cli, gdalprofile, mosaic, pipeline, userdirs
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+QUEUE_VERSION = 1
+# A lock file older than this is left over from a crashed process
+STALE_LOCK_SECONDS = 30
+# Seconds between SIGTERM and SIGKILL when cancelling a job
+KILL_GRACE_SECONDS = 5
+# Share of physical memory the scheduler hands out by default
+MEMORY_SHARE = 0.75
+# Scratch space per input byte: staged intermediates, the output and its journal
+SCRATCH_FACTOR_STAGED = 4.0
+SCRATCH_FACTOR_STREAMED = 1.5
+
+
+def queue_path():
+    return os.path.join(userdirs.config_dir(), 'queue.json')
+
+
+def estimate_scratch(input_spec, options):
+    """Disk a conversion may need at its peak: intermediates plus the output"""
+    try:
+        size = sum(os.path.getsize(path) for path in mosaic.resolve_inputs(input_spec))
+    except OSError:
+        return 0
+    factor = SCRATCH_FACTOR_STAGED if not options.stream else SCRATCH_FACTOR_STREAMED
+    return int(size * factor)
+
+
+@dataclass
+class Limits:
+    """What the scheduler may hand out across all running jobs (None: no limit)"""
+    cores: Optional[int] = None
+    memory: Optional[int] = None
+    scratch: Optional[int] = None
+
+    def resolved(self):
+        """Limits with machine defaults filled in"""
+        memory = self.memory
+        if memory is None:
+            total = gdalprofile.physical_memory()
+            memory = int(total * MEMORY_SHARE) if total else None
+        return Limits(self.cores or os.cpu_count() or 1, memory, self.scratch)
+
+
+@dataclass
+class Job:
+    """One queued conversion; options is a pipeline.ConversionOptions as a dict"""
+    input: str
+    output: str
+    options: dict
+    priority: int = 0
+    id: str = field(default_factory=lambda: uuid.uuid4().hex[:8])
+    state: str = QUEUED
+    created: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    error: Optional[str] = None
+    cancel_requested: bool = False
+    # Resources reserved while running, and the scheduler process that runs it
+    cores: int = 0
+    memory: Optional[int] = None
+    scratch: int = 0
+    owner: Optional[int] = None
+
+    @classmethod
+    def from_dict(cls, data):
+        names = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in names})
+
+    def conversion_options(self):
+        return pipeline.ConversionOptions(**self.options)
+
+
+class JobQueue:
+    """Jobs and scheduler limits in a JSON file shared by the GUI and the CLI
+
+    Every change is a read-modify-write under a lock file, so a CLI adding
+    jobs while the GUI's scheduler runs them cannot lose either's update.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or queue_path()
+
+    def _read(self):
+        data = userdirs.read_json(self.path, {})
+        if data.get('version') != QUEUE_VERSION:
+            data = {}
+        jobs = [Job.from_dict(job) for job in data.get('jobs', [])]
+        return jobs, Limits(**data.get('limits', {}))
+
+    @contextmanager
+    def _lock(self):
+        lock_path = self.path + '.lock'
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(lock_path) > STALE_LOCK_SECONDS:
+                        os.remove(lock_path)
+                        continue
+                except OSError:
+                    continue
+                time.sleep(0.05)
+        try:
+            os.close(fd)
+            yield
+        finally:
+            os.remove(lock_path)
+
+    @contextmanager
+    def edit(self):
+        """Yield (jobs list, limits) to change in place; saved on exit"""
+        with self._lock():
+            jobs, limits = self._read()
+            yield jobs, limits
+            userdirs.write_json(self.path, {'version': QUEUE_VERSION, 'limits': asdict(limits),
+                                            'jobs': [asdict(job) for job in jobs]})
+
+    def jobs(self):
+        return self._read()[0]
+
+    def limits(self):
+        return self._read()[1]
+
+    def set_limits(self, **values):
+        with self.edit() as (_, limits):
+            for name, value in values.items():
+                setattr(limits, name, value)
+
+    def add(self, input_spec, output_path, options, priority=0):
+        job = Job(input_spec, output_path, asdict(options), priority)
+        job.scratch = estimate_scratch(input_spec, options)
+        with self.edit() as (jobs, _):
+            jobs.append(job)
+        return job
+
+    def update(self, job_id, change):
+        """Apply change(job) to one job under the lock; returns the job"""
+        with self.edit() as (jobs, _):
+            for job in jobs:
+                if job.id == job_id:
+                    change(job)
+                    return job
+        raise KeyError(f"No such job: {job_id}")
+
+    def cancel(self, job_id):
+        """Cancel a queued job now, or ask its scheduler to kill a running one"""
+        def change(job):
+            if job.state == QUEUED:
+                job.state, job.finished = CANCELLED, time.time()
+            elif job.state == RUNNING:
+                job.cancel_requested = True
+        return self.update(job_id, change)
+
+    def set_priority(self, job_id, priority):
+        return self.update(job_id, lambda job: setattr(job, 'priority', int(priority)))
+
+    def retry(self, job_id):
+        def change(job):
+            if job.state in FINISHED_STATES:
+                job.state, job.error, job.cancel_requested = QUEUED, None, False
+        return self.update(job_id, change)
+
+    def remove(self, job_ids):
+        """Drop queued or finished jobs; running ones must be cancelled first"""
+        with self.edit() as (jobs, _):
+            jobs[:] = [job for job in jobs if job.id not in job_ids or job.state == RUNNING]
+
+    def clear_finished(self):
+        with self.edit() as (jobs, _):
+            jobs[:] = [job for job in jobs if job.state not in FINISHED_STATES]
+
+
+def job_command(job, cores, memory):
+    """The CLI invocation that runs a job with its share of the machine"""
+    options = replace(job.conversion_options(), workers=cores,
+                      max_memory=job.options.get('max_memory') or memory)
+    if getattr(sys, 'frozen', False):
+        # The bundled app runs CLI commands itself when given one
+        prefix = [sys.executable]
+    else:
+        prefix = [sys.executable, '-m', 'hillshade']
+    return prefix + cli.convert_arguments(job.input, job.output, options) + ['--json']
+
+
+def kill_tree(process):
+    """Terminate a job and every process it started (GDAL tools, tiler workers)"""
+    if process.poll() is not None:
+        return
+    if sys.platform == 'win32':
+        subprocess.run(['taskkill', '/T', '/F', '/PID', str(process.pid)],
+                       capture_output=True)
+        return
+    # Each job leads its own process group; see Scheduler._launch
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(KILL_GRACE_SECONDS)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+class Scheduler:
+    """Start queued jobs, highest priority first, while their reservations fit
+
+    A job reserves its --workers cores (by default an even share of the
+    limit across the jobs waiting), memory in proportion to its cores unless
+    it sets max_memory, and its estimated scratch space. Both are passed to
+    the child as --workers and --max-memory so it stays inside them. A job
+    that does not fit lets smaller ones behind it start, so no core idles.
+    Jobs left running by a scheduler that died are requeued; resumable
+    conversions then continue from their checkpoints.
+    """
+
+    def __init__(self, queue=None, log=print, poll_seconds=1.0):
+        self.queue = queue or JobQueue()
+        self.log = log
+        self.poll_seconds = poll_seconds
+        # Live progress of running jobs: id -> (percent, last message)
+        self.progress = {}
+        self._processes = {}
+        # Ids of jobs whose process is being killed; cleared when it is reaped
+        self._killing = set()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._shutting_down = False
+        # Set by a tick that found nothing running and no waiting job that fits
+        self._stalled = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping = self._shutting_down = False
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self):
+        """Stop starting jobs; running ones carry on to the end"""
+        self._stopping = True
+        self._wake.set()
+
+    def shutdown(self):
+        """Stop, kill running jobs and put them back in the queue for the next start"""
+        self.stop()
+        # Requeue before killing: a killed job's follower must not record it as failed
+        self._shutting_down = True
+        processes = dict(self._processes)
+        with self.queue.edit() as (jobs, _):
+            for job in jobs:
+                if job.id in processes and job.state == RUNNING:
+                    job.state, job.owner = QUEUED, None
+        for process in processes.values():
+            kill_tree(process)
+        if processes:
+            self.log(f"Stopped {len(processes)} running job(s); they resume on the next start")
+
+    def running(self):
+        return list(self._processes)
+
+    def idle(self):
+        """True when nothing runs here and nothing is waiting to run"""
+        return not self._processes and not any(job.state == QUEUED for job in self.queue.jobs())
+
+    def stalled(self):
+        """True when nothing runs here and no queued job fits in what is free"""
+        return self._stalled and not self._processes
+
+    def wait(self):
+        """Block until the queue has drained, or until no queued job can start"""
+        while not self.idle():
+            if self.stalled():
+                waiting = sum(job.state == QUEUED for job in self.queue.jobs())
+                self.log(f"{waiting} queued job(s) cannot start with the free cores, "
+                         "memory and disk space")
+                return
+            time.sleep(self.poll_seconds)
+
+    def _run(self):
+        while not self._stopping:
+            try:
+                self._tick()
+            except Exception as e:  # A bad queue file must not kill the scheduler
+                self.log(f"Job scheduler error: {e}")
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+
+    def _tick(self):
+        with self.queue.edit() as (jobs, limits):
+            limits = limits.resolved()
+            for job in jobs:
+                if job.state != RUNNING:
+                    continue
+                if job.owner == os.getpid():
+                    if (job.cancel_requested and job.id in self._processes
+                            and job.id not in self._killing):
+                        self._killing.add(job.id)
+                        self.log(f"Cancelling job {job.id}")
+                        threading.Thread(target=kill_tree, args=(self._processes[job.id],),
+                                         daemon=True).start()
+                elif not userdirs.pid_alive(job.owner):
+                    self.log(f"Requeueing job {job.id}: its scheduler is gone")
+                    job.state, job.owner = QUEUED, None
+            self._start_ready(jobs, limits)
+
+    def _start_ready(self, jobs, limits):
+        running = [job for job in jobs if job.state == RUNNING]
+        free_cores = limits.cores - sum(job.cores for job in running)
+        free_memory = (None if limits.memory is None
+                       else limits.memory - sum(job.memory or 0 for job in running))
+        used_scratch = sum(job.scratch for job in running)
+        waiting = sorted((job for job in jobs if job.state == QUEUED),
+                         key=lambda job: (-job.priority, job.created))
+        self._stalled = False
+        started = 0
+        for index, job in enumerate(waiting):
+            if self._stopping or free_cores < 1:
+                return
+            cores = job.options.get('workers') or max(
+                1, limits.cores // max(1, len(running) + len(waiting) - index))
+            cores = min(cores, limits.cores)
+            memory = job.options.get('max_memory')
+            if memory is None and limits.memory is not None:
+                memory = int(limits.memory * cores / limits.cores)
+            reason = self._never_fits(job, memory, limits)
+            if reason:
+                job.state, job.finished, job.error = FAILED, time.time(), reason
+                self.log(f"Job {job.id} failed: {reason}")
+                continue
+            if cores > free_cores or (free_memory is not None and (memory or 0) > free_memory):
+                continue
+            if limits.scratch is not None and used_scratch + job.scratch > limits.scratch:
+                continue
+            if not self._disk_has_room(job, running):
+                continue
+            self._launch(job, cores, memory)
+            started += 1
+            running.append(job)
+            free_cores -= cores
+            if free_memory is not None:
+                free_memory -= memory or 0
+            used_scratch += job.scratch
+        self._stalled = not running and not started
+
+    @staticmethod
+    def _never_fits(job, memory, limits):
+        """Why a job's reservation exceeds the limits even with nothing else running"""
+        if limits.memory is not None and (memory or 0) > limits.memory:
+            return (f"needs {memory / 1073741824.0:.1f} GB of memory but the queue's limit is "
+                    f"{limits.memory / 1073741824.0:.1f} GB")
+        if limits.scratch is not None and job.scratch > limits.scratch:
+            return (f"needs {job.scratch / 1073741824.0:.1f} GB of scratch space but the "
+                    f"queue's limit is {limits.scratch / 1073741824.0:.1f} GB")
+        try:
+            disk = shutil.disk_usage(os.path.dirname(os.path.abspath(job.output))).total
+        except OSError:
+            return None
+        if job.scratch > disk:
+            return (f"needs {job.scratch / 1073741824.0:.1f} GB of scratch space but its "
+                    f"output disk holds {disk / 1073741824.0:.1f} GB")
+        return None
+
+    @staticmethod
+    def _disk_has_room(job, running):
+        folder = os.path.dirname(os.path.abspath(job.output))
+        try:
+            free = shutil.disk_usage(folder).free
+        except OSError:
+            return True  # Let the job itself report the missing folder
+        reserved = sum(other.scratch for other in running
+                       if os.path.dirname(os.path.abspath(other.output)) == folder)
+        return job.scratch <= free - reserved
+
+    def _launch(self, job, cores, memory):
+        command = job_command(job, cores, memory)
+        kwargs = {}
+        if sys.platform == 'win32':
+            kwargs['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            # A process group of its own, so cancelling reaches GDAL's children too
+            kwargs['start_new_session'] = True
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                   stdin=subprocess.DEVNULL, text=True, errors='replace',
+                                   **kwargs)
+        job.state, job.started, job.finished, job.error = RUNNING, time.time(), None, None
+        job.cores, job.memory, job.owner = cores, memory, os.getpid()
+        self._processes[job.id] = process
+        self.progress[job.id] = (0.0, "Starting")
+        memory_text = f", {memory / 1073741824.0:.1f} GB" if memory else ""
+        self.log(f"Started job {job.id} ({cores} cores{memory_text}): {job.input}")
+        threading.Thread(target=self._follow, args=(job.id, process), daemon=True).start()
+
+    def _follow(self, job_id, process):
+        """Track a job's JSON event stream, then record how it ended"""
+        error = None
+        for line in process.stdout:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                event = {'event': 'log', 'message': line.rstrip()}
+            percent, message = self.progress.get(job_id, (0.0, ''))
+            kind = event.get('event')
+            if kind == 'progress':
+                percent = float(event['percent'])
+            elif kind == 'log':
+                message = event.get('message', '')
+            elif kind == 'error':
+                error = event.get('message')
+            self.progress[job_id] = (percent, message)
+        returncode = process.wait()
+
+        def change(job):
+            if job.state != RUNNING or job.owner != os.getpid():
+                return  # Requeued by shutdown()
+            if self._shutting_down and not job.cancel_requested and returncode != 0:
+                # Killed by shutdown() between its requeue and now; resume next time
+                job.state, job.owner = QUEUED, None
+                return
+            if job.cancel_requested:
+                job.state = CANCELLED
+            elif returncode == 0:
+                job.state = DONE
+            else:
+                job.state = FAILED
+                job.error = error or f"Exited with code {returncode}"
+            job.finished, job.owner, job.cancel_requested = time.time(), None, False
+        job = self.queue.update(job_id, change)
+        self._processes.pop(job_id, None)
+        self._killing.discard(job_id)
+        self.progress.pop(job_id, None)
+        if job.state != QUEUED:
+            self.log(f"Job {job_id} {job.state}" + (f": {job.error}" if job.error else ""))
+        self._wake.set()
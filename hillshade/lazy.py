@@ -0,0 +1,39 @@
+"""
+Deferred imports
+NumPy, GDAL, PIL and tkinter cost hundreds of milliseconds to import; modules
+bind them through lazy_import() so only the code paths that use them pay
+"""
+
+import importlib
+
+
+class LazyModule:
+    """Stand-in for a module that imports it on first attribute access"""
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            module = importlib.import_module(self.__dict__['_name'])
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_module'] is not None else 'not loaded'
+        return f"<lazy module {self.__dict__['_name']!r} ({state})>"
+
+
+def lazy_import(name):
+    """Return a proxy for module `name` that imports it when first used
+
+    PyInstaller cannot see these imports; frozen builds list them in
+    hiddenimports instead.
+    """
+    return LazyModule(name)
+
@@ -0,0 +1,50 @@
+"""
+Thread-safe log sink
+Worker threads post log lines, progress and status; a UI thread drains them
+in batches on its own schedule instead of being called once per line
+"""
+
+import threading
+from collections import deque, namedtuple
+
+Drained = namedtuple('Drained', ['lines', 'dropped', 'progress', 'status'])
+
+
+class QueueSink:
+    """Bounded queue of pending log lines plus the latest progress/status
+
+    Only the newest max_lines are kept: anything older would be trimmed
+    from the scrollback immediately anyway. Progress and status are
+    latest-value-wins, so a burst of updates costs one redraw.
+    """
+
+    def __init__(self, max_lines=5000):
+        self._lock = threading.Lock()
+        self._lines = deque(maxlen=max_lines)
+        self._dropped = 0
+        self._progress = None
+        self._status = None
+
+    def log(self, message):
+        with self._lock:
+            if len(self._lines) == self._lines.maxlen:
+                self._dropped += 1
+            self._lines.append(message)
+
+    def progress(self, percent):
+        with self._lock:
+            self._progress = percent
+
+    def status(self, update):
+        with self._lock:
+            self._status = update
+
+    def drain(self):
+        """Take everything posted since the last drain"""
+        with self._lock:
+            drained = Drained(list(self._lines), self._dropped, self._progress, self._status)
+            self._lines.clear()
+            self._dropped = 0
+            self._progress = None
+            self._status = None
+        return drained
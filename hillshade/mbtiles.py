@@ -0,0 +1,437 @@
+"""
+MBTiles output
+Batched, deduplicating writer for tiles produced by the built-in tiler
+"""
+
+import hashlib
+import math
+import os
+import sqlite3
+
+# New files use the deduplicating layout popularised by mbutil: each distinct
+# tile image is stored once in `images`, `map` points tile coordinates at it
+# and the standard `tiles` table becomes a view over the two.
+DEDUP_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT);
+    CREATE UNIQUE INDEX IF NOT EXISTS name ON metadata (name);
+    CREATE TABLE IF NOT EXISTS map (
+        zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_id TEXT);
+    CREATE UNIQUE INDEX IF NOT EXISTS map_index
+        ON map (zoom_level, tile_column, tile_row);
+    CREATE TABLE IF NOT EXISTS images (tile_data BLOB, tile_id TEXT);
+    CREATE UNIQUE INDEX IF NOT EXISTS images_id ON images (tile_id);
+    CREATE VIEW IF NOT EXISTS tiles AS
+        SELECT map.zoom_level AS zoom_level,
+               map.tile_column AS tile_column,
+               map.tile_row AS tile_row,
+               images.tile_data AS tile_data
+        FROM map JOIN images ON images.tile_id = map.tile_id;
+"""
+
+TILE_KEY = ('zoom_level', 'tile_column', 'tile_row')
+# SQLite accepts powers of two in this range
+PAGE_SIZES = tuple(1 << n for n in range(9, 17))
+
+FLAT_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT);
+    CREATE UNIQUE INDEX IF NOT EXISTS name ON metadata (name);
+    CREATE TABLE IF NOT EXISTS tiles (
+        zoom_level INTEGER, tile_column INTEGER,
+        tile_row INTEGER, tile_data BLOB);
+    CREATE UNIQUE INDEX IF NOT EXISTS tile_index
+        ON tiles (zoom_level, tile_column, tile_row);
+"""
+
+
+def tile_id(data):
+    """Content hash used to deduplicate identical tile images"""
+    return hashlib.md5(data).hexdigest()
+
+
+def xyz_to_tms(z, y):
+    return (1 << z) - 1 - y
+
+
+def has_dedup_schema(conn):
+    row = conn.execute(
+        "SELECT type FROM sqlite_master WHERE name = 'tiles'").fetchone()
+    return row is not None and row[0] == 'view'
+
+
+def tiles_per_zoom(conn):
+    """Return {zoom: tile count}, counted on the index rather than the tile blobs"""
+    table = tile_table(conn)
+    return dict(conn.execute(
+        f"SELECT zoom_level, COUNT(*) FROM {table} GROUP BY zoom_level ORDER BY zoom_level"))
+
+
+def read_metadata(conn):
+    """Return the metadata table as a {name: value} dict"""
+    return dict(conn.execute("SELECT name, value FROM metadata"))
+
+
+def write_metadata(conn, metadata):
+    """Set metadata values; works without a unique index on name (GDAL's files)"""
+    for name, value in metadata.items():
+        conn.execute("DELETE FROM metadata WHERE name = ?", (name,))
+        conn.execute("INSERT INTO metadata (name, value) VALUES (?, ?)", (name, str(value)))
+
+
+def tile_table(conn):
+    """Table holding the tile coordinates: `map` in the deduplicating layout"""
+    return 'map' if has_dedup_schema(conn) else 'tiles'
+
+
+def unique_tile_index(conn, table):
+    """Name of a unique index on exactly (zoom_level, tile_column, tile_row), or None"""
+    for row in conn.execute(f"PRAGMA index_list({table})").fetchall():
+        name, unique = row[1], row[2]
+        columns = tuple(info[2] for info in conn.execute(f'PRAGMA index_info("{name}")'))
+        if unique and columns == TILE_KEY:
+            return name
+    return None
+
+
+def ensure_tile_index(conn):
+    """Create the unique tile coordinate index if missing; returns duplicates removed
+
+    Duplicate coordinates (possible in files written without the index)
+    keep their most recently inserted row.
+    """
+    table = tile_table(conn)
+    if unique_tile_index(conn, table) is not None:
+        return 0
+    cursor = conn.execute(
+        f"DELETE FROM {table} WHERE rowid NOT IN "
+        f"(SELECT MAX(rowid) FROM {table} GROUP BY {', '.join(TILE_KEY)})")
+    name = 'map_index' if table == 'map' else 'tile_index'
+    conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(TILE_KEY)})")
+    return cursor.rowcount
+
+
+def _floats(text, count):
+    """Comma-separated numbers, or None if text is missing or malformed"""
+    try:
+        values = [float(v) for v in str(text).split(',')]
+    except ValueError:
+        return None
+    return values if len(values) == count else None
+
+
+def tile_lonlat(zoom, x, y):
+    """Longitude and latitude of the top-left corner of XYZ tile (x, y)"""
+    n = 1 << zoom
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2.0 * y / n))))
+    return x * 360.0 / n - 180.0, lat
+
+
+def lonlat_tile(zoom, lon, lat):
+    """XYZ tile (x, y) containing a longitude and latitude, clamped to the grid"""
+    n = 1 << zoom
+    lat = max(min(lat, 85.0511287798), -85.0511287798)
+    y = (1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n
+    clamp = lambda v: min(max(int(math.floor(v)), 0), n - 1)
+    return clamp((lon + 180.0) / 360.0 * n), clamp(y)
+
+
+def complete_metadata(conn):
+    """Set minzoom/maxzoom from the stored tiles, and bounds/center where missing
+
+    Only the coordinate index is read: zoom extremes, and the tile range
+    at the max zoom for the bounds. Returns the values written.
+    """
+    table = tile_table(conn)
+    min_zoom, max_zoom = conn.execute(
+        f"SELECT MIN(zoom_level), MAX(zoom_level) FROM {table}").fetchone()
+    if min_zoom is None:
+        return {}
+    stored = read_metadata(conn)
+    updates = {'minzoom': min_zoom, 'maxzoom': max_zoom}
+    bounds = _floats(stored.get('bounds'), 4)
+    if bounds is None:
+        x0, x1, row0, row1 = conn.execute(
+            f"SELECT MIN(tile_column), MAX(tile_column), MIN(tile_row), MAX(tile_row) "
+            f"FROM {table} WHERE zoom_level = ?", (max_zoom,)).fetchone()
+        west, north = tile_lonlat(max_zoom, x0, xyz_to_tms(max_zoom, row1))
+        east, south = tile_lonlat(max_zoom, x1 + 1, xyz_to_tms(max_zoom, row0) + 1)
+        bounds = [west, south, east, north]
+        updates['bounds'] = ','.join(f'{v:.6f}' for v in bounds)
+    if _floats(stored.get('center'), 3) is None:
+        updates['center'] = (f'{(bounds[0] + bounds[2]) / 2:.6f},'
+                             f'{(bounds[1] + bounds[3]) / 2:.6f},{min_zoom}')
+    write_metadata(conn, updates)
+    return updates
+
+
+def finalize(path, vacuum=False, page_size=None):
+    """Prepare a finished MBTiles for readers
+
+    Ensures the unique coordinate index, completes the metadata, runs
+    ANALYZE so the query planner has statistics, and with vacuum (implied
+    by page_size) rewrites the file compactly. Returns what was done.
+    """
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA journal_mode = DELETE")
+        with conn:
+            duplicates = ensure_tile_index(conn)
+            metadata = complete_metadata(conn)
+        conn.execute("ANALYZE")
+        vacuumed = bool(vacuum or page_size)
+        if page_size:
+            if page_size not in PAGE_SIZES:
+                raise ValueError(f"Invalid page size {page_size} "
+                                 f"(expected a power of two from 512 to 65536)")
+            conn.execute(f"PRAGMA page_size = {int(page_size)}")
+        if vacuumed:
+            conn.execute("VACUUM")
+        return {'duplicates_removed': duplicates, 'metadata': metadata,
+                'vacuumed': vacuumed,
+                'page_size': conn.execute("PRAGMA page_size").fetchone()[0]}
+    finally:
+        conn.close()
+
+
+def expected_tiles(conn, zooms):
+    """{zoom: tiles in the metadata bounds' tile range}, or {} without bounds"""
+    bounds = _floats(read_metadata(conn).get('bounds'), 4)
+    if bounds is None:
+        return {}
+    west, south, east, north = bounds
+    expected = {}
+    for zoom in zooms:
+        x0, y0 = lonlat_tile(zoom, west, north)
+        x1, y1 = lonlat_tile(zoom, east, south)
+        expected[zoom] = (x1 - x0 + 1) * (y1 - y0 + 1)
+    return expected
+
+
+def tile_report(conn, expected=None, sizes=False):
+    """Per zoom: tiles, bytes, expected tiles and corrupt tiles
+
+    By default only indexes are read: the coordinate index for counts and
+    coordinate checks, and the image id index for map entries without an
+    image, so this takes seconds even on multi-GB files. With sizes the
+    tile bytes are summed and empty (zero-length or NULL) tiles found too,
+    which reads a page of every tile; otherwise bytes and empty are None.
+    expected maps zoom to a tile count (e.g. from a coverage index); by
+    default it is the tile range of the metadata bounds. Corrupt tiles are
+    empty ones, map entries without an image, and coordinates outside the
+    zoom's grid.
+    """
+    table = tile_table(conn)
+    unmeasured = 0 if sizes else None
+    report = {}
+    for zoom, tiles, invalid in conn.execute(
+            f"SELECT zoom_level, COUNT(*), SUM(tile_column < 0 OR tile_row < 0 "
+            f"OR tile_column >= (1 << zoom_level) OR tile_row >= (1 << zoom_level)) "
+            f"FROM {table} GROUP BY zoom_level ORDER BY zoom_level"):
+        report[zoom] = {'tiles': tiles, 'bytes': unmeasured, 'expected': None,
+                        'empty': unmeasured, 'dangling': 0, 'invalid': invalid}
+    if table == 'map':
+        # Covered by the unique index on images.tile_id; no image page is read
+        for zoom, dangling in conn.execute(
+                "SELECT map.zoom_level, COUNT(*) FROM map "
+                "LEFT JOIN images ON images.tile_id = map.tile_id "
+                "WHERE images.tile_id IS NULL GROUP BY map.zoom_level"):
+            report[zoom]['dangling'] = dangling
+    if sizes:
+        if table == 'map':
+            rows = conn.execute(
+                "SELECT map.zoom_level, SUM(length(images.tile_data)), "
+                "SUM(IFNULL(length(images.tile_data), 0) = 0) "
+                "FROM map JOIN images ON images.tile_id = map.tile_id "
+                "GROUP BY map.zoom_level")
+        else:
+            rows = conn.execute(
+                "SELECT zoom_level, SUM(length(tile_data)), "
+                "SUM(IFNULL(length(tile_data), 0) = 0) FROM tiles GROUP BY zoom_level")
+        for zoom, size, empty in rows:
+            report[zoom].update(bytes=size or 0, empty=empty)
+    if expected is None:
+        expected = expected_tiles(conn, report)
+    for zoom in expected:
+        report.setdefault(zoom, {'tiles': 0, 'bytes': unmeasured, 'expected': None,
+                                 'empty': unmeasured, 'dangling': 0, 'invalid': 0})
+    report = dict(sorted(report.items()))
+    for zoom, row in report.items():
+        row['expected'] = expected.get(zoom)
+        row['corrupt'] = (row['empty'] or 0) + row['dangling'] + row['invalid']
+    return report
+
+
+class MBTilesWriter:
+    """Write tiles (XYZ addressing) into an MBTiles 1.3 file
+
+    Tiles are buffered and inserted batch_size at a time in one transaction.
+    The pragmas trade crash durability of the last batch for throughput; the
+    file is consistent again after close(). Existing files keep whichever
+    layout they already have, so GDAL-written outputs can be updated too.
+    With shared, the connection may be used from several threads; the
+    caller then serializes access itself.
+    """
+
+    def __init__(self, path, metadata=None, batch_size=2000, dedup=True,
+                 page_size=32768, journal_mode='WAL', synchronous='NORMAL', shared=False):
+        self.path = os.fspath(path)
+        self.batch_size = batch_size
+        self.tiles_written = 0
+        self.images_written = 0
+        self.bytes_written = 0
+        self._pending = []
+
+        is_new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        # Upserts into an existing file can orphan images; prune them on close
+        self._may_orphan = not is_new
+        self.conn = sqlite3.connect(self.path, check_same_thread=not shared)
+        if is_new:
+            # page_size only takes effect before the first table is created
+            self.conn.execute(f"PRAGMA page_size = {int(page_size)}")
+        self.conn.execute(f"PRAGMA journal_mode = {journal_mode}")
+        self.conn.execute(f"PRAGMA synchronous = {synchronous}")
+        self.conn.execute("PRAGMA temp_store = MEMORY")
+        self.conn.execute("PRAGMA cache_size = -65536")  # 64 MB
+
+        if is_new:
+            self.conn.executescript(DEDUP_SCHEMA if dedup else FLAT_SCHEMA)
+            self.dedup = dedup
+        else:
+            self.dedup = has_dedup_schema(self.conn)
+            self.conn.executescript(DEDUP_SCHEMA if self.dedup else FLAT_SCHEMA)
+        if metadata:
+            self.set_metadata(metadata)
+
+    def set_metadata(self, metadata):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)",
+                [(name, str(value)) for name, value in metadata.items()])
+
+    def add_tile(self, z, x, y, data):
+        """Queue one tile; y is XYZ (top origin)"""
+        self._pending.append((z, x, y, data))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def write_tiles(self, tiles):
+        """Queue (z, x, y, data) tuples and return how many were queued"""
+        count = 0
+        for tile in tiles:
+            self.add_tile(*tile)
+            count += 1
+        return count
+
+    def flush(self):
+        """Insert all queued tiles in a single transaction"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        with self.conn:
+            if self.dedup:
+                self._insert_dedup(pending)
+            else:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data) "
+                    "VALUES (?, ?, ?, ?)",
+                    [(z, x, xyz_to_tms(z, y), sqlite3.Binary(data))
+                     for z, x, y, data in pending])
+                self.images_written += len(pending)
+                self.bytes_written += sum(len(t[3]) for t in pending)
+        self.tiles_written += len(pending)
+
+    def _insert_dedup(self, pending):
+        # The unique index on images.tile_id is the only record of what is
+        # stored, so memory stays flat however many distinct tiles are written
+        images = {}
+        rows = []
+        for z, x, y, data in pending:
+            tid = tile_id(data)
+            images.setdefault(tid, data)
+            rows.append((z, x, xyz_to_tms(z, y), tid))
+        for tid, data in images.items():
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO images (tile_data, tile_id) VALUES (?, ?)",
+                (sqlite3.Binary(data), tid))
+            if cursor.rowcount > 0:
+                self.images_written += 1
+                self.bytes_written += len(data)
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO map (zoom_level, tile_column, tile_row, tile_id) "
+            "VALUES (?, ?, ?, ?)", rows)
+
+    def checkpoint(self):
+        """Flush queued tiles and sync them to the main database file"""
+        self.flush()
+        self.conn.execute("PRAGMA wal_checkpoint(FULL)")
+
+    def read_tile(self, z, x, y):
+        """Return the stored tile data for XYZ coordinates, or None"""
+        self.flush()
+        row = self.conn.execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? "
+            "AND tile_row = ?", (z, x, xyz_to_tms(z, y))).fetchone()
+        return None if row is None else bytes(row[0])
+
+    def read_rows(self, z, y_start, y_stop):
+        """Return {(x, y): data} for XYZ rows y_start..y_stop (inclusive) of zoom z
+
+        Queued tiles are not flushed first; call flush() if they are needed.
+        """
+        n = 1 << z
+        rows = self.conn.execute(
+            "SELECT tile_column, tile_row, tile_data FROM tiles WHERE zoom_level = ? "
+            "AND tile_row BETWEEN ? AND ?",
+            (z, xyz_to_tms(z, y_stop), xyz_to_tms(z, y_start))).fetchall()
+        return {(x, n - 1 - row): bytes(data) for x, row, data in rows}
+
+    def read_range(self, z, x0, y0, x1, y1):
+        """Return {(x, y): data} for the inclusive XYZ range x0..x1, y0..y1 of zoom z
+
+        Queued tiles are not flushed first; call flush() if they are needed.
+        """
+        n = 1 << z
+        rows = self.conn.execute(
+            "SELECT tile_column, tile_row, tile_data FROM tiles WHERE zoom_level = ? "
+            "AND tile_column BETWEEN ? AND ? AND tile_row BETWEEN ? AND ?",
+            (z, x0, x1, xyz_to_tms(z, y1), xyz_to_tms(z, y0))).fetchall()
+        return {(x, n - 1 - row): bytes(data) for x, row, data in rows}
+
+    def delete_tiles(self, z, coords):
+        """Remove the stored tiles at XYZ (x, y) coords of zoom z; returns how many"""
+        self.flush()
+        table = 'map' if self.dedup else 'tiles'
+        before = self.conn.total_changes
+        with self.conn:
+            self.conn.executemany(
+                f"DELETE FROM {table} WHERE zoom_level = ? AND tile_column = ? "
+                "AND tile_row = ?", [(z, x, xyz_to_tms(z, y)) for x, y in coords])
+        # Only existing files can hold tiles to delete, so close() prunes images
+        return self.conn.total_changes - before
+
+    def prune_images(self):
+        """Drop images no longer referenced by any map entry"""
+        if not self.dedup:
+            return 0
+        with self.conn:
+            cursor = self.conn.execute(
+                "DELETE FROM images WHERE tile_id NOT IN (SELECT tile_id FROM map)")
+        return cursor.rowcount
+
+    def close(self):
+        if self.conn is None:
+            return
+        try:
+            self.flush()
+            if self._may_orphan:
+                self.prune_images()
+            # Fold the WAL back so the output is a single self-contained file
+            self.conn.execute("PRAGMA journal_mode = DELETE")
+        finally:
+            self.conn.close()
+            self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
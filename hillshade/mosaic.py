@@ -0,0 +1,114 @@
+"""
+Batch / mosaic input
+Turn a directory or glob of DEM tiles into one seamless virtual raster
+"""
+
+import atexit
+import glob
+import os
+import shutil
+import tempfile
+
+from hillshade.lazy import lazy_import
+
+engine = lazy_import('hillshade.engine')
+
+DEM_EXTENSIONS = ('.tif', '.tiff', '.img', '.asc')
+# Used for gaps between tiles when the tiles themselves declare no nodata
+DEFAULT_NODATA = -32768.0
+
+
+def is_mosaic(spec):
+    """True if the input is a directory or glob rather than a single file"""
+    return not os.path.isfile(spec)
+
+
+def resolve_inputs(spec):
+    """Expand an input spec (file, directory or glob) into DEM file paths"""
+    if os.path.isfile(spec):
+        return [spec]
+    if os.path.isdir(spec):
+        files = []
+        for dirpath, _, filenames in os.walk(spec):
+            files += [os.path.join(dirpath, name) for name in filenames
+                      if name.lower().endswith(DEM_EXTENSIONS)]
+    else:
+        files = [path for path in glob.glob(spec, recursive=True) if os.path.isfile(path)]
+    if not files:
+        raise FileNotFoundError(f"No DEM files found for input: {spec}")
+    return sorted(files)
+
+
+def _member_nodata(files):
+    """Common nodata of the members, or None if they disagree or have none"""
+    gdal = engine.require_gdal()
+    values = set()
+    projections = {}
+    for path in files:
+        ds = gdal.Open(path)
+        band = ds.GetRasterBand(1)
+        values.add(band.GetNoDataValue())
+        projections.setdefault(ds.GetProjection(), path)
+    if len(projections) > 1:
+        sample = '\n'.join(f"  {path}" for path in list(projections.values())[:3])
+        raise ValueError(
+            "Mosaic inputs use different coordinate systems; reproject them to a "
+            f"common CRS first. For example these differ:\n{sample}")
+    return values.pop() if len(values) == 1 else None
+
+
+def build_vrt(files, vrt_path):
+    """Build a VRT mosaic of files (GDAL Python bindings)"""
+    gdal = engine.require_gdal()
+    nodata = _member_nodata(files)
+    options = gdal.BuildVRTOptions(
+        resolution='highest',
+        srcNodata=None if nodata is None else nodata,
+        VRTNodata=DEFAULT_NODATA if nodata is None else nodata)
+    ds = gdal.BuildVRT(vrt_path, files, options=options)
+    if ds is None:
+        raise RuntimeError(f"Could not build mosaic from {len(files)} files")
+    ds.FlushCache()
+    ds = None
+    return vrt_path
+
+
+def build_vrt_command(files, vrt_path, list_path):
+    """gdalbuildvrt command line for the CLI fallback"""
+    with open(list_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(files) + '\n')
+    return ['gdalbuildvrt', '-overwrite', '-resolution', 'highest',
+            '-vrtnodata', str(DEFAULT_NODATA),
+            '-input_file_list', list_path, vrt_path]
+
+
+class SourceResolver:
+    """Resolve input specs to a readable DEM, caching mosaic VRTs per spec"""
+
+    def __init__(self):
+        self.mosaic_dir = None
+        self._cache = {}
+
+    def resolve(self, spec, log=print, run_command=None):
+        """Return (path to read, member files) for a file, folder or glob"""
+        files = resolve_inputs(spec)
+        if not is_mosaic(spec):
+            return spec, files
+
+        # Rebuild only when the set of member files changed
+        cached = self._cache.get(spec)
+        if cached and cached[0] == tuple(files) and os.path.exists(cached[1]):
+            return cached[1], files
+
+        if self.mosaic_dir is None:
+            self.mosaic_dir = tempfile.mkdtemp(prefix='hillshade_mosaic_')
+            atexit.register(shutil.rmtree, self.mosaic_dir, True)
+        vrt_path = os.path.join(self.mosaic_dir, f'mosaic_{len(self._cache)}.vrt')
+        log(f"Building seamless mosaic of {len(files)} DEM tiles...")
+        if engine.is_available():
+            build_vrt(files, vrt_path)
+        else:
+            run_command(build_vrt_command(files, vrt_path,
+                                          vrt_path.replace('.vrt', '_files.txt')))
+        self._cache[spec] = (tuple(files), vrt_path)
+        return vrt_path, files
@@ -0,0 +1,1243 @@
+"""
+Conversion pipeline
+GUI-free conversion and preview API shared by the desktop app and the CLI
+"""
+
+import codecs
+import contextlib
+import cProfile
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import uuid
+from dataclasses import asdict, dataclass, replace
+from typing import List, Optional, Tuple
+
+from hillshade import (checkpoint, encoding, gdalprofile, instrument, mbtiles, mosaic, pmtiles,
+                       stagecache)
+from hillshade.progress import GdalProgressParser, StageProgress
+from hillshade.lazy import lazy_import
+
+# Only loaded once a preview or conversion actually runs
+np = lazy_import('numpy')
+engine = lazy_import('hillshade.engine')
+tiler = lazy_import('hillshade.tiler')
+coverage = lazy_import('hillshade.coverage')
+
+WEB_MERCATOR = 'EPSG:3857'
+
+# File names of the intermediates in the stage cache (or work directory)
+HILLSHADE_FILE = 'hillshade.tif'
+MERCATOR_FILE = 'hillshade_mercator.tif'
+
+# Preview is rendered from a decimated DEM; never at full resolution
+PREVIEW_DISPLAY_SIZE = 580
+PREVIEW_MAX_SIZE = 2048
+
+_MEMORY_UNITS = {'': 1, 'B': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+
+@dataclass
+class ConversionOptions:
+    """Parameters of one conversion or preview"""
+    z_factor: float = 1.0
+    azimuth: float = 315.0
+    altitude: float = 45.0
+    # Weighted lights (azimuth, altitude, weight) blended in place of azimuth/altitude
+    lights: Optional[List[Tuple[float, float, float]]] = None
+    # Weight of slope shading (flat bright, steep dark) in the blend
+    slope_weight: float = 0.0
+    min_zoom: int = 10
+    max_zoom: int = 17
+    # Stream without intermediate files
+    stream: bool = True
+    # Built-in process-pool tiler instead of GDAL's MBTiles driver
+    native_tiler: bool = True
+    # Skip tiles without data using a coverage index of the DEM (built-in tiler only)
+    coverage_index: bool = True
+    # Checkpoint progress in <output>.job.json
+    resumable: bool = True
+    # Keep intermediate rasters in the stage cache for later runs and reuse them
+    stage_cache: bool = True
+    # VACUUM the finished MBTiles, optionally to this SQLite page size
+    vacuum: bool = False
+    page_size: Optional[int] = None
+    # Tiler worker processes (default: one per core)
+    workers: Optional[int] = None
+    # Peak memory budget in bytes for in-process work (None: unlimited)
+    max_memory: Optional[int] = None
+    # GDAL block cache, thread count and warp memory for this run (None: the
+    # saved or detected performance profile, see gdalprofile)
+    gdal_cache: Optional[int] = None
+    gdal_threads: Optional[int] = None
+    warp_memory: Optional[int] = None
+    # Tile encoding: png[:LEVEL], webp (lossless), webp:QUALITY or jpeg[:QUALITY]
+    tile_format: str = 'png'
+    # Profile the in-process parts with cProfile into <output>.pstats
+    profile: bool = False
+
+    def shading(self):
+        """Keyword arguments for engine.hillshade"""
+        return {
+            'z_factor': self.z_factor,
+            'azimuth': self.azimuth,
+            'altitude': self.altitude,
+            'lights': self.light_sources(),
+            'slope_weight': self.slope_weight,
+        }
+
+    def light_sources(self):
+        """lights as engine.Light tuples, or None for the single azimuth/altitude light"""
+        if not self.lights:
+            return None
+        return [engine.Light(*map(float, light)) for light in self.lights]
+
+    def blended(self):
+        """Whether the lighting goes beyond what gdaldem hillshade can render"""
+        return bool(self.lights) or bool(self.slope_weight)
+
+    def job_params(self, mode):
+        """Everything that affects the output; a resumed job must match exactly"""
+        return {
+            'mode': mode,
+            'z_factor': self.z_factor,
+            'azimuth': self.azimuth,
+            'altitude': self.altitude,
+            'lights': [list(map(float, light)) for light in self.lights or ()],
+            'slope_weight': self.slope_weight,
+            'min_zoom': self.min_zoom,
+            'max_zoom': self.max_zoom,
+            # The tiler's block layout depends on the memory budget
+            'max_memory': self.max_memory,
+            'tile_format': encoding.spec(self.tile_encoding()),
+        }
+
+    def tile_encoding(self):
+        """tile_format parsed into an encoding.TileEncoding"""
+        return encoding.parse_encoding(self.tile_format)
+
+    def hillshade_params(self, renderer):
+        """What a hillshade raster depends on besides the input: its stage cache key
+
+        renderer is 'numpy' (engine) or 'gdaldem'; their rounding differs.
+        Zoom levels, memory budget and tile format do not matter here.
+        """
+        return {
+            'renderer': renderer,
+            'z_factor': self.z_factor,
+            'azimuth': self.azimuth,
+            'altitude': self.altitude,
+            'lights': [list(map(float, light)) for light in self.lights or ()],
+            'slope_weight': self.slope_weight,
+            'compute_edges': True,
+        }
+
+
+def parse_memory(text):
+    """Parse a size such as '2G', '512M' or '1.5GB' into bytes; None passes through"""
+    if text is None or isinstance(text, int):
+        return text
+    value = str(text).strip().upper()
+    if value.endswith('IB'):
+        value = value[:-2]
+    elif value.endswith('B') and len(value) > 1 and not value[-2].isdigit():
+        value = value[:-1]
+    unit = value[-1] if value and value[-1] in _MEMORY_UNITS else ''
+    number = value[:-1] if unit else value
+    try:
+        size = int(float(number) * _MEMORY_UNITS[unit])
+    except ValueError:
+        raise ValueError(f"Invalid memory size: {text!r} (expected e.g. 2G or 512M)")
+    if size <= 0:
+        raise ValueError(f"Memory size must be positive: {text!r}")
+    return size
+
+
+def mbtiles_creation_options(min_zoom, max_zoom):
+    """GDAL MBTiles creation options used for the tiling step"""
+    return [
+        'TILE_FORMAT=PNG',
+        'RESAMPLING=AVERAGE',
+        f'MINZOOM={min_zoom}',
+        f'MAXZOOM={max_zoom}',
+        'ZOOM_LEVEL_STRATEGY=UPPER',
+    ]
+
+
+def require_engine_for(options):
+    """Refuse lighting the gdaldem fallback cannot reproduce"""
+    if options.blended():
+        raise RuntimeError("Several lights or slope shading need the GDAL Python "
+                           "bindings (osgeo); gdaldem renders a single light only")
+
+
+def gdal_progress(progress, start=0, end=100):
+    """Adapt a 0-100 progress setter to a GDAL progress callback"""
+    if progress is None:
+        return None
+
+    def callback(complete, message, data):
+        progress(start + (end - start) * complete)
+        return 1
+    return callback
+
+
+def unlink_vsimem(path):
+    """Free an in-memory GDAL file, ignoring ones that were never created"""
+    try:
+        engine.require_gdal().Unlink(path)
+    except RuntimeError:
+        pass
+
+
+def stretch_preview(shaded):
+    """Stretch a hillshade array to 0-255 like `gdal_translate -scale`"""
+    lo, hi = int(shaded.min()), int(shaded.max())
+    if hi > lo:
+        stretched = (shaded.astype(np.float32) - lo) * (255.0 / (hi - lo))
+        shaded = (stretched + 0.5).astype(np.uint8)
+    return shaded
+
+
+def check_output_location(output_path, log=print):
+    """Ensure the output directory exists and is writable"""
+    output_dir = os.path.dirname(output_path)
+
+    if output_dir and not os.path.exists(output_dir):
+        log(f"Creating output directory: {output_dir}")
+        os.makedirs(output_dir, exist_ok=True)
+
+    # Check if we can write to the output location
+    if output_dir:
+        test_file = os.path.join(output_dir, '.write_test')
+        try:
+            with open(test_file, 'w') as f:
+                f.write('test')
+            os.remove(test_file)
+        except (PermissionError, OSError) as e:
+            raise PermissionError(
+                f"Cannot write to directory: {output_dir}\n"
+                f"Error: {e}\n\n"
+                f"This directory may have restricted permissions.\n"
+                f"Try saving to a different location like:\n"
+                f"  • Desktop\n"
+                f"  • Documents\n"
+                f"  • A folder you created"
+            )
+
+
+class Pipeline:
+    """Conversion and preview pipeline, independent of any user interface
+
+    log receives one message per call, progress a 0-100 percentage and status
+    a ProgressUpdate; all may be called from whichever thread runs the
+    pipeline, so a GUI should queue them (see logsink.QueueSink).
+    """
+
+    def __init__(self, log=print, progress=None, status=None,
+                 gradient_cache_bytes=1024 * 1024 * 1024):
+        self.log = log
+        self.progress = progress or (lambda percent: None)
+        # Receives progress.ProgressUpdate (stage, throughput, ETA) for long steps
+        self.status = status
+        self.gradient_cache_bytes = gradient_cache_bytes
+        self._gradient_cache = None
+        self.sources = mosaic.SourceResolver()
+        # instrument.RunReport of the conversion in progress, if any
+        self.report = None
+
+    @property
+    def gradient_cache(self):
+        """Slope/aspect terms reused when only the light direction changes"""
+        if self._gradient_cache is None:
+            self._gradient_cache = engine.GradientCache(max_bytes=self.gradient_cache_bytes)
+        return self._gradient_cache
+
+    def run_command(self, cmd, progress=None, env=None):
+        """Run a command and log output
+
+        Output is read in chunks rather than lines so GDAL's `0...10...20`
+        progress bar, which has no newlines, reaches progress (0-100) live.
+        Where os.wait4 exists the child's resource usage (peak RSS, CPU) goes
+        to the run report of the conversion in progress.
+        """
+        self.log(f"Running: {' '.join(cmd)}")
+
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env=env,
+        )
+        parser = GdalProgressParser()
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+        def handle(events):
+            for kind, value in events:
+                if kind == 'line':
+                    self.log(value.strip())
+                elif progress is not None:
+                    progress(value)
+
+        while True:
+            chunk = process.stdout.read1(65536)
+            if not chunk:
+                break
+            handle(parser.feed(decoder.decode(chunk)))
+        handle(parser.feed(decoder.decode(b'', final=True)))
+        handle(parser.finish())
+
+        if hasattr(os, 'wait4'):
+            _, wait_status, rusage = os.wait4(process.pid, 0)
+            process.returncode = instrument.exit_code(wait_status)
+            if self.report is not None:
+                self.report.record_child(rusage)
+        else:
+            process.wait()
+
+        if process.returncode != 0:
+            raise RuntimeError(f"Command failed with exit code {process.returncode}")
+
+    def prepare_source(self, input_spec):
+        """Resolve the input into (readable DEM path, member files)"""
+        return self.sources.resolve(input_spec, log=self.log, run_command=self.run_command)
+
+    def raster_size_cli(self, path):
+        """Read raster dimensions with `gdalinfo -json`"""
+        result = subprocess.run(['gdalinfo', '-json', path],
+                                check=True, capture_output=True, text=True)
+        width, height = json.loads(result.stdout)['size']
+        return width, height
+
+    # ── Preview ──
+
+    def preview(self, input_spec, options, display_size=PREVIEW_DISPLAY_SIZE,
+                max_size=PREVIEW_MAX_SIZE, cancel=None):
+        """Yield (index, count, greyscale array, full source size), coarse first
+
+        The DEM is read decimated for each level, so the full-resolution
+        raster is never rendered. Stops early once cancel (an Event) is set.
+        A level that is the full resolution is kept in the stage cache, so
+        converting with the same shading reuses it.
+        """
+        self.log("\nGenerating hillshade preview...")
+        source_path, source_files = self.prepare_source(input_spec)
+
+        if not engine.is_available():
+            require_engine_for(options)
+            self.progress(50)
+            yield 0, 1, self._preview_cli(source_path, options, max_size), \
+                self.raster_size_cli(source_path)
+            self.progress(100)
+            return
+
+        full_size = engine.raster_size(source_path)
+        levels = engine.preview_levels(full_size[0], full_size[1], display_size, max_size)
+        for index, size in enumerate(levels):
+            if cancel is not None and cancel.is_set():
+                self.log("Preview refinement cancelled")
+                return
+            self.log(f"Rendering preview level {index + 1}/{len(levels)} "
+                     f"({size[0]} x {size[1]})")
+            gradients, hit = self.gradient_cache.gradients_for_file(
+                source_path,
+                z_factor=options.z_factor,
+                compute_edges=True,
+                max_size=max(size),
+                source_files=source_files)
+            if hit:
+                self.log("Reusing cached gradients (only lighting changed)")
+            shaded = engine.shade(gradients, options.azimuth, options.altitude,
+                                  options.light_sources(), options.slope_weight)
+            self.progress(100 * (index + 1) / len(levels))
+            yield index, len(levels), stretch_preview(shaded), full_size
+            if options.stage_cache and tuple(size) == tuple(full_size):
+                self.cache_preview_hillshade(source_path, source_files, options, shaded)
+
+    def cache_preview_hillshade(self, source_path, source_files, options, shaded):
+        """Store a full-resolution preview as the hillshade stage of a later conversion"""
+        try:
+            cache = stagecache.StageCache()
+            key = stagecache.stage_key('hillshade', source_files,
+                                       options.hillshade_params('numpy'))
+            if cache.contains(key, HILLSHADE_FILE):
+                return
+            geotransform, projection = engine.georeference(source_path)
+
+            def write(path):
+                ds = engine.write_hillshade(path, shaded, geotransform, projection,
+                                            creation_options=stagecache.CREATION_OPTIONS)
+                ds.FlushCache()
+            cache.put(key, HILLSHADE_FILE, write, info={'stage': 'hillshade', 'from': 'preview'})
+            cache.release()
+            cache.evict()
+            self.log("Preview hillshade kept in the stage cache for conversion")
+        except (OSError, RuntimeError) as e:
+            self.log(f"Could not cache the preview hillshade: {e}")
+
+    def _preview_cli(self, source_path, options, max_size):
+        """gdaldem fallback: decimate with gdal_translate, then shade"""
+        from PIL import Image
+        temp_dir = tempfile.mkdtemp(prefix='hillshade_preview_')
+        try:
+            full_size = self.raster_size_cli(source_path)
+            dem_path = source_path
+            size = engine.decimated_size(full_size[0], full_size[1], max_size)
+            if size != full_size:
+                # Decimate the DEM before shading
+                dem_path = os.path.join(temp_dir, 'dem_preview.tif')
+                self.run_command([
+                    'gdal_translate',
+                    '-outsize', str(size[0]), str(size[1]),
+                    '-r', 'average',
+                    source_path,
+                    dem_path
+                ])
+            hillshade_path = os.path.join(temp_dir, 'hillshade_preview.tif')
+            self.run_command([
+                'gdaldem', 'hillshade',
+                dem_path,
+                hillshade_path,
+                '-z', str(options.z_factor),
+                '-az', str(options.azimuth),
+                '-alt', str(options.altitude),
+                '-compute_edges'
+            ])
+            temp_png = os.path.join(temp_dir, 'hillshade_preview.png')
+            subprocess.run([
+                'gdal_translate',
+                '-of', 'PNG',
+                '-scale',
+                hillshade_path,
+                temp_png
+            ], check=True, capture_output=True)
+            with Image.open(temp_png) as img:
+                return np.asarray(img.convert('L'))
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    # ── Conversion ──
+
+    def select_mode(self, options):
+        if not options.stream:
+            return 'staged'
+        if not engine.is_available():
+            return 'chained'
+        return 'native' if options.native_tiler else 'streamed'
+
+    def convert(self, input_spec, output_path, options):
+        """Convert a DEM (file, folder or glob) to hillshade MBTiles or PMTiles
+
+        Returns a summary dict; raises on failure. With options.resumable a
+        failed run leaves a job manifest so the same call can continue it.
+        Either way a run report with per-stage timings is written to
+        <output>.report.json. A .pmtiles output is tiled into an MBTiles
+        file next to it first and converted at the end.
+        """
+        manifest = None
+        work_dir = None
+        job = None
+        tiles_path = output_path
+        if pmtiles.is_pmtiles(output_path):
+            tiles_path = output_path + '.mbtiles'
+        report = self.report = instrument.RunReport(
+            input=str(input_spec), output=output_path, options=asdict(options))
+        profiler = None
+        if options.profile:
+            # Only this thread: tiler workers and GDAL tools are separate processes
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            check_output_location(output_path, self.log)
+            with report.stage('prepare'):
+                source_path, source_files = self.prepare_source(input_spec)
+            mode = self.select_mode(options)
+            report.info.update(mode=mode, source_files=len(source_files))
+            if mode == 'chained' or (mode == 'staged' and not engine.is_available()):
+                require_engine_for(options)
+            if options.tile_encoding().format == 'jpeg':
+                self.log("Note: JPEG tiles have no transparency; areas without data are black")
+
+            if options.resumable:
+                manifest = checkpoint.JobManifest.for_output(
+                    tiles_path, source_files, options.job_params(mode))
+                if manifest.blocks and not os.path.exists(tiles_path):
+                    self.log("Previous job's output is missing; starting over")
+                    manifest.reset()
+                if manifest.resumed:
+                    self.log(f"Resuming previous job ({len(manifest.stages)} stages, "
+                             f"{len(manifest.blocks)} tile blocks already done)")
+
+            # Remove existing output file if present, unless tiles are being resumed into it
+            for path in {output_path, tiles_path}:
+                if os.path.exists(path) and not (manifest and manifest.blocks
+                                                 and path == tiles_path):
+                    self.log(f"Removing existing file: {path}")
+                    try:
+                        os.remove(path)
+                    except OSError as e:
+                        raise PermissionError(f"Cannot remove existing file: {path}\nError: {e}")
+
+            if mode in ('chained', 'staged'):
+                if manifest is not None:
+                    work_dir = manifest.work_dir
+                    os.makedirs(work_dir, exist_ok=True)
+                    self.log(f"Using work directory: {work_dir}")
+                else:
+                    work_dir = tempfile.mkdtemp(prefix='hillshade_')
+                    self.log(f"Created temporary directory: {work_dir}")
+
+            job = _Job(self, source_path, source_files, tiles_path, options,
+                       work_dir, manifest)
+            self.log(f"GDAL: {job.gdal.describe()}")
+            report.info['gdal_profile'] = asdict(job.gdal)
+            with job.gdal_applied():
+                if mode == 'native':
+                    job.convert_native()
+                elif mode == 'streamed':
+                    job.convert_streamed()
+                elif mode == 'chained':
+                    job.convert_chained()
+                else:
+                    job.convert_staged()
+
+            with report.stage('finalize'):
+                # Compacting an MBTiles that only feeds the PMTiles writer is wasted work
+                self.finalize_output(tiles_path, options,
+                                     compact=tiles_path == output_path)
+            with report.stage('verify'):
+                zoom_levels = self.verify_output(tiles_path, options, job.coverage)
+            if tiles_path != output_path:
+                self.log("\nConverting to PMTiles...")
+                with report.stage('pmtiles'):
+                    pmtiles.mbtiles_to_pmtiles(
+                        tiles_path, output_path, log=self.log,
+                        progress=StageProgress(self.progress, 92, 99, stage='PMTiles',
+                                               status=self.status))
+                os.remove(tiles_path)
+
+            # Cleanup
+            if manifest is not None:
+                manifest.discard()
+            if work_dir:
+                self.log("\nCleaning up temporary files...")
+                shutil.rmtree(work_dir, ignore_errors=True)
+                work_dir = None
+
+            self.progress(100)
+            self.log("\n✓ Conversion complete!")
+            self.log(f"Output saved to: {output_path}")
+            report.info['status'] = 'complete'
+            return {
+                'output': output_path,
+                'mode': mode,
+                'zoom_levels': zoom_levels,
+                'tiles_per_zoom': report.info.get('tiles_per_zoom'),
+                'report': instrument.report_path(output_path),
+                'options': asdict(options),
+            }
+        except BaseException as e:
+            report.info.update(status='failed', error=str(e) or type(e).__name__)
+            if manifest is not None:
+                self.log("Progress has been saved; convert again with the same settings to resume.")
+            raise
+        finally:
+            if job is not None:
+                job.release_cache()
+            # Scratch space is only kept when a resumable job can reuse it
+            if work_dir and manifest is None:
+                shutil.rmtree(work_dir, ignore_errors=True)
+            if tiles_path != output_path and manifest is None and os.path.exists(tiles_path):
+                os.remove(tiles_path)
+            self.report = None
+            if profiler is not None:
+                profiler.disable()
+                report.info['profile'] = instrument.profile_path(output_path)
+                profiler.dump_stats(report.info['profile'])
+            self.write_report(report, output_path)
+
+    def update(self, input_spec, output_path, options, region=None, bbox=None):
+        """Re-render the part of an existing MBTiles that a changed DEM region touches
+
+        input_spec is the source as it is now (with the re-flown patch in
+        place), so the hillshade halo around the change comes from real
+        neighbouring data. The change is given as region (the new DEM file,
+        folder or glob; each file's footprint counts separately) or bbox
+        (west, south, east, north in degrees). Zoom levels come from the
+        MBTiles metadata; the shading options must match the original run.
+        """
+        if pmtiles.is_pmtiles(output_path):
+            raise ValueError("Only MBTiles can be updated in place; update the MBTiles "
+                             "and convert it with the pmtiles command")
+        if not os.path.isfile(output_path):
+            raise FileNotFoundError(f"MBTiles file not found: {output_path}")
+        if (region is None) == (bbox is None):
+            raise ValueError("Give either a changed region or a bounding box")
+        if not engine.is_available():
+            raise RuntimeError("Updating needs the GDAL Python bindings (osgeo)")
+
+        report = self.report = instrument.RunReport(
+            input=str(input_spec), output=output_path, mode='update',
+            region=str(region or bbox), options=asdict(options))
+        try:
+            conn = sqlite3.connect(output_path)
+            try:
+                metadata = mbtiles.read_metadata(conn)
+            finally:
+                conn.close()
+            options = replace(options, min_zoom=int(metadata.get('minzoom', options.min_zoom)),
+                              max_zoom=int(metadata.get('maxzoom', options.max_zoom)))
+            tile_encoding = options.tile_encoding()
+            stored_format = metadata.get('format')
+            if stored_format and stored_format != encoding.MBTILES_FORMATS[tile_encoding.format]:
+                self.log(f"Existing tiles are {stored_format}; encoding the update to match")
+                tile_encoding = encoding.parse_encoding(
+                    'jpeg' if stored_format == 'jpg' else stored_format)
+
+            # No _Job for an update; resolve the same GDAL profile a conversion uses
+            profile = gdalprofile.resolve(options, scratch_dir=os.path.dirname(
+                os.path.abspath(output_path)))
+            self.log(f"GDAL: {profile.describe()}")
+            report.info['gdal_profile'] = asdict(profile)
+            with profile.applied():
+                with report.stage('prepare'):
+                    source_path, source_files = self.prepare_source(input_spec)
+                    if bbox is not None:
+                        footprints = [tiler.lonlat_to_mercator(bbox)]
+                    else:
+                        footprints = [tiler.mercator_bounds(path)[0]
+                                      for path in mosaic.resolve_inputs(region)]
+                self.log(f"\nUpdating {output_path} (zoom {options.min_zoom}-{options.max_zoom}) "
+                         f"for {len(footprints)} changed region(s)...")
+                stats = encoding.EncodingStats()
+                with report.stage('tiling'):
+                    written, removed = tiler.update_mbtiles(
+                        source_path, output_path, footprints,
+                        options.min_zoom, options.max_zoom,
+                        shading=options.shading(),
+                        workers=options.workers,
+                        encoding=tile_encoding,
+                        stats=stats,
+                        log=self.log,
+                        max_memory=options.max_memory,
+                        progress=StageProgress(self.progress, 0, 90, stage='Updating',
+                                               status=self.status))
+                    report.annotate(tiles=written, removed=removed, encodings=stats.as_dict())
+                with report.stage('finalize'):
+                    self.finalize_output(output_path, options)
+                with report.stage('verify'):
+                    zoom_levels = self.verify_output(output_path, options)
+
+            self.progress(100)
+            self.log("\n✓ Update complete!")
+            report.info['status'] = 'complete'
+            return {
+                'output': output_path,
+                'mode': 'update',
+                'tiles_written': written,
+                'tiles_removed': removed,
+                'zoom_levels': zoom_levels,
+                'tiles_per_zoom': report.info.get('tiles_per_zoom'),
+                'report': instrument.report_path(output_path),
+            }
+        except BaseException as e:
+            report.info.update(status='failed', error=str(e) or type(e).__name__)
+            raise
+        finally:
+            self.report = None
+            self.write_report(report, output_path)
+
+    def inspect(self, path, options=None, sizes=False):
+        """Finalize (with options) and verify an existing MBTiles; returns the zoom report
+
+        Without options the file is only read. The zoom range checked is
+        the one in its metadata. sizes also sums tile bytes and finds empty
+        tiles, which reads every tile (see mbtiles.tile_report).
+        """
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"MBTiles file not found: {path}")
+        if options is not None:
+            self.finalize_output(path, options)
+        conn = sqlite3.connect(path)
+        try:
+            metadata = mbtiles.read_metadata(conn)
+            zooms = mbtiles.tiles_per_zoom(conn)
+        finally:
+            conn.close()
+        options = replace(options or ConversionOptions(),
+                          min_zoom=int(metadata.get('minzoom', min(zooms, default=0))),
+                          max_zoom=int(metadata.get('maxzoom', max(zooms, default=0))))
+        report = self.report = instrument.RunReport()
+        try:
+            zoom_levels = self.verify_output(path, options, sizes=sizes)
+        finally:
+            self.report = None
+        return {'output': path, 'zoom_levels': zoom_levels,
+                'zooms': report.info.get('zoom_report'),
+                'bytes': os.path.getsize(path)}
+
+    def tile_service(self, input_spec, options, workers=None, memory_bytes=None):
+        """tileserver.TileService rendering XYZ tiles of the DEM on demand
+
+        Needs the in-process engine: each tile is hillshaded from its own
+        window of the DEM.
+        """
+        if not engine.is_available():
+            raise RuntimeError("Serving tiles needs the GDAL Python bindings (osgeo)")
+        from hillshade import tileserver
+        source_path, source_files = self.prepare_source(input_spec)
+        return tileserver.TileService(
+            source_path, source_files, options, workers=workers or options.workers,
+            memory_bytes=memory_bytes or tileserver.MEMORY_CACHE_BYTES, log=self.log)
+
+    def write_report(self, report, output_path):
+        """Write <output>.report.json; a report that cannot be written is only logged"""
+        if os.path.exists(output_path):
+            report.info['output_bytes'] = os.path.getsize(output_path)
+        gdal = engine.load_gdal()
+        report.info['gdal'] = gdal.__version__ if gdal is not None else None
+        try:
+            path = report.write(instrument.report_path(output_path))
+            self.log(f"Run report: {path}")
+        except OSError as e:
+            self.log(f"Could not write run report: {e}")
+
+    def finalize_output(self, output_path, options, compact=True):
+        """Index, ANALYZE and (if asked) VACUUM the MBTiles, and complete its metadata"""
+        vacuum = compact and (options.vacuum or bool(options.page_size))
+        self.log("\nFinalizing MBTiles (index, statistics, metadata"
+                 + (", vacuum)..." if vacuum else ")..."))
+        done = mbtiles.finalize(output_path, vacuum=vacuum,
+                                page_size=options.page_size if vacuum else None)
+        if done['duplicates_removed']:
+            self.log(f"WARNING: removed {done['duplicates_removed']} duplicate tiles")
+        if done['metadata']:
+            self.log("Metadata: " + ', '.join(f"{k}={v}" for k, v in done['metadata'].items()))
+        if self.report is not None:
+            self.report.annotate(**done)
+        return done
+
+    def log_coverage(self, covered):
+        """Warn about written tiles outside the coverage index"""
+        outside = sum(c['outside'] for c in covered.values())
+        if outside:
+            self.log(f"WARNING: {outside} tiles lie outside the coverage index.")
+        if self.report is not None:
+            self.report.info['coverage'] = covered
+
+    def verify_output(self, output_path, options, index=None, sizes=False):
+        """Step 4: per zoom level, the tiles, bytes, expected coverage and corrupt tiles
+
+        Expected tiles come from the coverage index if given, else from the
+        tile range of the metadata bounds. Only indexes are read, so this is
+        quick on multi-GB files; sizes adds tile bytes and empty tiles at the
+        cost of reading every tile.
+        """
+        self.progress(90)
+        self.log("\nStep 4/4: Verifying MBTiles output...")
+
+        # Calculate the zoom level span for overview generation
+        zoom_span = options.max_zoom - options.min_zoom
+
+        try:
+            conn = sqlite3.connect(output_path)
+            try:
+                if index is not None:
+                    expected = index.counts()
+                else:
+                    expected = mbtiles.expected_tiles(
+                        conn, range(options.min_zoom, options.max_zoom + 1))
+                zooms = mbtiles.tile_report(conn, expected, sizes)
+                covered = index.compare(conn) if index is not None else None
+            finally:
+                conn.close()
+            counts = {z: row['tiles'] for z, row in zooms.items() if row['tiles']}
+            zoom_levels = sorted(counts)
+            self.log(f"Created tiles at zoom levels: {zoom_levels}")
+            for zoom, row in zooms.items():
+                line = f"  zoom {zoom:>2}: {row['tiles']:>9} tiles"
+                if row['bytes'] is not None:
+                    line += f" {row['bytes'] / 1e6:>9.1f} MB"
+                if row['expected']:
+                    line += (f"  {100.0 * row['tiles'] / row['expected']:5.1f}% "
+                             f"of {row['expected']} expected")
+                self.log(line)
+            corrupt = sum(row['corrupt'] for row in zooms.values())
+            if corrupt:
+                self.log(f"WARNING: {corrupt} corrupt tiles (" + ', '.join(
+                    f"{sum(row[kind] or 0 for row in zooms.values())} {kind}"
+                    for kind in ('empty', 'dangling', 'invalid')
+                    if any(row[kind] for row in zooms.values())) + ")")
+            if self.report is not None:
+                self.report.info['tiles_per_zoom'] = counts
+                self.report.info['zoom_report'] = zooms
+            if covered is not None:
+                self.log_coverage(covered)
+
+            if len(zoom_levels) < zoom_span + 1:
+                self.log("WARNING: Not all zoom levels have tiles. This may cause visibility issues.")
+                self.log("Try using a higher resolution input file or reducing MAXZOOM.")
+            return zoom_levels
+        except Exception as e:
+            self.log(f"Could not verify zoom levels: {e}")
+            return None
+
+
+class _Job:
+    """One conversion run: the stage implementations for each pipeline mode"""
+
+    def __init__(self, pipeline, source_path, source_files, output_path, options,
+                 work_dir, manifest):
+        self.pipeline = pipeline
+        self.log = pipeline.log
+        self.progress = pipeline.progress
+        self.status = pipeline.status
+        self.report = pipeline.report
+        self.gdal = gdalprofile.resolve(options, scratch_dir=work_dir or os.path.dirname(
+            os.path.abspath(output_path)))
+        self.command_env = self.gdal.env()
+        self.source_path = source_path
+        self.source_files = source_files
+        self.output_path = output_path
+        self.options = options
+        self.work_dir = work_dir
+        self.manifest = manifest
+        self.coverage = None
+        self._source_megapixels = None
+        self.cache = None
+        if options.stage_cache:
+            try:
+                self.cache = stagecache.StageCache()
+            except OSError as e:
+                self.log(f"Stage cache unavailable ({e}); intermediates are not kept")
+
+    @property
+    def source_megapixels(self):
+        """Input size, so throughput can be shown in source Mpx/s"""
+        if self._source_megapixels is None:
+            try:
+                if engine.is_available():
+                    width, height = engine.raster_size(self.source_path)
+                else:
+                    width, height = self.pipeline.raster_size_cli(self.source_path)
+                self._source_megapixels = width * height / 1e6
+            except Exception:
+                self._source_megapixels = 0  # Unknown: report ETA only
+        return self._source_megapixels or None
+
+    def stage(self, name, start, end):
+        """Progress of one step, mapped onto [start, end] of the overall bar"""
+        return StageProgress(self.progress, start, end, stage=name,
+                             total=self.source_megapixels, unit='Mpx',
+                             status=self.status)
+
+    def run_command(self, cmd, progress=None):
+        self.pipeline.run_command(cmd, progress, env=self.command_env)
+
+    def gdal_applied(self):
+        """The profile applied to in-process GDAL too, where the bindings exist"""
+        if engine.is_available():
+            return self.gdal.applied()
+        return contextlib.nullcontext()
+
+    def measure(self, name):
+        """Record the enclosed block as one stage of the run report"""
+        return self.report.stage(name, temp_dir=self.work_dir)
+
+    def run_stage(self, name, output, func):
+        """Run one pipeline stage unless a resumed job already finished it"""
+        if self.manifest is not None and self.manifest.stage_done(name):
+            self.log(f"Skipping {name}: already completed by a previous run")
+            self.report.skip(name)
+            return
+        with self.measure(name):
+            func()
+        if self.manifest is not None:
+            self.manifest.complete_stage(name, output)
+
+    def cached_stage(self, name, filename, params, produce):
+        """Path of a stage output, reused from the stage cache when possible
+
+        produce(path) writes the output. On a miss it is written into the
+        cache (then evicted down to its size cap); without the cache it goes
+        to the work directory as a checkpointed stage.
+        """
+        if self.cache is None:
+            path = os.path.join(self.work_dir, filename)
+            self.run_stage(name, path, lambda: produce(path))
+            return path
+        key = stagecache.stage_key(name, self.source_files, params)
+        path = self.cache.get(key, filename)
+        if path is not None:
+            self.log(f"Reusing cached {name} output: {path}")
+            self.report.skip(name, reason='cached')
+            return path
+        with self.measure(name):
+            path = self.cache.put(key, filename, produce, info={'stage': name})
+            self.report.annotate(cached_bytes=instrument.tree_bytes(path))
+        self.cache.evict()
+        return path
+
+    def cached_hillshade(self):
+        """In-process hillshade of the source from an earlier run or preview, or None"""
+        if self.cache is None:
+            return None
+        key = stagecache.stage_key('hillshade', self.source_files,
+                                   self.options.hillshade_params('numpy'))
+        return self.cache.get(key, HILLSHADE_FILE)
+
+    def release_cache(self):
+        if self.cache is not None:
+            self.cache.release()
+
+    def log_input_info(self):
+        # Check input resolution to understand appropriate zoom levels
+        self.log("\nInput file information:")
+        with self.measure('analyze'):
+            if len(self.source_files) > 1:
+                # -nofl keeps the mosaic listing from flooding the log
+                self.log(f"Mosaic of {len(self.source_files)} DEM tiles")
+                self.run_command(['gdalinfo', '-nofl', self.source_path])
+            else:
+                self.run_command(['gdalinfo', self.source_path])
+        self.report.info['source_megapixels'] = self.source_megapixels
+        self.log("")
+
+    def log_tiling_notes(self):
+        self.log(f"Zoom levels: {self.options.min_zoom} to {self.options.max_zoom}")
+        self.log("")
+        self.log("IMPORTANT: Using UPPER zoom strategy to create tiles at all zoom levels.")
+        self.log("Tiles may appear stretched at higher zoom if input resolution is insufficient.")
+        self.log("")
+
+    def run_mbtiles_translate(self, source_path, start):
+        """Tile with GDAL's MBTiles driver (start-80%), then re-encode (80-90%)"""
+        cmd = ['gdal_translate', '-of', 'MBTiles']
+        for option in mbtiles_creation_options(self.options.min_zoom, self.options.max_zoom):
+            cmd += ['-co', option]
+        with self.measure('tiling'):
+            self.run_command(cmd + [source_path, self.output_path],
+                             progress=self.stage('Tiling', start, 80))
+        self.encode_tiles()
+
+    def encode_tiles(self):
+        """Re-encode GDAL's tiles in the selected format on a process pool"""
+        if not encoding.needs_recode(self.options.tile_encoding()):
+            return
+        self.log(f"\nEncoding tiles as {encoding.describe(self.options.tile_encoding())}...")
+        stats = encoding.EncodingStats()
+        with self.measure('encoding'):
+            encoding.recode_mbtiles(self.output_path, self.options.tile_encoding(),
+                                    workers=self.options.workers, log=self.log,
+                                    progress=self.stage('Encoding', 80, 90), stats=stats)
+            self.report.annotate(encodings=stats.as_dict())
+        for line in stats.summary():
+            self.log(f"  {line}")
+
+    def build_coverage(self, source_path):
+        """Index the tiles that can hold data, from a low-resolution mask read"""
+        with self.measure('coverage'):
+            index = coverage.build_index(source_path, self.options.min_zoom,
+                                         self.options.max_zoom)
+            indexed, box = index.count(index.max_zoom), index.box_count(index.max_zoom)
+            self.report.annotate(valid_fraction=round(index.valid_fraction, 4),
+                                 indexed_tiles=indexed, box_tiles=box)
+        self.log(f"Coverage index: {100.0 * index.valid_fraction:.0f}% of the DEM has data; "
+                 f"{indexed} of {box} tiles at zoom {index.max_zoom} can hold data")
+        self.coverage = index
+
+    def run_native_tiler(self, source_path, shading=None, start=10):
+        """Tile with the built-in process-pool tiler (progress start-90%)"""
+        if self.options.coverage_index:
+            self.build_coverage(source_path)
+        stats = encoding.EncodingStats()
+        with self.measure('tiling'):
+            tiles = tiler.build_mbtiles(
+                source_path, self.output_path,
+                self.options.min_zoom, self.options.max_zoom,
+                shading=shading,
+                workers=self.options.workers,
+                manifest=self.manifest,
+                max_memory=self.options.max_memory,
+                encoding=self.options.tile_encoding(),
+                stats=stats,
+                coverage=self.coverage,
+                log=self.log,
+                progress=self.stage('Tiling', start, 90))
+            self.report.annotate(tiles=tiles, encodings=stats.as_dict())
+
+    def convert_native(self):
+        """Hillshade, reproject and tile per block straight from the DEM"""
+        self.progress(10)
+        self.log("\nStep 1/4: Analyzing input and generating hillshade...")
+        self.log_input_info()
+        hillshade_path = self.cached_hillshade()
+        if hillshade_path is not None:
+            self.log(f"Reusing cached hillshade: {hillshade_path}")
+            self.report.skip('hillshade', reason='cached')
+            self.log("Steps 2/4 and 3/4: Reprojecting and tiling the cached hillshade...")
+            self.log(f"Zoom levels: {self.options.min_zoom} to {self.options.max_zoom}")
+            self.run_native_tiler(hillshade_path)
+            return
+        self.log("Steps 2/4 and 3/4: Rendering tiles in parallel directly from the DEM...")
+        self.log(f"Zoom levels: {self.options.min_zoom} to {self.options.max_zoom}")
+        self.run_native_tiler(self.source_path, shading=self.options.shading())
+
+    def convert_streamed(self):
+        """In-process fused pipeline: nothing is written until the tiles"""
+        self.progress(10)
+        self.log("\nStep 1/4: Analyzing input and generating hillshade...")
+        self.log_input_info()
+        self.log("Step 2/4 and 3/4: Streaming hillshade -> Web Mercator -> MBTiles...")
+        self.log_tiling_notes()
+        stream_to_mbtiles(
+            self.source_path, self.output_path,
+            min_zoom=self.options.min_zoom,
+            max_zoom=self.options.max_zoom,
+            log=self.log,
+            progress=self.progress,
+            status=self.status,
+            max_memory=self.options.max_memory,
+            report=self.report,
+            tile_encoding=self.options.tile_encoding(),
+            workers=self.options.workers,
+            hillshade_path=self.cached_hillshade(),
+            gdal_profile=self.gdal,
+            **self.options.shading())
+
+    def convert_chained(self):
+        """CLI fallback: a single hillshade GeoTIFF feeds a VRT chain"""
+        self.progress(10)
+        self.log("\nStep 1/4: Analyzing input and generating hillshade...")
+        self.log_input_info()
+
+        # gdaldem already writes single-band Byte, so no greyscale pass is needed
+        hillshade_path = self.cached_stage(
+            'hillshade', HILLSHADE_FILE, self.options.hillshade_params('gdaldem'),
+            lambda path: self.run_command([
+                'gdaldem', 'hillshade',
+                self.source_path,
+                path,
+                '-z', str(self.options.z_factor),
+                '-az', str(self.options.azimuth),
+                '-alt', str(self.options.altitude),
+                '-compute_edges',
+                '-co', 'TILED=YES',
+                '-co', 'COMPRESS=DEFLATE',
+            ] + self.gdal.creation_args(), progress=self.stage('Hillshade', 10, 30)))
+
+        self.log("\nStep 2/4: Reprojecting to Web Mercator EPSG:3857 (virtual)...")
+        warped_path = os.path.join(self.work_dir, 'hillshade_mercator.vrt')
+        with self.measure('warp'):
+            self.run_command([
+                'gdalwarp',
+                '-overwrite',
+                '-of', 'VRT',
+                '-t_srs', 'EPSG:3857',
+                '-r', 'bilinear',
+            ] + self.gdal.warp_args() + [
+                hillshade_path,
+                warped_path
+            ])
+
+        # The warp is virtual, so tiling does all the resampling work
+        self.log("\nStep 3/4: Converting to MBTiles format...")
+        self.log_tiling_notes()
+        self.run_mbtiles_translate(warped_path, start=30)
+
+    def convert_staged(self):
+        """Original pipeline with full-size GeoTIFF intermediates"""
+        # Step 1: Generate hillshade
+        self.progress(10)
+        self.log("\nStep 1/4: Analyzing input and generating hillshade...")
+        self.log_input_info()
+
+        if engine.is_available():
+            renderer = 'numpy'
+
+            # In-process hillshade writes Byte greyscale directly,
+            # replacing both gdaldem and the greyscale gdal_translate pass
+            def make_hillshade(hillshade_path):
+                self.log("Computing hillshade in-process (NumPy)...")
+                engine.hillshade_file(self.source_path, hillshade_path,
+                                      compute_edges=True,
+                                      creation_options=(stagecache.CREATION_OPTIONS
+                                                        if self.cache else None),
+                                      max_memory=self.options.max_memory,
+                                      progress=self.stage('Hillshade', 10, 30),
+                                      **self.options.shading())
+        else:
+            renderer = 'gdaldem'
+
+            def make_hillshade(hillshade_path):
+                raw_path = os.path.join(self.work_dir, 'hillshade_raw.tif')
+                self.run_command([
+                    'gdaldem', 'hillshade',
+                    self.source_path,
+                    raw_path,
+                    '-z', str(self.options.z_factor),
+                    '-az', str(self.options.azimuth),
+                    '-alt', str(self.options.altitude),
+                    '-compute_edges'
+                ], progress=self.stage('Hillshade', 10, 25))
+
+                # Convert to explicit greyscale to ensure no color tinting
+                self.log("\nConverting to greyscale...")
+                self.run_command([
+                    'gdal_translate',
+                    '-ot', 'Byte',
+                    '-co', 'PHOTOMETRIC=MINISBLACK',
+                    raw_path,
+                    hillshade_path
+                ], progress=self.stage('Greyscale', 25, 30))
+                os.remove(raw_path)
+        hillshade_params = self.options.hillshade_params(renderer)
+        hillshade_path = self.cached_stage('hillshade', HILLSHADE_FILE, hillshade_params,
+                                           make_hillshade)
+
+        if self.options.native_tiler and engine.is_available():
+            # The built-in tiler warps each block itself, so Step 2 is folded in
+            self.log("\nSteps 2/4 and 3/4: Reprojecting and tiling in parallel...")
+            self.log(f"Zoom levels: {self.options.min_zoom} to {self.options.max_zoom}")
+            self.run_native_tiler(hillshade_path, start=30)
+            return
+
+        # Step 2: Warp to Web Mercator
+        self.log("\nStep 2/4: Reprojecting to Web Mercator EPSG:3857...")
+        # Keyed on the hillshade's parameters: a new zoom range reuses the warp
+        warp_params = {'hillshade': hillshade_params, 'srs': WEB_MERCATOR,
+                       'resampling': 'bilinear'}
+
+        def warp(warped_path):
+            self.run_command([
+                'gdalwarp',
+                '-overwrite',
+                '-t_srs', WEB_MERCATOR,
+                '-r', 'bilinear',
+                '-co', 'TILED=YES',
+                '-co', 'COMPRESS=DEFLATE',
+            ] + self.gdal.creation_args() + self.gdal.warp_args() + [
+                hillshade_path,
+                warped_path
+            ], progress=self.stage('Reprojecting', 30, 60))
+        warped_path = self.cached_stage('warp', MERCATOR_FILE, warp_params, warp)
+
+        # Step 3: Convert to MBTiles with proper zoom levels
+        self.log("\nStep 3/4: Converting to MBTiles format...")
+        self.log_tiling_notes()
+        self.run_mbtiles_translate(warped_path, start=60)
+
+
+def stream_to_mbtiles(input_path, output_path, z_factor=1.0, azimuth=315.0,
+                      altitude=45.0, min_zoom=10, max_zoom=17, log=print,
+                      progress=None, status=None, max_memory=None, report=None,
+                      tile_encoding=None, workers=None, lights=None, slope_weight=0.0,
+                      hillshade_path=None, gdal_profile=None):
+    """Hillshade, reproject and tile in one pass with no scratch files
+
+    The hillshade is computed in-process into a compressed /vsimem/ raster,
+    reprojection is a warped VRT on top of it, and the MBTiles driver pulls
+    pixels through that chain, so nothing but the final tiles touches disk.
+    With max_memory (bytes) the DEM is shaded in strips and the compressed
+    hillshade goes to a scratch file next to the output instead, since even
+    compressed it grows with the input. Stages are recorded in report (an
+    instrument.RunReport) if given. GDAL's PNG tiles are then re-encoded as
+    tile_encoding (default PNG) on `workers` processes. A hillshade_path
+    (e.g. from the stage cache) is tiled as is and never removed. The warp
+    uses the threads and warp memory of gdal_profile (a gdalprofile.GdalProfile)
+    if given.
+    """
+    gdal = engine.require_gdal()
+    report = report or instrument.RunReport()
+
+    job = uuid.uuid4().hex
+    scratch_path = None
+    if hillshade_path is None:
+        if max_memory is None:
+            scratch_path = f'/vsimem/hillshade_{job}.tif'
+        else:
+            scratch_path = f'{output_path}.{job}.hillshade.tif'
+    warped_path = f'/vsimem/hillshade_{job}_mercator.vrt'
+    previous_cache = gdal.GetCacheMax()
+    if max_memory is not None:
+        # The MBTiles driver pulls through GDAL's block cache; keep it in budget
+        gdal.SetCacheMax(min(previous_cache, max_memory // 4))
+    try:
+        width, height = engine.raster_size(input_path)
+        megapixels = width * height / 1e6
+        if hillshade_path is not None:
+            log(f"Reusing cached hillshade: {hillshade_path}")
+            report.skip('hillshade', reason='cached')
+        else:
+            log("Computing hillshade in-process "
+                f"({'in memory' if max_memory is None else 'in strips'})...")
+            hillshade_path = scratch_path
+            shading_progress = None
+            if progress:
+                shading_progress = StageProgress(progress, 10, 30, stage='Hillshade',
+                                                 total=megapixels, unit='Mpx', status=status)
+            with report.stage('hillshade'):
+                engine.hillshade_file(
+                    input_path, hillshade_path, z_factor, azimuth, altitude,
+                    compute_edges=True, creation_options=stagecache.CREATION_OPTIONS,
+                    max_memory=max_memory, progress=shading_progress, lights=lights,
+                    slope_weight=slope_weight)
+                if max_memory is not None:
+                    report.annotate(temp_bytes=instrument.tree_bytes(hillshade_path))
+
+        log(f"Reprojecting to Web Mercator {WEB_MERCATOR} (virtual)...")
+        with report.stage('warp'):
+            gdal.Warp(warped_path, hillshade_path, format='VRT', dstSRS=WEB_MERCATOR,
+                      resampleAlg='bilinear',
+                      **(gdal_profile.warp_kwargs() if gdal_profile else {}))
+
+        log(f"Tiling zoom levels {min_zoom} to {max_zoom}...")
+        tiling = None
+        if progress:
+            tiling = StageProgress(progress, 30, 80, stage='Tiling', total=megapixels,
+                                   unit='Mpx', status=status)
+        with report.stage('tiling'):
+            gdal.Translate(output_path, warped_path, format='MBTiles',
+                           creationOptions=mbtiles_creation_options(min_zoom, max_zoom),
+                           callback=gdal_progress(tiling))
+    finally:
+        gdal.SetCacheMax(previous_cache)
+        unlink_vsimem(warped_path)
+        if scratch_path and scratch_path.startswith('/vsimem/'):
+            unlink_vsimem(scratch_path)
+        elif scratch_path and os.path.exists(scratch_path):
+            os.remove(scratch_path)
+
+    tile_encoding = encoding.parse_encoding(tile_encoding or encoding.PNG)
+    if not encoding.needs_recode(tile_encoding):
+        return output_path
+    stats = encoding.EncodingStats()
+    encoding_progress = None
+    if progress:
+        encoding_progress = StageProgress(progress, 80, 90, stage='Encoding', status=status)
+    with report.stage('encoding'):
+        encoding.recode_mbtiles(output_path, tile_encoding, workers=workers, log=log,
+                                progress=encoding_progress, stats=stats)
+        report.annotate(encodings=stats.as_dict())
+    for line in stats.summary():
+        log(f"  {line}")
+    return output_path
+
+
+def convert(input_spec, output_path, options=None, log=print, progress=None,
+            status=None):
+    """Convert a DEM file, folder or glob to hillshade MBTiles"""
+    return Pipeline(log, progress, status).convert(input_spec, output_path,
+                                                   options or ConversionOptions())
+
+
+def preview(input_spec, options=None, max_size=PREVIEW_MAX_SIZE, log=print):
+    """Return the finest preview level as a greyscale array"""
+    shaded = None
+    for _, _, shaded, _ in Pipeline(log).preview(
+            input_spec, options or ConversionOptions(), max_size=max_size):
+        pass
+    return shaded
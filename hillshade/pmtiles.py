@@ -0,0 +1,497 @@
+"""
+PMTiles output
+Writer, reader and MBTiles converter for PMTiles v3: tiles clustered in
+Hilbert order, duplicate and run-length encoded directory entries, and
+gzip-compressed root and leaf directories
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import zlib
+from array import array
+from collections import OrderedDict, namedtuple
+
+from hillshade.mbtiles import has_dedup_schema
+
+MAGIC = b'PMTiles'
+VERSION = 3
+HEADER_SIZE = 127
+# Clients fetch the first 16 KiB in one request: header plus root directory
+ROOT_MAX_BYTES = 16384 - HEADER_SIZE
+# First guess at entries per leaf directory; grown until the root fits
+LEAF_SIZE = 4096
+# Only tiles up to this size are hashed for deduplication in flat MBTiles;
+# in practice the repeated ones are uniform tiles of a few hundred bytes
+DEDUP_MAX_BYTES = 4096
+# Decoded leaf directories a reader keeps
+LEAF_CACHE_SIZE = 64
+
+# Compression and tile type codes of the header
+COMPRESSION_NONE = 1
+COMPRESSION_GZIP = 2
+TILE_TYPES = {'mvt': 1, 'pbf': 1, 'png': 2, 'jpg': 3, 'jpeg': 3, 'webp': 4, 'avif': 5}
+
+_HEADER = struct.Struct('<7sB11QBBBBBBiiiiBii')
+
+Entry = namedtuple('Entry', ['tile_id', 'offset', 'length', 'run_length'])
+Header = namedtuple('Header', [
+    'root_offset', 'root_length', 'metadata_offset', 'metadata_length',
+    'leaf_offset', 'leaf_length', 'data_offset', 'data_length',
+    'addressed_tiles', 'tile_entries', 'tile_contents', 'clustered',
+    'internal_compression', 'tile_compression', 'tile_type', 'min_zoom', 'max_zoom',
+    'min_lon', 'min_lat', 'max_lon', 'max_lat', 'center_zoom', 'center_lon', 'center_lat'])
+
+
+def is_pmtiles(path):
+    return os.fspath(path).lower().endswith('.pmtiles')
+
+
+# ── Tile ids ──
+
+def _rotate(n, x, y, rx, ry):
+    if ry == 0:
+        if rx != 0:
+            x = n - 1 - x
+            y = n - 1 - y
+        return y, x
+    return x, y
+
+
+def zxy_to_tileid(z, x, y):
+    """Position of XYZ tile z/x/y on the Hilbert curves of all zoom levels"""
+    if z > 31:
+        raise OverflowError(f"Zoom level {z} is beyond PMTiles' range")
+    n = 1 << z
+    if not (0 <= x < n and 0 <= y < n):
+        raise ValueError(f"Tile {z}/{x}/{y} is outside zoom level {z}")
+    tile_id = ((1 << (2 * z)) - 1) // 3  # Tiles in all lower zoom levels
+    for a in range(z - 1, -1, -1):
+        s = 1 << a
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        tile_id += s * s * ((3 * rx) ^ ry)
+        x, y = _rotate(s, x, y, rx, ry)
+    return tile_id
+
+
+def tileid_to_zxy(tile_id):
+    """Inverse of zxy_to_tileid"""
+    z = 0
+    base = 0
+    while tile_id >= base + (1 << (2 * z)):
+        base += 1 << (2 * z)
+        z += 1
+    t = tile_id - base
+    x = y = 0
+    s = 1
+    while s < (1 << z):
+        rx = 1 & (t // 2)
+        ry = 1 & (t ^ rx)
+        x, y = _rotate(s, x, y, rx, ry)
+        x += s * rx
+        y += s * ry
+        t //= 4
+        s *= 2
+    return z, x, y
+
+
+# ── Directories ──
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def gzip_bytes(data):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 31)  # 31: gzip container
+    return compressor.compress(data) + compressor.flush()
+
+
+def gunzip_bytes(data):
+    return zlib.decompress(data, 47)  # 47: zlib or gzip, detected
+
+
+def serialize_directory(tile_ids, offsets, lengths, run_lengths):
+    """Encode directory entries (parallel sequences) as specified, uncompressed
+
+    Columns are stored one after another: tile id deltas, run lengths,
+    lengths, then offsets, where 0 means "right after the previous entry".
+    """
+    out = bytearray()
+    _write_varint(out, len(tile_ids))
+    last = 0
+    for tile_id in tile_ids:
+        _write_varint(out, tile_id - last)
+        last = tile_id
+    for run_length in run_lengths:
+        _write_varint(out, run_length)
+    for length in lengths:
+        _write_varint(out, length)
+    for i, offset in enumerate(offsets):
+        if i > 0 and offset == offsets[i - 1] + lengths[i - 1]:
+            out.append(0)
+        else:
+            _write_varint(out, offset + 1)
+    return bytes(out)
+
+
+def deserialize_directory(data):
+    count, pos = _read_varint(data, 0)
+    columns = []
+    for _ in range(3):
+        values = []
+        for _ in range(count):
+            value, pos = _read_varint(data, pos)
+            values.append(value)
+        columns.append(values)
+    deltas, run_lengths, lengths = columns
+    entries = []
+    tile_id = 0
+    for i in range(count):
+        tile_id += deltas[i]
+        value, pos = _read_varint(data, pos)
+        if value == 0 and i > 0:
+            offset = entries[-1].offset + entries[-1].length
+        else:
+            offset = value - 1
+        entries.append(Entry(tile_id, offset, lengths[i], run_lengths[i]))
+    return entries
+
+
+def build_directories(tile_ids, offsets, lengths, run_lengths, leaf_size=LEAF_SIZE):
+    """Return (compressed root, compressed leaf directories, leaf count)
+
+    If all entries do not fit in the root, they are split into leaf
+    directories of leaf_size entries, and the root points at the leaves
+    (run length 0). leaf_size grows until the root fits.
+    """
+    root = gzip_bytes(serialize_directory(tile_ids, offsets, lengths, run_lengths))
+    if len(root) <= ROOT_MAX_BYTES:
+        return root, b'', 0
+    while True:
+        leaves = bytearray()
+        root_ids, root_offsets, root_lengths = [], [], []
+        for start in range(0, len(tile_ids), leaf_size):
+            stop = start + leaf_size
+            leaf = gzip_bytes(serialize_directory(
+                tile_ids[start:stop], offsets[start:stop], lengths[start:stop],
+                run_lengths[start:stop]))
+            root_ids.append(tile_ids[start])
+            root_offsets.append(len(leaves))
+            root_lengths.append(len(leaf))
+            leaves += leaf
+        root = gzip_bytes(serialize_directory(root_ids, root_offsets, root_lengths,
+                                              [0] * len(root_ids)))
+        if len(root) <= ROOT_MAX_BYTES:
+            return root, bytes(leaves), len(root_ids)
+        leaf_size = int(leaf_size * 1.2)
+
+
+def find_tile(entries, tile_id):
+    """Entry of a directory that holds tile_id (or the leaf that may), else None"""
+    lo, hi = 0, len(entries) - 1
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        if tile_id > entries[mid].tile_id:
+            lo = mid + 1
+        elif tile_id < entries[mid].tile_id:
+            hi = mid - 1
+        else:
+            return entries[mid]
+    if hi >= 0:
+        entry = entries[hi]
+        if entry.run_length == 0 or tile_id - entry.tile_id < entry.run_length:
+            return entry
+    return None
+
+
+# ── Writer ──
+
+class PMTilesWriter:
+    """Write tiles, added in increasing tile id order, to a PMTiles file
+
+    Tile data is appended to a scratch file while the directory is kept as
+    four packed integer columns; close() writes header, directories and
+    metadata and then copies the data in. Tiles added with the same content
+    key share one copy, and consecutive tile ids with the same content
+    collapse into one run-length entry.
+    """
+
+    def __init__(self, path):
+        self.path = os.fspath(path)
+        self._data_path = self.path + '.tiledata'
+        self._data = open(self._data_path, 'wb')
+        self._tile_ids = array('Q')
+        self._offsets = array('Q')
+        self._lengths = array('Q')
+        self._run_lengths = array('Q')
+        self._contents = {}
+        self._size = 0
+        self._last_id = -1
+        self.addressed_tiles = 0
+        self.tile_contents = 0
+        self.min_zoom = None
+        self.max_zoom = None
+
+    @property
+    def tile_entries(self):
+        return len(self._tile_ids)
+
+    def has_content(self, key):
+        return key in self._contents
+
+    def add_tile(self, tile_id, data=None, key=None):
+        """Add one tile; data may be None when key names content already added"""
+        if tile_id <= self._last_id:
+            raise ValueError("Tiles must be added in increasing tile id order")
+        self._last_id = tile_id
+        location = self._contents.get(key) if key is not None else None
+        if location is None:
+            location = (self._size, len(data))
+            self._data.write(data)
+            self._size += len(data)
+            self.tile_contents += 1
+            if key is not None:
+                self._contents[key] = location
+        offset, length = location
+        self.addressed_tiles += 1
+        last = len(self._tile_ids) - 1
+        if (last >= 0 and self._offsets[last] == offset and self._lengths[last] == length
+                and self._tile_ids[last] + self._run_lengths[last] == tile_id):
+            self._run_lengths[last] += 1
+        else:
+            self._tile_ids.append(tile_id)
+            self._offsets.append(offset)
+            self._lengths.append(length)
+            self._run_lengths.append(1)
+
+    def close(self, metadata, tile_type, min_zoom, max_zoom, bounds, center):
+        """Write the file; bounds are (west, south, east, north) degrees,
+        center is (lon, lat, zoom)"""
+        self._data.close()
+        try:
+            root, leaves, leaf_count = build_directories(
+                self._tile_ids, self._offsets, self._lengths, self._run_lengths)
+            meta = gzip_bytes(json.dumps(metadata).encode('utf-8'))
+            metadata_offset = HEADER_SIZE + len(root)
+            leaf_offset = metadata_offset + len(meta)
+            data_offset = leaf_offset + len(leaves)
+            e7 = lambda degrees: int(round(degrees * 1e7))
+            header = _HEADER.pack(
+                MAGIC, VERSION,
+                HEADER_SIZE, len(root), metadata_offset, len(meta),
+                leaf_offset, len(leaves), data_offset, self._size,
+                self.addressed_tiles, len(self._tile_ids), self.tile_contents,
+                1, COMPRESSION_GZIP, COMPRESSION_NONE, tile_type, min_zoom, max_zoom,
+                e7(bounds[0]), e7(bounds[1]), e7(bounds[2]), e7(bounds[3]),
+                center[2], e7(center[0]), e7(center[1]))
+            tmp = self.path + '.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(header)
+                f.write(root)
+                f.write(meta)
+                f.write(leaves)
+                with open(self._data_path, 'rb') as data:
+                    shutil.copyfileobj(data, f, 1 << 20)
+            os.replace(tmp, self.path)
+            return leaf_count
+        finally:
+            os.remove(self._data_path)
+
+    def abort(self):
+        self._data.close()
+        if os.path.exists(self._data_path):
+            os.remove(self._data_path)
+
+
+# ── Reader ──
+
+class PMTilesReader:
+    """Random access to the tiles of a PMTiles file, e.g. to verify output"""
+
+    def __init__(self, path):
+        self.path = os.fspath(path)
+        self._file = open(self.path, 'rb')
+        self.header = read_header(self._file.read(HEADER_SIZE))
+        self._root = deserialize_directory(
+            self._read_directory(self.header.root_offset, self.header.root_length))
+        self._leaves = OrderedDict()
+
+    def _read(self, offset, length):
+        self._file.seek(offset)
+        return self._file.read(length)
+
+    def _read_directory(self, offset, length):
+        data = self._read(offset, length)
+        if self.header.internal_compression == COMPRESSION_GZIP:
+            data = gunzip_bytes(data)
+        return data
+
+    def metadata(self):
+        return json.loads(self._read_directory(self.header.metadata_offset,
+                                               self.header.metadata_length))
+
+    def get_tile(self, z, x, y):
+        """Tile data for XYZ coordinates, or None"""
+        tile_id = zxy_to_tileid(z, x, y)
+        entries = self._root
+        for _ in range(4):  # The spec allows at most three levels of leaves
+            entry = find_tile(entries, tile_id)
+            if entry is None:
+                return None
+            if entry.run_length > 0:
+                return self._read(self.header.data_offset + entry.offset, entry.length)
+            entries = self._leaf(entry)
+        return None
+
+    def _leaf(self, entry):
+        entries = self._leaves.get(entry.offset)
+        if entries is None:
+            entries = deserialize_directory(self._read_directory(
+                self.header.leaf_offset + entry.offset, entry.length))
+            self._leaves[entry.offset] = entries
+            if len(self._leaves) > LEAF_CACHE_SIZE:
+                self._leaves.popitem(last=False)
+        else:
+            self._leaves.move_to_end(entry.offset)
+        return entries
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def read_header(data):
+    fields = _HEADER.unpack(data[:HEADER_SIZE])
+    if fields[0] != MAGIC or fields[1] != VERSION:
+        raise ValueError("Not a PMTiles v3 file")
+    values = list(fields[2:])
+    for index in (17, 18, 19, 20, 22, 23):  # Stored as degrees * 1e7
+        values[index] = values[index] / 1e7
+    return Header(*values)
+
+
+# ── MBTiles conversion ──
+
+def _tile_type(fmt, first_tile):
+    if fmt in TILE_TYPES:
+        return TILE_TYPES[fmt]
+    if first_tile is None:
+        return 0
+    if first_tile.startswith(b'\x89PNG'):
+        return TILE_TYPES['png']
+    if first_tile.startswith(b'\xff\xd8'):
+        return TILE_TYPES['jpg']
+    if first_tile[8:12] == b'WEBP':
+        return TILE_TYPES['webp']
+    return 0
+
+
+def _parse_floats(text, count):
+    try:
+        values = [float(v) for v in str(text).split(',')]
+    except ValueError:
+        return None
+    return values if len(values) == count else None
+
+
+def mbtiles_to_pmtiles(mbtiles_path, pmtiles_path, log=print, progress=None):
+    """Convert an MBTiles file to PMTiles; returns the number of tiles
+
+    SQLite sorts the tile coordinates by Hilbert tile id (spilling to disk
+    for large files), so memory stays flat; tile images are then fetched one
+    at a time through the coordinate index in that order.
+    """
+    conn = sqlite3.connect(mbtiles_path)
+    # MBTiles rows count from the bottom (TMS); tile ids use XYZ
+    conn.create_function('pmtiles_id', 3,
+                         lambda z, x, row: zxy_to_tileid(z, x, (1 << z) - 1 - row))
+    writer = None
+    try:
+        metadata = dict(conn.execute("SELECT name, value FROM metadata"))
+        dedup = has_dedup_schema(conn)
+        if dedup:
+            # Exact deduplication: only images referenced more than once are remembered
+            shared = {row[0] for row in conn.execute(
+                "SELECT tile_id FROM map GROUP BY tile_id HAVING COUNT(*) > 1")}
+            coords = conn.execute(
+                "SELECT pmtiles_id(zoom_level, tile_column, tile_row) AS id, zoom_level, "
+                "tile_id FROM map ORDER BY id")
+        else:
+            coords = conn.execute(
+                "SELECT pmtiles_id(zoom_level, tile_column, tile_row) AS id, zoom_level, "
+                "tile_column, tile_row FROM tiles ORDER BY id")
+        total = conn.execute(
+            f"SELECT COUNT(*) FROM {'map' if dedup else 'tiles'}").fetchone()[0]
+        log(f"Writing {total} tiles to PMTiles in Hilbert order...")
+
+        writer = PMTilesWriter(pmtiles_path)
+        lookup = conn.cursor()
+        first_tile = None
+        zooms = set()
+        for count, row in enumerate(coords, 1):
+            tile_id, z = row[0], row[1]
+            zooms.add(z)
+            if dedup:
+                key = row[2] if row[2] in shared else None
+                data = None
+                if key is None or not writer.has_content(key):
+                    data = bytes(lookup.execute(
+                        "SELECT tile_data FROM images WHERE tile_id = ?",
+                        (row[2],)).fetchone()[0])
+            else:
+                data = bytes(lookup.execute(
+                    "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? "
+                    "AND tile_row = ?", (z, row[2], row[3])).fetchone()[0])
+                key = hashlib.md5(data).digest() if len(data) <= DEDUP_MAX_BYTES else None
+            if first_tile is None and data is not None:
+                first_tile = data
+            writer.add_tile(tile_id, data, key)
+            if progress and count % 1000 == 0:
+                progress(100.0 * count / max(total, 1))
+
+        if not zooms:
+            raise RuntimeError(f"No tiles in {mbtiles_path}")
+        min_zoom, max_zoom = min(zooms), max(zooms)
+        bounds = _parse_floats(metadata.get('bounds'), 4) or [-180.0, -85.0511287798066,
+                                                                 180.0, 85.0511287798066]
+        center = _parse_floats(metadata.get('center'), 3) or [
+            (bounds[0] + bounds[2]) / 2.0, (bounds[1] + bounds[3]) / 2.0, min_zoom]
+        metadata.update(minzoom=str(min_zoom), maxzoom=str(max_zoom))
+        leaf_count = writer.close(metadata, _tile_type(metadata.get('format'), first_tile),
+                                  min_zoom, max_zoom, bounds,
+                                  (center[0], center[1], int(center[2])))
+        log(f"PMTiles: {writer.addressed_tiles} tiles, {writer.tile_contents} unique, "
+            f"{writer.tile_entries} directory entries"
+            + (f" in {leaf_count} leaf directories" if leaf_count else "")
+            + f" ({os.path.getsize(pmtiles_path) / 1048576.0:.1f} MB)")
+        writer = None
+        if progress:
+            progress(100)
+        return total
+    finally:
+        if writer is not None:
+            writer.abort()
+        conn.close()
@@ -0,0 +1,176 @@
+"""
+Progress reporting
+Parse the `0...10...20` progress bar GDAL's command line tools print, and turn
+per-stage completion into overall progress with throughput and an ETA
+"""
+
+import re
+import time
+from collections import namedtuple
+
+# GDAL prints a number every 10% and a dot for each 2.5% step in between
+DOT_STEP = 2.5
+
+_PROGRESS_START = re.compile(r'\d+')
+
+ProgressUpdate = namedtuple(
+    'ProgressUpdate', ['stage', 'percent', 'stage_percent', 'rate', 'unit', 'eta'])
+
+
+class GdalProgressParser:
+    """Split raw GDAL tool output into text lines and progress percentages
+
+    feed() takes arbitrary chunks (the progress bar is written without
+    newlines, so line-based reading would only see it when the step ends)
+    and returns a list of ('line', text) and ('progress', percent) events.
+    """
+
+    def __init__(self):
+        self.percent = None
+        self._buffer = ''
+        self._in_bar = False
+        self._active = False  # A bar has started and not yet reached 100
+        self._digits = ''
+
+    def _set(self, percent, events):
+        percent = min(float(percent), 100.0)
+        self.percent = percent
+        self._active = percent < 100
+        events.append(('progress', percent))
+
+    def feed(self, text):
+        events = []
+        buf = self._buffer + text
+        i = 0
+        while i < len(buf):
+            if self._in_bar:
+                ch = buf[i]
+                if ch.isdigit():
+                    self._digits += ch
+                    i += 1
+                    continue
+                if self._digits:
+                    self._set(int(self._digits), events)
+                    self._digits = ''
+                if ch == '.':
+                    if self._active:
+                        self._set(self.percent + DOT_STEP, events)
+                    i += 1
+                elif ch == '\n':
+                    self._in_bar = False
+                    i += 1
+                elif ch in ' -\r' or not self._active:
+                    # Separators, and the " - done." after 100
+                    i += 1
+                else:
+                    # A warning interleaved with the bar; it runs to the newline
+                    self._in_bar = False
+                continue
+
+            line_start = i == 0 or buf[i - 1] == '\n'
+            if line_start and self._active and buf[i] == '.':
+                self._in_bar = True  # The bar resuming after a warning
+                continue
+            if line_start:
+                m = _PROGRESS_START.match(buf, i)
+                if m and m.end() == len(buf):
+                    break  # Cannot tell a bar from text yet; wait for more
+                if m and buf[m.end()] == '.' and (m.group() == '0' or self._active):
+                    self._in_bar = True
+                    continue
+            end = buf.find('\n', i)
+            if end < 0:
+                break
+            line = buf[i:end].rstrip('\r')
+            if line.strip():
+                events.append(('line', line))
+            i = end + 1
+        self._buffer = buf[i:]
+        return events
+
+    def finish(self):
+        """Flush whatever is left once the process has exited"""
+        events = []
+        if self._digits:
+            self._set(int(self._digits), events)
+            self._digits = ''
+        rest = self._buffer.strip()
+        self._buffer = ''
+        if rest and not self._in_bar:
+            events.append(('line', rest))
+        self._in_bar = False
+        return events
+
+
+class StageProgress:
+    """Map one stage's 0-100 onto [start, end] of the overall progress
+
+    total/unit describe the stage's work (e.g. source megapixels) so status
+    updates can report throughput; the ETA is extrapolated from the average
+    rate since the stage began. Status updates are throttled to `interval`.
+    """
+
+    def __init__(self, progress, start, end, stage='', total=None, unit=None,
+                 status=None, interval=0.5, clock=time.monotonic):
+        self.progress = progress
+        self.start = start
+        self.end = end
+        self.stage = stage
+        self.total = total
+        self.unit = unit
+        self.status = status
+        self.interval = interval
+        self.clock = clock
+        self.started = clock()
+        self._last_status = None
+        self.stage_percent = 0.0
+
+    def __call__(self, stage_percent):
+        self.update(stage_percent)
+
+    def update(self, stage_percent):
+        stage_percent = max(0.0, min(float(stage_percent), 100.0))
+        self.stage_percent = stage_percent
+        overall = self.start + (self.end - self.start) * stage_percent / 100.0
+        if self.progress:
+            self.progress(overall)
+        if self.status is None:
+            return
+        now = self.clock()
+        if (self._last_status is not None and stage_percent < 100
+                and now - self._last_status < self.interval):
+            return
+        self._last_status = now
+        self.status(self.snapshot(now, overall))
+
+    def snapshot(self, now=None, overall=None):
+        now = self.clock() if now is None else now
+        if overall is None:
+            overall = self.start + (self.end - self.start) * self.stage_percent / 100.0
+        elapsed = now - self.started
+        rate = eta = None
+        if elapsed > 0 and self.stage_percent > 0:
+            if self.total:
+                rate = self.total * self.stage_percent / 100.0 / elapsed
+            eta = elapsed * (100.0 - self.stage_percent) / self.stage_percent
+        return ProgressUpdate(self.stage, overall, self.stage_percent, rate, self.unit, eta)
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+
+
+def format_update(update):
+    """One-line description of a ProgressUpdate for status bars"""
+    parts = [f"{update.stage}: {update.stage_percent:.0f}%" if update.stage
+             else f"{update.stage_percent:.0f}%"]
+    if update.rate is not None:
+        parts.append(f"{update.rate:.1f} {update.unit}/s")
+    if update.eta is not None and update.stage_percent < 100:
+        parts.append(f"ETA {format_duration(update.eta)}")
+    return ' · '.join(parts)
@@ -0,0 +1,189 @@
+"""
+Stage cache
+Intermediate rasters (hillshade, Web Mercator warp) kept across runs in the user
+cache directory, keyed by a hash of the input identity and the parameters of the
+stage that made them, and evicted least recently used past a size cap
+"""
+
+import os
+import shutil
+import time
+import uuid
+
+from hillshade import checkpoint, instrument, userdirs
+
+CACHE_VERSION = 1
+DEFAULT_MAX_BYTES = 20 << 30
+# Cached rasters are compressed; they are read back far more often than written
+CREATION_OPTIONS = ['TILED=YES', 'COMPRESS=DEFLATE', 'PHOTOMETRIC=MINISBLACK']
+# Entries touched this recently are never evicted, even without a lease
+RECENT_SECONDS = 60
+
+ENTRY_FILE = 'entry.json'
+SETTINGS_FILE = 'cache.json'
+LEASE_PREFIX = 'lease-'
+TMP_PREFIX = '.tmp-'
+
+
+def cache_root():
+    return os.path.join(userdirs.cache_dir(), 'stages')
+
+
+def stage_key(stage, input_paths, params):
+    """Hash of the input identity, the stage and the parameters its output depends on"""
+    return checkpoint.job_key(input_paths, {'version': CACHE_VERSION, 'stage': stage,
+                                            'params': params})
+
+
+def _owner_pid(name, prefix):
+    """pid in a lease or scratch directory name (<prefix><pid>-<id>)"""
+    try:
+        return int(name[len(prefix):].split('-', 1)[0])
+    except ValueError:
+        return None
+
+
+class StageCache:
+    """Directory of cache entries, one per stage output: <root>/<key>/<file>
+
+    An entry's directory mtime is its last use. Entries are leased (a
+    lease-<pid>-<id> file) while a conversion reads them, and eviction skips
+    leased entries whose process is still alive.
+    """
+
+    def __init__(self, root=None, max_bytes=None):
+        self.root = root or cache_root()
+        os.makedirs(self.root, exist_ok=True)
+        self._max_bytes = max_bytes
+        self._leases = []
+
+    @property
+    def settings_path(self):
+        return os.path.join(self.root, SETTINGS_FILE)
+
+    @property
+    def max_bytes(self):
+        """Size cap: the constructor's, else the saved one, else DEFAULT_MAX_BYTES"""
+        if self._max_bytes is not None:
+            return self._max_bytes
+        return userdirs.read_json(self.settings_path, {}).get('max_bytes', DEFAULT_MAX_BYTES)
+
+    def set_max_bytes(self, max_bytes):
+        """Save the size cap for later runs and evict down to it"""
+        userdirs.write_json(self.settings_path, {'max_bytes': max_bytes})
+        self._max_bytes = None
+        return self.evict()
+
+    def _entry(self, key):
+        return os.path.join(self.root, key)
+
+    def _lease(self, key):
+        entry = self._entry(key)
+        lease = os.path.join(entry, f'{LEASE_PREFIX}{os.getpid()}-{uuid.uuid4().hex[:8]}')
+        # Creating the lease also bumps the entry's mtime, marking it used
+        with open(lease, 'w'):
+            pass
+        self._leases.append(lease)
+
+    def get(self, key, filename):
+        """Path of a cached stage output, leased until release(), or None"""
+        path = os.path.join(self._entry(key), filename)
+        if not os.path.isfile(path):
+            return None
+        try:
+            self._lease(key)
+        except OSError:
+            return None  # Evicted in the meantime
+        return path if os.path.isfile(path) else None
+
+    def contains(self, key, filename):
+        return os.path.isfile(os.path.join(self._entry(key), filename))
+
+    def put(self, key, filename, produce, info=None):
+        """Cache the file produce(path) writes and return its (leased) path
+
+        The file is written in a scratch directory that is renamed into
+        place, so a concurrent run never sees a partial entry. If another run
+        stored the same key first, its entry wins.
+        """
+        scratch = os.path.join(self.root, f'{TMP_PREFIX}{os.getpid()}-{uuid.uuid4().hex[:8]}')
+        os.makedirs(scratch)
+        try:
+            produce(os.path.join(scratch, filename))
+            userdirs.write_json(os.path.join(scratch, ENTRY_FILE),
+                                dict(info or {}, created=round(time.time(), 3)))
+            try:
+                os.rename(scratch, self._entry(key))
+            except OSError:
+                if not os.path.isdir(self._entry(key)):
+                    raise
+                shutil.rmtree(scratch, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(scratch, ignore_errors=True)
+            raise
+        self._lease(key)
+        return os.path.join(self._entry(key), filename)
+
+    def release(self):
+        """Drop this cache's leases; the entries count as used now"""
+        for lease in self._leases:
+            try:
+                os.remove(lease)
+            except OSError:
+                pass
+        self._leases = []
+
+    def entries(self):
+        """(key, bytes, last used, leased) per entry, least recently used first"""
+        result = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if not os.path.isdir(path):
+                continue
+            if name.startswith(TMP_PREFIX):
+                # Scratch left behind by a run that crashed while writing
+                if not userdirs.pid_alive(_owner_pid(name, TMP_PREFIX)):
+                    shutil.rmtree(path, ignore_errors=True)
+                continue
+            try:
+                leases = [lease for lease in os.listdir(path) if lease.startswith(LEASE_PREFIX)]
+                used = os.stat(path).st_mtime
+            except OSError:
+                continue
+            leased = False
+            for lease in leases:
+                if userdirs.pid_alive(_owner_pid(lease, LEASE_PREFIX)):
+                    leased = True
+                    continue
+                # Left by a crashed run; removing it must not count as a use
+                try:
+                    os.remove(os.path.join(path, lease))
+                    os.utime(path, (used, used))
+                except OSError:
+                    pass
+            result.append((name, instrument.tree_bytes(path), used, leased))
+        result.sort(key=lambda entry: entry[2])
+        return result
+
+    def total_bytes(self):
+        return sum(size for _, size, _, _ in self.entries())
+
+    def evict(self, max_bytes=None, grace=RECENT_SECONDS):
+        """Remove least recently used entries until the cache fits; returns bytes freed"""
+        limit = self.max_bytes if max_bytes is None else max_bytes
+        entries = self.entries()
+        total = sum(size for _, size, _, _ in entries)
+        freed = 0
+        now = time.time()
+        for key, size, used, leased in entries:
+            if total - freed <= limit:
+                break
+            if leased or now - used < grace:
+                continue
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+            freed += size
+        return freed
+
+    def clear(self):
+        """Remove every entry not in use; returns bytes freed"""
+        return self.evict(max_bytes=0, grace=0)
@@ -0,0 +1,642 @@
+"""
+Built-in parallel MBTiles tiler
+Renders the max zoom level in blocks across a process pool and builds each
+lower zoom by 2x2-averaging child tiles instead of resampling the source.
+"""
+
+import math
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+
+from hillshade import encoding as tile_encoding
+from hillshade import engine
+from hillshade.encoding import EncodingStats, decode_tile, encode_parallel, encode_tiles
+from hillshade.mbtiles import MBTilesWriter, read_metadata
+
+TILE_SIZE = 256
+# Max-zoom tiles per block edge is 2**BLOCK_LEVELS; each block is warped once
+BLOCK_LEVELS = 3
+WEB_MERCATOR_HALF = 20037508.342789244
+MAX_LATITUDE = 85.0511287798066
+# Source pixels read around a block: 1 for the Horn window, the rest for bilinear
+SOURCE_MARGIN = 3
+
+# Memory planning under a budget (see plan_memory)
+# Per output pixel of a block: warped Byte, tile stacks and PNG encoding
+OUTPUT_BYTES_PER_PIXEL = 8
+# Per source pixel of an already shaded Byte raster: read buffer and MEM copy
+SHADED_BYTES_PER_PIXEL = 2
+# Share of the budget kept for the parent: writer batches, root tiles, GDAL cache
+PARENT_MEMORY_SHARE = 0.25
+# Blocks are shrunk until at least this many fit in the budget at once
+MIN_PARALLEL_BLOCKS = 4
+
+MemoryPlan = namedtuple('MemoryPlan', ['levels', 'workers', 'max_window_pixels',
+                                       'gdal_cache', 'keep_roots'])
+
+
+def tile_span(zoom):
+    """Width of one tile in Web Mercator metres"""
+    return 2 * WEB_MERCATOR_HALF / (1 << zoom)
+
+
+def tile_bounds(zoom, x, y, count=1):
+    """Web Mercator bounds of a count x count group of XYZ tiles"""
+    span = tile_span(zoom)
+    minx = -WEB_MERCATOR_HALF + x * span
+    maxy = WEB_MERCATOR_HALF - y * span
+    return minx, maxy - count * span, minx + count * span, maxy
+
+
+def range_bounds(zoom, x0, y0, x1, y1):
+    """Web Mercator bounds of the inclusive XYZ tile range x0..x1, y0..y1"""
+    minx, _, _, maxy = tile_bounds(zoom, x0, y0)
+    _, miny, maxx, _ = tile_bounds(zoom, x1, y1)
+    return minx, miny, maxx, maxy
+
+
+def tile_range(bounds, zoom):
+    """Inclusive XYZ tile range (x0, y0, x1, y1) covering Web Mercator bounds"""
+    span = tile_span(zoom)
+    n = 1 << zoom
+    minx, miny, maxx, maxy = bounds
+    x0 = int(math.floor((minx + WEB_MERCATOR_HALF) / span))
+    x1 = int(math.ceil((maxx + WEB_MERCATOR_HALF) / span)) - 1
+    y0 = int(math.floor((WEB_MERCATOR_HALF - maxy) / span))
+    y1 = int(math.ceil((WEB_MERCATOR_HALF - miny) / span)) - 1
+    clamp = lambda v: min(max(v, 0), n - 1)
+    return clamp(x0), clamp(y0), clamp(max(x0, x1)), clamp(max(y0, y1))
+
+
+def _srs(wkt_or_code):
+    from osgeo import osr
+    srs = osr.SpatialReference()
+    if wkt_or_code.startswith('EPSG:'):
+        srs.ImportFromEPSG(int(wkt_or_code[5:]))
+    else:
+        srs.ImportFromWkt(wkt_or_code)
+    srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    return srs
+
+
+def _transform_bounds(bounds, src_wkt, dst_wkt, densify=21):
+    """Transform a bounding box by densifying its edges"""
+    from osgeo import osr
+    transform = osr.CoordinateTransformation(_srs(src_wkt), _srs(dst_wkt))
+    minx, miny, maxx, maxy = bounds
+    points = []
+    for i in range(densify):
+        t = i / (densify - 1.0)
+        x = minx + (maxx - minx) * t
+        y = miny + (maxy - miny) * t
+        points += [(x, miny), (x, maxy), (minx, y), (maxx, y)]
+    xs, ys = [], []
+    for px, py in points:
+        try:
+            tx, ty = transform.TransformPoint(px, py)[:2]
+        except RuntimeError:
+            continue
+        if math.isfinite(tx) and math.isfinite(ty):
+            xs.append(tx)
+            ys.append(ty)
+    if not xs:
+        return None
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def lonlat_to_mercator(geo_bounds):
+    """Web Mercator bounds of (west, south, east, north) in degrees"""
+    west, south, east, north = geo_bounds
+    return _transform_bounds((max(west, -180.0), max(south, -MAX_LATITUDE),
+                              min(east, 180.0), min(north, MAX_LATITUDE)),
+                             'EPSG:4326', 'EPSG:3857')
+
+
+def raster_bounds(ds):
+    gt = ds.GetGeoTransform()
+    xs = [gt[0], gt[0] + gt[1] * ds.RasterXSize]
+    ys = [gt[3], gt[3] + gt[5] * ds.RasterYSize]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def mercator_bounds(path):
+    """Web Mercator bounds of a raster, clamped to the valid latitude range"""
+    ds = engine.require_gdal().Open(os.fspath(path))
+    srs_wkt = ds.GetProjection()
+    bounds = raster_bounds(ds)
+    if not srs_wkt:
+        raise RuntimeError(f"Input has no coordinate reference system: {path}")
+    geo = _transform_bounds(bounds, srs_wkt, 'EPSG:4326')
+    if geo is None:
+        raise RuntimeError(f"Cannot transform input bounds of {path}")
+    minlon, minlat, maxlon, maxlat = geo
+    clamped = (max(minlon, -180.0), max(minlat, -MAX_LATITUDE),
+               min(maxlon, 180.0), min(maxlat, MAX_LATITUDE))
+    return _transform_bounds(clamped, 'EPSG:4326', 'EPSG:3857'), clamped
+
+
+def _source_window(ds, bounds, margin=SOURCE_MARGIN):
+    """Pixel window (xoff, yoff, xsize, ysize) of ds covering Mercator bounds
+
+    margin source pixels are added on every side, clipped to the raster.
+    """
+    src = _transform_bounds(bounds, 'EPSG:3857', ds.GetProjection())
+    if src is None:
+        return None
+    gt = ds.GetGeoTransform()
+    cols = [(src[0] - gt[0]) / gt[1], (src[2] - gt[0]) / gt[1]]
+    rows = [(src[1] - gt[3]) / gt[5], (src[3] - gt[3]) / gt[5]]
+    x0 = max(int(math.floor(min(cols))) - margin, 0)
+    y0 = max(int(math.floor(min(rows))) - margin, 0)
+    x1 = min(int(math.ceil(max(cols))) + margin, ds.RasterXSize)
+    y1 = min(int(math.ceil(max(rows))) + margin, ds.RasterYSize)
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def render_window(source_path, bounds, width, height, shading=None,
+                  max_window_pixels=None):
+    """Render Web Mercator bounds to a (height, width) Byte array, 0 = nodata
+
+    With shading (a dict of engine.hillshade keyword arguments) source_path is
+    a DEM and the hillshade is computed in its native CRS for just this window
+    plus a halo, so no full-size hillshade raster is ever needed. Without it,
+    source_path is an already shaded Byte raster. A source window larger than
+    max_window_pixels is read averaged down to that size, with the margin
+    widened so it still spans SOURCE_MARGIN of the averaged pixels; adjacent
+    windows then shade their shared edges from real data, not extrapolation.
+    """
+    gdal = engine.require_gdal()
+    ds = gdal.Open(os.fspath(source_path))
+    margin = SOURCE_MARGIN
+    factor = 1.0
+    while True:
+        window = _source_window(ds, bounds, margin)
+        if window is None:
+            return None
+        xoff, yoff, xsize, ysize = window
+        if max_window_pixels is None or xsize * ysize <= max_window_pixels:
+            break
+        factor = math.sqrt(xsize * ysize / float(max_window_pixels))
+        if margin >= SOURCE_MARGIN * factor:
+            break
+        # The wider window decimates a little more; converges in a step or two
+        margin = int(math.ceil(SOURCE_MARGIN * factor))
+    gt = ds.GetGeoTransform()
+    band = ds.GetRasterBand(1)
+    if factor > 1.0:
+        buf_xsize = max(1, int(xsize / factor))
+        buf_ysize = max(1, int(ysize / factor))
+        values = band.ReadAsArray(xoff, yoff, xsize, ysize, buf_xsize=buf_xsize,
+                                  buf_ysize=buf_ysize, resample_alg=gdal.GRIORA_Average)
+        sx, sy = xsize / float(buf_xsize), ysize / float(buf_ysize)
+        xsize, ysize = buf_xsize, buf_ysize
+    else:
+        values = band.ReadAsArray(xoff, yoff, xsize, ysize)
+        sx = sy = 1.0
+    window_gt = (gt[0] + xoff * gt[1] + yoff * gt[2], gt[1] * sx, gt[2] * sy,
+                 gt[3] + xoff * gt[4] + yoff * gt[5], gt[4] * sx, gt[5] * sy)
+    if shading is not None:
+        values = engine.hillshade(values.astype(np.float32, copy=False), window_gt,
+                                  band.GetNoDataValue(), compute_edges=True, **shading)
+        nodata = engine.HILLSHADE_NODATA
+    else:
+        nodata = band.GetNoDataValue()
+
+    mem = gdal.GetDriverByName('MEM').Create('', xsize, ysize, 1, gdal.GDT_Byte)
+    mem.SetGeoTransform(window_gt)
+    mem.SetProjection(ds.GetProjection())
+    mem_band = mem.GetRasterBand(1)
+    if nodata is not None:
+        mem_band.SetNoDataValue(nodata)
+    mem_band.WriteArray(values)
+
+    out = gdal.Warp('', mem, format='MEM', dstSRS='EPSG:3857',
+                    outputBounds=bounds, width=width, height=height,
+                    resampleAlg='bilinear', dstNodata=engine.HILLSHADE_NODATA,
+                    outputType=gdal.GDT_Byte)
+    return out.GetRasterBand(1).ReadAsArray()
+
+
+def to_tile(grey):
+    """Byte array (0 = nodata) -> uint8 (2, N, N) grey/alpha tile, or None if empty"""
+    alpha = np.where(grey != engine.HILLSHADE_NODATA, 255, 0).astype(np.uint8)
+    if not alpha.any():
+        return None
+    return np.stack([grey.astype(np.uint8, copy=False), alpha])
+
+
+def downsample(children):
+    """Average four child tiles [nw, ne, sw, se] into their parent (alpha-weighted)"""
+    grey = np.zeros((TILE_SIZE * 2, TILE_SIZE * 2), np.float32)
+    alpha = np.zeros((TILE_SIZE * 2, TILE_SIZE * 2), np.float32)
+    any_child = False
+    for index, child in enumerate(children):
+        if child is None:
+            continue
+        any_child = True
+        row, col = divmod(index, 2)
+        sl = (slice(row * TILE_SIZE, (row + 1) * TILE_SIZE),
+              slice(col * TILE_SIZE, (col + 1) * TILE_SIZE))
+        child_alpha = child[1].astype(np.float32)
+        grey[sl] = child[0] * child_alpha
+        alpha[sl] = child_alpha
+    if not any_child:
+        return None
+    weighted = grey.reshape(TILE_SIZE, 2, TILE_SIZE, 2).sum(axis=(1, 3))
+    coverage = alpha.reshape(TILE_SIZE, 2, TILE_SIZE, 2).sum(axis=(1, 3))
+    parent_alpha = (coverage / 4.0 + 0.5).astype(np.uint8)
+    if not parent_alpha.any():
+        return None
+    parent_grey = np.divide(weighted, coverage, out=np.zeros_like(weighted),
+                            where=coverage > 0)
+    return np.stack([(parent_grey + 0.5).astype(np.uint8), parent_alpha])
+
+
+def _encoded(zoom, tiles, encoding, stats):
+    """[(zoom, x, y, data)] for a dict of (x, y) -> tile"""
+    return [(zoom, x, y, data) for (x, y), data in
+            encode_tiles(list(tiles.items()), encoding, stats)]
+
+
+def render_block(source_path, zoom, bx, by, levels, min_zoom, shading=None,
+                 max_window_pixels=None, encoding=tile_encoding.PNG, extent=None):
+    """Worker: render a 2**levels block at `zoom` and its in-block ancestors
+
+    Returns (encoded tiles, root tile, encoding.EncodingStats) where the root
+    is the raw (grey, alpha) tile at zoom - levels, used to continue the
+    pyramid in the parent process. extent (inclusive x0, y0, x1, y1 tiles
+    from a coverage index) limits the warp to the part of the block with data.
+    """
+    count = 1 << levels
+    if extent is None:
+        extent = (bx * count, by * count, bx * count + count - 1, by * count + count - 1)
+    x0, y0, x1, y1 = extent
+    columns, rows = x1 - x0 + 1, y1 - y0 + 1
+    grey = render_window(source_path, range_bounds(zoom, x0, y0, x1, y1),
+                         TILE_SIZE * columns, TILE_SIZE * rows, shading,
+                         max_window_pixels)
+    stats = EncodingStats()
+    if grey is None:
+        return [], None, stats
+
+    current = {}
+    for ty in range(rows):
+        for tx in range(columns):
+            tile = to_tile(grey[ty * TILE_SIZE:(ty + 1) * TILE_SIZE,
+                                tx * TILE_SIZE:(tx + 1) * TILE_SIZE])
+            if tile is not None:
+                current[(x0 + tx, y0 + ty)] = tile
+    del grey
+
+    encoded = _encoded(zoom, current, encoding, stats)
+    for z in range(zoom - 1, zoom - levels - 1, -1):
+        current = build_parents(current)
+        if z >= min_zoom:
+            encoded += _encoded(z, current, encoding, stats)
+    root = current.get((bx, by))
+    return encoded, root, stats
+
+
+def build_parents(tiles):
+    """Build the next lower zoom level from a dict of (x, y) -> tile"""
+    parents = {}
+    for px, py in {(x // 2, y // 2) for x, y in tiles}:
+        children = [tiles.get((2 * px + dx, 2 * py + dy))
+                    for dy in (0, 1) for dx in (0, 1)]
+        parent = downsample(children)
+        if parent is not None:
+            parents[(px, py)] = parent
+    return parents
+
+
+def build_lower_zooms(writer, roots, bounds, root_zoom, min_zoom,
+                      encoding=tile_encoding.PNG, pool=None, stats=None):
+    """Build zoom levels below root_zoom down to min_zoom
+
+    With roots (a dict of root tiles) the pyramid is built in memory; with
+    None each level is built from the stored level above, two tile rows at a
+    time, so memory does not grow with the extent. Tiles are encoded on pool
+    (a process pool) when given.
+    """
+    def write_level(z, tiles):
+        encoded = encode_parallel(list(tiles.items()), encoding, pool, stats)
+        writer.write_tiles([(z, x, y, data) for (x, y), data in encoded])
+
+    if roots is not None:
+        current = roots
+        for z in range(root_zoom - 1, min_zoom - 1, -1):
+            current = build_parents(current)
+            write_level(z, current)
+        return
+    for z in range(root_zoom - 1, min_zoom - 1, -1):
+        writer.flush()
+        x0, y0, x1, y1 = tile_range(bounds, z)
+        for py in range(y0, y1 + 1):
+            stored = writer.read_rows(z + 1, 2 * py, 2 * py + 1)
+            if not stored:
+                continue
+            children = {key: decode_tile(data) for key, data in stored.items()}
+            write_level(z, build_parents(children))
+
+
+def plan_memory(bounds, raster_width, min_zoom, max_zoom, workers, max_memory,
+                shading=None):
+    """Choose block size, worker count and read limits for a memory budget
+
+    Block size depends only on the budget and the source, not the worker
+    count, so a resumed job always sees the same blocks. Workers are then
+    limited to what fits; if a single one-tile block still does not fit,
+    source windows are read decimated.
+    """
+    levels = min(BLOCK_LEVELS, max_zoom - min_zoom)
+    if max_memory is None:
+        return MemoryPlan(levels, workers, None, None, True)
+
+    budget = max_memory * (1 - PARENT_MEMORY_SHARE)
+    source_pixel = (bounds[2] - bounds[0]) / float(raster_width)
+    source_bpp = (engine.WORKING_BYTES_PER_PIXEL if shading is not None
+                  else SHADED_BYTES_PER_PIXEL)
+
+    def block_bytes(lv):
+        edge = tile_span(max_zoom) * (1 << lv) / source_pixel + 2 * SOURCE_MARGIN
+        return edge * edge * source_bpp + (TILE_SIZE << lv) ** 2 * OUTPUT_BYTES_PER_PIXEL
+
+    while levels > 0 and block_bytes(levels) * MIN_PARALLEL_BLOCKS > budget:
+        levels -= 1
+    workers = max(1, min(workers, int(budget // block_bytes(levels))))
+    max_window_pixels = None
+    if block_bytes(levels) > budget:
+        output_bytes = (TILE_SIZE << levels) ** 2 * OUTPUT_BYTES_PER_PIXEL
+        max_window_pixels = max(int((budget - output_bytes) // source_bpp),
+                                (TILE_SIZE << levels) ** 2)
+    # GDAL's block cache defaults to 5% of RAM in every worker
+    gdal_cache = int(min(64 << 20, budget / workers / 8))
+
+    root_zoom = max_zoom - levels
+    bx0, by0, bx1, by1 = tile_range(bounds, root_zoom)
+    roots_bytes = (bx1 - bx0 + 1) * (by1 - by0 + 1) * 2 * TILE_SIZE * TILE_SIZE
+    keep_roots = roots_bytes <= max_memory * PARENT_MEMORY_SHARE / 2
+    return MemoryPlan(levels, workers, max_window_pixels, gdal_cache, keep_roots)
+
+
+def _init_worker(gdal_cache):
+    gdal = engine.require_gdal()
+    if gdal_cache:
+        gdal.SetCacheMax(gdal_cache)
+    # One worker per core already; a forked worker would otherwise inherit the
+    # conversion's GDAL_NUM_THREADS and each warp would spawn a thread per core
+    gdal.SetConfigOption('GDAL_NUM_THREADS', '1')
+
+
+def _lonlat_bounds_text(geo_bounds):
+    return ','.join(f'{v:.6f}' for v in geo_bounds)
+
+
+def build_mbtiles(source_path, output_path, min_zoom, max_zoom, shading=None,
+                  workers=None, name=None, log=print, progress=None,
+                  manifest=None, checkpoint_every=16, max_memory=None,
+                  encoding=None, stats=None, coverage=None):
+    """Tile source_path into output_path using a process pool
+
+    shading is passed to render_window; see there for the two source modes.
+    With a checkpoint.JobManifest, finished blocks are recorded every
+    checkpoint_every blocks (after their tiles are synced) and skipped when
+    the job is rerun. max_memory (bytes) caps the estimated peak across all
+    processes; see plan_memory. Tiles are written in encoding (a spec string
+    or encoding.TileEncoding, default PNG), encoded on the worker processes;
+    per-format sizes and times are logged and accumulated into stats. With
+    a coverage.CoverageIndex, blocks without indexed tiles are skipped and
+    the rest are warped only over their indexed tiles.
+    """
+    if not engine.is_available():
+        raise RuntimeError("GDAL Python bindings (osgeo) are not installed")
+    if min_zoom > max_zoom:
+        raise ValueError("Min zoom must not exceed max zoom")
+
+    workers = workers or os.cpu_count() or 1
+    encoding = tile_encoding.parse_encoding(encoding)
+    stats = stats if stats is not None else EncodingStats()
+    bounds, geo_bounds = mercator_bounds(source_path)
+    plan = plan_memory(bounds, engine.raster_size(source_path)[0], min_zoom, max_zoom,
+                       workers, max_memory, shading)
+    levels, workers = plan.levels, plan.workers
+    if max_memory is not None:
+        log(f"Memory limit {max_memory / 1073741824.0:.1f} GB: "
+            f"{1 << levels}x{1 << levels} tile blocks, {workers} workers"
+            + (", decimated source reads" if plan.max_window_pixels else "")
+            + ("" if plan.keep_roots else ", lower zooms built from disk"))
+    root_zoom = max_zoom - levels
+    bx0, by0, bx1, by1 = tile_range(bounds, root_zoom)
+    blocks = [(bx, by) for by in range(by0, by1 + 1) for bx in range(bx0, bx1 + 1)]
+    extents = {}
+    if coverage is not None:
+        count = 1 << levels
+        for bx, by in blocks:
+            extents[(bx, by)] = coverage.extent(max_zoom, bx * count, by * count,
+                                                bx * count + count - 1, by * count + count - 1)
+        covered = [b for b in blocks if extents[b] is not None]
+        log(f"Coverage index: {len(blocks) - len(covered)} of {len(blocks)} blocks "
+            f"have no data and are skipped")
+        blocks = covered
+    finished_blocks = []
+    if manifest is not None:
+        finished_blocks = [b for b in blocks if manifest.block_done(b)]
+        if finished_blocks:
+            log(f"Resuming: {len(finished_blocks)} of {len(blocks)} blocks already done")
+            blocks = [b for b in blocks if not manifest.block_done(b)]
+    log(f"Rendering {len(blocks)} blocks of {1 << levels}x{1 << levels} tiles "
+        f"at zoom {max_zoom} on {workers} worker processes "
+        f"as {tile_encoding.describe(encoding)}")
+
+    metadata = {
+        'name': name or os.path.splitext(os.path.basename(output_path))[0],
+        'type': 'overlay',
+        'version': '1.1',
+        'description': 'Hillshade',
+        'format': tile_encoding.MBTILES_FORMATS[encoding.format],
+        'minzoom': min_zoom,
+        'maxzoom': max_zoom,
+        'bounds': _lonlat_bounds_text(geo_bounds),
+    }
+    roots = {} if plan.keep_roots else None
+    with MBTilesWriter(output_path, metadata) as writer, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                initargs=(plan.gdal_cache,)) as pool:
+        # Blocks finished by an earlier run contribute their stored root tiles
+        for block in finished_blocks if roots is not None else ():
+            data = writer.read_tile(root_zoom, block[0], block[1])
+            if data is not None:
+                roots[block] = decode_tile(data)
+
+        pending = {}
+        queue = iter(blocks)
+        done_blocks = 0
+        unrecorded = []
+
+        def record_checkpoint():
+            if manifest is not None and unrecorded:
+                writer.checkpoint()
+                manifest.complete_blocks(unrecorded)
+                del unrecorded[:]
+
+        def submit_next():
+            block = next(queue, None)
+            if block is not None:
+                future = pool.submit(render_block, source_path, max_zoom, block[0],
+                                     block[1], levels, min_zoom, shading,
+                                     plan.max_window_pixels, encoding,
+                                     extents.get(block))
+                pending[future] = block
+
+        # Bound in-flight results so memory does not grow with the extent
+        for _ in range(workers * 2):
+            submit_next()
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                block = pending.pop(future)
+                encoded, root, block_stats = future.result()
+                writer.write_tiles(encoded)
+                stats.merge(block_stats)
+                if root is not None and roots is not None:
+                    roots[block] = root
+                done_blocks += 1
+                unrecorded.append(block)
+                if len(unrecorded) >= checkpoint_every:
+                    record_checkpoint()
+                if progress:
+                    progress(100.0 * done_blocks / max(len(blocks), 1))
+                submit_next()
+        record_checkpoint()
+
+        # Zoom levels below the block roots are cheap; build them here
+        build_lower_zooms(writer, roots, bounds, root_zoom, min_zoom, encoding,
+                          pool, stats)
+
+    log(f"Wrote {writer.tiles_written} tiles as {writer.images_written} unique images "
+        f"({writer.bytes_written / 1048576.0:.1f} MB)")
+    for line in stats.summary():
+        log(f"  {line}")
+    return writer.tiles_written
+
+
+def changed_tiles(footprints, zoom, halo=0.0):
+    """XYZ tiles at zoom touched by any of the Web Mercator footprints grown by halo"""
+    tiles = set()
+    for minx, miny, maxx, maxy in footprints:
+        x0, y0, x1, y1 = tile_range((minx - halo, miny - halo, maxx + halo, maxy + halo),
+                                    zoom)
+        tiles.update((x, y) for y in range(y0, y1 + 1) for x in range(x0, x1 + 1))
+    return tiles
+
+
+def _updated_metadata(writer, footprints):
+    """bounds metadata grown to include the changed footprints"""
+    geo = [_transform_bounds(fp, 'EPSG:3857', 'EPSG:4326') for fp in footprints]
+    stored = read_metadata(writer.conn).get('bounds')
+    if stored:
+        geo.append(tuple(float(v) for v in stored.split(',')))
+    geo = [b for b in geo if b is not None]
+    if not geo:
+        return {}
+    union = (min(b[0] for b in geo), min(b[1] for b in geo),
+             max(b[2] for b in geo), max(b[3] for b in geo))
+    return {'bounds': _lonlat_bounds_text(union)}
+
+
+def update_mbtiles(source_path, output_path, footprints, min_zoom, max_zoom,
+                   shading=None, workers=None, log=print, progress=None,
+                   encoding=None, stats=None, max_memory=None):
+    """Re-render the tiles of an existing MBTiles that changed regions touch
+
+    footprints are the Web Mercator bounds of the changed parts of the
+    source. Max-zoom tiles within them, plus a halo of SOURCE_MARGIN source
+    pixels for the hillshade window and bilinear warp, are rendered from
+    source_path in blocks on a process pool. Each lower zoom then rebuilds
+    only the parents of changed tiles from their stored children. Tiles are
+    upserted; tiles that now render empty are removed. Rerunning an update
+    gives the same file, so an interrupted one is simply run again.
+    max_memory bounds the blocks, workers and GDAL caches as in build_mbtiles.
+    Returns (tiles written, tiles removed).
+    """
+    if not engine.is_available():
+        raise RuntimeError("GDAL Python bindings (osgeo) are not installed")
+    workers = workers or os.cpu_count() or 1
+    encoding = tile_encoding.parse_encoding(encoding)
+    stats = stats if stats is not None else EncodingStats()
+    bounds, _ = mercator_bounds(source_path)
+    raster_width = engine.raster_size(source_path)[0]
+    # Blocks only group max-zoom tiles here, so plan as if zooms went down a block
+    plan = plan_memory(bounds, raster_width, max(max_zoom - BLOCK_LEVELS, 0), max_zoom,
+                       workers, max_memory, shading)
+    workers = plan.workers
+    halo = SOURCE_MARGIN * (bounds[2] - bounds[0]) / float(raster_width)
+    changed = changed_tiles(footprints, max_zoom, halo)
+    count = 1 << plan.levels
+    blocks = {}
+    for x, y in changed:
+        blocks.setdefault((x // count, y // count), []).append((x, y))
+    log(f"Updating {len(changed)} tiles at zoom {max_zoom} in {len(blocks)} blocks "
+        f"on {workers} worker processes")
+
+    removed = 0
+    with MBTilesWriter(output_path) as writer, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                initargs=(plan.gdal_cache,)) as pool:
+        writer.set_metadata(_updated_metadata(writer, footprints))
+        pending = {}
+        queue = iter(blocks.values())
+        done_blocks = 0
+
+        def submit_next():
+            tiles = next(queue, None)
+            if tiles is not None:
+                xs, ys = [x for x, _ in tiles], [y for _, y in tiles]
+                # One-tile "blocks" (levels 0): the extent is what gets warped
+                future = pool.submit(render_block, source_path, max_zoom, min(xs), min(ys),
+                                     0, max_zoom, shading, plan.max_window_pixels, encoding,
+                                     (min(xs), min(ys), max(xs), max(ys)))
+                pending[future] = set(tiles)
+
+        for _ in range(workers * 2):
+            submit_next()
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                tiles = pending.pop(future)
+                encoded, _, block_stats = future.result()
+                encoded = [tile for tile in encoded if (tile[1], tile[2]) in tiles]
+                removed += writer.delete_tiles(
+                    max_zoom, tiles - {(x, y) for _, x, y, _ in encoded})
+                writer.write_tiles(encoded)
+                stats.merge(block_stats)
+                done_blocks += 1
+                if progress:
+                    progress(90.0 * done_blocks / max(len(blocks), 1))
+                submit_next()
+
+        for z in range(max_zoom - 1, min_zoom - 1, -1):
+            changed = {(x // 2, y // 2) for x, y in changed}
+            writer.flush()
+            for py in sorted({y for _, y in changed}):
+                row = {x for x, y in changed if y == py}
+                stored = writer.read_range(z + 1, 2 * min(row), 2 * py,
+                                           2 * max(row) + 1, 2 * py + 1)
+                children = {key: decode_tile(data) for key, data in stored.items()
+                            if key[0] // 2 in row}
+                parents = build_parents(children)
+                encoded = encode_parallel(list(parents.items()), encoding, pool, stats)
+                removed += writer.delete_tiles(z, {(x, py) for x in row} - set(parents))
+                writer.write_tiles([(z, x, y, data) for (x, y), data in encoded])
+            if progress:
+                progress(90.0 + 10.0 * (max_zoom - z) / max(max_zoom - min_zoom, 1))
+
+    log(f"Wrote {writer.tiles_written} tiles, removed {removed} that no longer have data")
+    for line in stats.summary():
+        log(f"  {line}")
+    return writer.tiles_written, removed
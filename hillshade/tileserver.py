@@ -0,0 +1,490 @@
+"""
+Tile server
+Renders XYZ hillshade tiles on demand straight from the DEM and serves them on
+localhost, behind an in-memory LRU and a persistent MBTiles cache, with
+background seeding of chosen areas
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from hillshade import checkpoint, encoding, tiler, userdirs
+from hillshade.mbtiles import MBTilesWriter, xyz_to_tms
+
+# Loopback only: the server has no authentication and is meant for this machine
+HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# Bumped when rendering changes, so tiles cached by an older version are not served
+CACHE_VERSION = 2
+MEMORY_CACHE_BYTES = 256 << 20
+# Memory charged for remembering that a tile is empty
+EMPTY_ENTRY_BYTES = 64
+# Source pixels read for one tile at most; coarser zooms read the DEM averaged,
+# from its overviews where it has them
+MAX_WINDOW_PIXELS = (4 * tiler.TILE_SIZE) ** 2
+CONTENT_TYPES = {'png': 'image/png', 'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+# Browsers may keep tiles for a day; the shading of a running server never changes
+CACHE_CONTROL = 'max-age=86400'
+
+# Tile data of a tile without any valid source pixel
+EMPTY = b''
+
+EMPTY_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS empty_tiles (
+        zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER);
+    CREATE UNIQUE INDEX IF NOT EXISTS empty_index
+        ON empty_tiles (zoom_level, tile_column, tile_row);
+"""
+
+_TILE_PATH = re.compile(r'^/(\d+)/(\d+)/(\d+)(?:\.\w+)?$')
+
+
+def render_tile(source_path, zoom, x, y, shading, tile_encoding,
+                max_window_pixels=MAX_WINDOW_PIXELS):
+    """Worker: one encoded XYZ tile rendered from the DEM, or EMPTY without data"""
+    grey = tiler.render_window(source_path, tiler.tile_bounds(zoom, x, y),
+                               tiler.TILE_SIZE, tiler.TILE_SIZE, shading, max_window_pixels)
+    tile = None if grey is None else tiler.to_tile(grey)
+    if tile is None:
+        return EMPTY
+    data, _ = encoding.encode_tile(tile, tile_encoding)
+    return data
+
+
+def parse_zooms(text):
+    """'MIN-MAX' or a single zoom -> (min, max)"""
+    low, _, high = str(text).partition('-')
+    zooms = (int(low), int(high or low))
+    if not 0 <= zooms[0] <= zooms[1] <= 24:
+        raise ValueError(f"Invalid zoom range: {text!r}")
+    return zooms
+
+
+class MemoryCache:
+    """Byte-bounded LRU of encoded tiles keyed by (z, x, y)"""
+
+    def __init__(self, max_bytes=MEMORY_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size(data):
+        return len(data) or EMPTY_ENTRY_BYTES
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._size(self._entries.pop(key))
+            self._entries[key] = data
+            self.current_bytes += self._size(data)
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= self._size(evicted)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskCache:
+    """Rendered tiles in an MBTiles file, plus a table of tiles known to be empty
+
+    The file is a regular MBTiles that other tools can read. One connection
+    is shared by the server threads under a lock.
+    """
+
+    def __init__(self, path, metadata=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self.writer = MBTilesWriter(path, metadata, batch_size=256, shared=True)
+        self.writer.conn.executescript(EMPTY_SCHEMA)
+
+    def get(self, zoom, x, y):
+        """Stored data, EMPTY for a known empty tile, or None if never rendered"""
+        with self._lock:
+            data = self.writer.read_tile(zoom, x, y)
+            if data is None and self.writer.conn.execute(
+                    "SELECT 1 FROM empty_tiles WHERE zoom_level = ? AND tile_column = ? "
+                    "AND tile_row = ?", (zoom, x, xyz_to_tms(zoom, y))).fetchone():
+                return EMPTY
+        return data
+
+    def put(self, zoom, x, y, data):
+        with self._lock:
+            if data:
+                self.writer.add_tile(zoom, x, y, data)
+                return
+            with self.writer.conn:
+                self.writer.conn.execute(
+                    "INSERT OR IGNORE INTO empty_tiles (zoom_level, tile_column, tile_row) "
+                    "VALUES (?, ?, ?)", (zoom, x, xyz_to_tms(zoom, y)))
+
+    def flush(self):
+        with self._lock:
+            self.writer.flush()
+
+    def close(self):
+        with self._lock:
+            self.writer.close()
+
+
+class Seeding:
+    """Progress of one background seeding run"""
+
+    def __init__(self, geo_bounds, min_zoom, max_zoom, total):
+        self.geo_bounds = geo_bounds
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.total = total
+        self.done = 0
+        self.started = time.time()
+        self.finished = None
+        self.error = None
+        self.cancel = threading.Event()
+
+    def as_dict(self):
+        return {'bounds': list(self.geo_bounds), 'minzoom': self.min_zoom,
+                'maxzoom': self.max_zoom, 'total': self.total, 'done': self.done,
+                'running': self.finished is None, 'cancelled': self.cancel.is_set(),
+                'error': self.error}
+
+
+class TileService:
+    """XYZ tiles of a DEM: memory LRU, then disk cache, then the renderer
+
+    Concurrent requests for the same tile share a single render. Misses are
+    rendered on a process pool with the options' shading and tile format;
+    min_zoom..max_zoom of the options bound what is served. The disk cache
+    is keyed on the input files and everything that changes a tile, so a
+    restart with the same settings finds its earlier tiles again.
+    """
+
+    def __init__(self, source_path, source_files, options, workers=None,
+                 memory_bytes=MEMORY_CACHE_BYTES, cache_path=None, log=print):
+        self.source_path = source_path
+        self.options = options
+        self.shading = options.shading()
+        self.tile_encoding = options.tile_encoding()
+        self.log = log
+        self.bounds, self.geo_bounds = tiler.mercator_bounds(source_path)
+        self.workers = workers or os.cpu_count() or 1
+        if cache_path is None:
+            key = checkpoint.job_key(source_files, {
+                'version': CACHE_VERSION,
+                'shading': options.hillshade_params('numpy'),
+                'tile_format': encoding.spec(self.tile_encoding),
+                'max_window_pixels': MAX_WINDOW_PIXELS,
+            })
+            cache_dir = os.path.join(userdirs.cache_dir(), 'tiles')
+            os.makedirs(cache_dir, exist_ok=True)
+            cache_path = os.path.join(cache_dir, f'{key[:24]}.mbtiles')
+        self.memory = MemoryCache(memory_bytes)
+        self.disk = DiskCache(cache_path, {
+            'name': os.path.splitext(os.path.basename(source_files[0]))[0],
+            'type': 'overlay',
+            'version': '1.1',
+            'description': 'Hillshade (rendered on demand)',
+            'format': encoding.MBTILES_FORMATS[self.tile_encoding.format],
+            'bounds': ','.join(f'{v:.6f}' for v in self.geo_bounds),
+        })
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.counters = dict.fromkeys(
+            ('requests', 'memory_hits', 'disk_hits', 'rendered', 'coalesced', 'empty'), 0)
+        self.seeding = None
+        self._seeder = None
+        log(f"Tile cache: {cache_path}")
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def serves(self, zoom, x, y):
+        return (self.options.min_zoom <= zoom <= self.options.max_zoom
+                and 0 <= x < (1 << zoom) and 0 <= y < (1 << zoom))
+
+    def _outside(self, zoom, x, y):
+        minx, miny, maxx, maxy = tiler.tile_bounds(zoom, x, y)
+        return (maxx <= self.bounds[0] or minx >= self.bounds[2]
+                or maxy <= self.bounds[1] or miny >= self.bounds[3])
+
+    def tile(self, zoom, x, y, remember=True):
+        """Encoded tile data, or EMPTY where the DEM has no data
+
+        remember=False keeps the tile out of the memory LRU (for seeding,
+        so it does not push out tiles being viewed).
+        """
+        key = (zoom, x, y)
+        if remember:
+            self._count('requests')
+        data = self.memory.get(key)
+        if data is not None:
+            if remember:
+                self._count('memory_hits')
+            return data
+        if self._outside(zoom, x, y):
+            return EMPTY
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+            else:
+                self.counters['coalesced'] += 1
+        if not leader:
+            return future.result()
+        try:
+            data = self.disk.get(zoom, x, y)
+            if data is not None:
+                self._count('disk_hits')
+            else:
+                data = self.pool.submit(render_tile, self.source_path, zoom, x, y,
+                                        self.shading, self.tile_encoding).result()
+                self._count('rendered')
+                if not data:
+                    self._count('empty')
+                self.disk.put(zoom, x, y, data)
+            if remember:
+                self.memory.put(key, data)
+            future.set_result(data)
+            return data
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    # ── Seeding ──
+
+    def seed(self, geo_bounds=None, min_zoom=None, max_zoom=None):
+        """Render an area (west, south, east, north; default: the whole DEM) in the background
+
+        A running seeding is cancelled first. Tiles already cached are
+        skipped; at most `workers` tiles render at once, so requests from
+        viewers are never queued behind more than that.
+        """
+        min_zoom = self.options.min_zoom if min_zoom is None else max(min_zoom,
+                                                                      self.options.min_zoom)
+        max_zoom = self.options.max_zoom if max_zoom is None else min(max_zoom,
+                                                                      self.options.max_zoom)
+        bounds = self.bounds
+        if geo_bounds is not None:
+            area = tiler.lonlat_to_mercator(geo_bounds)
+            bounds = (max(area[0], bounds[0]), max(area[1], bounds[1]),
+                      min(area[2], bounds[2]), min(area[3], bounds[3]))
+            if bounds[0] >= bounds[2] or bounds[1] >= bounds[3]:
+                raise ValueError("The seeding area does not overlap the DEM")
+        ranges = [(zoom, tiler.tile_range(bounds, zoom))
+                  for zoom in range(min_zoom, max_zoom + 1)]
+        total = sum((x1 - x0 + 1) * (y1 - y0 + 1) for _, (x0, y0, x1, y1) in ranges)
+        self.cancel_seeding()
+        seeding = self.seeding = Seeding(geo_bounds or self.geo_bounds, min_zoom,
+                                         max_zoom, total)
+        self._seeder = threading.Thread(target=self._seed, args=(seeding, ranges),
+                                        daemon=True)
+        self._seeder.start()
+        self.log(f"Seeding {total} tiles at zoom {min_zoom}-{max_zoom} in the background")
+        return seeding
+
+    def _seed(self, seeding, ranges):
+        lock = threading.Lock()
+
+        def render(zoom, x, y):
+            if not seeding.cancel.is_set():
+                self.tile(zoom, x, y, remember=False)
+            with lock:
+                seeding.done += 1
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as threads:
+                pending = set()
+                for zoom, (x0, y0, x1, y1) in ranges:
+                    for y in range(y0, y1 + 1):
+                        for x in range(x0, x1 + 1):
+                            if seeding.cancel.is_set():
+                                break
+                            pending.add(threads.submit(render, zoom, x, y))
+                            if len(pending) >= 2 * self.workers:
+                                finished = {f for f in pending if f.done()}
+                                if not finished:
+                                    next(iter(pending)).result()
+                                    finished = {f for f in pending if f.done()}
+                                for future in finished:
+                                    future.result()
+                                pending -= finished
+                for future in pending:
+                    future.result()
+            self.disk.flush()
+        except Exception as e:
+            seeding.error = str(e)
+            self.log(f"Seeding failed: {e}")
+        seeding.finished = time.time()
+        if not seeding.cancel.is_set() and seeding.error is None:
+            self.log(f"Seeding finished: {seeding.done} tiles in "
+                     f"{seeding.finished - seeding.started:.0f} s")
+
+    def cancel_seeding(self):
+        if self.seeding is not None:
+            self.seeding.cancel.set()
+        if self._seeder is not None:
+            self._seeder.join()
+            self._seeder = None
+
+    # ── Description ──
+
+    def tilejson(self, base_url):
+        west, south, east, north = self.geo_bounds
+        extension = self.tile_encoding.format
+        return {
+            'tilejson': '3.0.0',
+            'name': 'Hillshade',
+            'scheme': 'xyz',
+            'format': encoding.MBTILES_FORMATS[self.tile_encoding.format],
+            'tiles': [f'{base_url}/{{z}}/{{x}}/{{y}}.{extension}'],
+            'minzoom': self.options.min_zoom,
+            'maxzoom': self.options.max_zoom,
+            'bounds': [west, south, east, north],
+            'center': [(west + east) / 2, (south + north) / 2, self.options.min_zoom],
+        }
+
+    def status(self):
+        with self._lock:
+            counters = dict(self.counters)
+        return dict(counters, memory_tiles=len(self.memory),
+                    memory_bytes=self.memory.current_bytes, cache=self.disk.path,
+                    seeding=self.seeding.as_dict() if self.seeding else None)
+
+    def close(self):
+        self.cancel_seeding()
+        self.pool.shutdown()
+        self.disk.close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = 'hillshade-converter'
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def log_message(self, format, *args):
+        pass  # One line per tile would drown the log
+
+    def _send(self, status, body=b'', content_type='application/json', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        # Lets a map page opened from a file:// URL or another port use the tiles
+        self.send_header('Access-Control-Allow-Origin', '*')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _json(self, data, status=200):
+        self._send(status, json.dumps(data).encode('utf-8'))
+
+    def _error(self, status, message):
+        self._json({'error': message}, status)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        try:
+            if url.path in ('/', '/tilejson.json'):
+                host, port = self.server.server_address[:2]
+                self._json(self.service.tilejson(f'http://{host}:{port}'))
+            elif url.path == '/status':
+                self._json(self.service.status())
+            else:
+                match = _TILE_PATH.match(url.path)
+                if match is None:
+                    return self._error(404, "Not found")
+                zoom, x, y = map(int, match.groups())
+                if not self.service.serves(zoom, x, y):
+                    return self._error(404, "Tile outside the served zoom levels or grid")
+                data = self.service.tile(zoom, x, y)
+                if not data:
+                    return self._send(204, headers={'Cache-Control': CACHE_CONTROL})
+                self._send(200, data, CONTENT_TYPES[self.service.tile_encoding.format],
+                           {'Cache-Control': CACHE_CONTROL})
+        except BrokenPipeError:
+            pass  # The viewer moved on before the tile was ready
+        except Exception as e:
+            self._error(500, str(e))
+
+    do_HEAD = do_GET
+
+    def do_POST(self):
+        """POST /seed?bbox=W,S,E,N&zooms=MIN-MAX starts seeding; POST /seed/cancel stops it"""
+        url = urlparse(self.path)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            if url.path == '/seed':
+                bbox = None
+                if 'bbox' in query:
+                    bbox = tuple(float(v) for v in query['bbox'].split(','))
+                    if len(bbox) != 4:
+                        raise ValueError("bbox must be WEST,SOUTH,EAST,NORTH")
+                zooms = parse_zooms(query['zooms']) if 'zooms' in query else (None, None)
+                self._json(self.service.seed(bbox, *zooms).as_dict(), 202)
+            elif url.path == '/seed/cancel':
+                self.service.cancel_seeding()
+                self._json(self.service.status())
+            else:
+                self._error(404, "Not found")
+        except ValueError as e:
+            self._error(400, str(e))
+        except Exception as e:
+            self._error(500, str(e))
+
+
+class TileServer:
+    """HTTP front end of a TileService on localhost
+
+    GET /{z}/{x}/{y}.png (204 for a tile without data), GET /tilejson.json,
+    GET /status, POST /seed and POST /seed/cancel.
+    """
+
+    def __init__(self, service, port=DEFAULT_PORT):
+        self.service = service
+        self.httpd = ThreadingHTTPServer((HOST, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.service = service
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def start(self):
+        """Serve on a background thread"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.service.close()
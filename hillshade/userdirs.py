@@ -0,0 +1,76 @@
+"""
+Per-user storage locations
+Cache and settings directories following each platform's conventions, and the
+helpers for files kept there: atomic JSON and owner liveness for locks and leases
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+APP_NAME = 'hillshade-converter'
+
+
+def _base_dir(kind):
+    if sys.platform == 'win32':
+        root = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~\\AppData\\Local')
+        return os.path.join(root, APP_NAME, 'Cache' if kind == 'cache' else 'Config')
+    if sys.platform == 'darwin':
+        sub = 'Caches' if kind == 'cache' else 'Application Support'
+        return os.path.join(os.path.expanduser('~/Library'), sub, APP_NAME)
+    if kind == 'cache':
+        root = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    else:
+        root = os.environ.get('XDG_CONFIG_HOME') or os.path.expanduser('~/.config')
+    return os.path.join(root, APP_NAME)
+
+
+def cache_dir(create=True):
+    """Directory for data that can be regenerated (HILLSHADE_CACHE_DIR overrides)"""
+    path = os.environ.get('HILLSHADE_CACHE_DIR') or _base_dir('cache')
+    if create:
+        os.makedirs(path, exist_ok=True)
+    return path
+
+
+def config_dir(create=True):
+    """Directory for user settings (HILLSHADE_CONFIG_DIR overrides)"""
+    path = os.environ.get('HILLSHADE_CONFIG_DIR') or _base_dir('config')
+    if create:
+        os.makedirs(path, exist_ok=True)
+    return path
+
+
+def read_json(path, default=None):
+    """Load a JSON file, returning default if it is missing or unreadable"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def write_json(path, data):
+    """Replace a JSON file atomically; concurrent readers see old or new, never torn"""
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def pid_alive(pid):
+    """Whether a process with this id exists (owner of a lock, lease or job)"""
+    if not pid:
+        return False
+    if sys.platform == 'win32':
+        result = subprocess.run(['tasklist', '/FI', f'PID eq {pid}', '/NH'],
+                                capture_output=True, text=True)
+        return str(pid) in result.stdout
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
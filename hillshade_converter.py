@@ -4,17 +4,27 @@ Hillshade to MBTiles Converter
 Converts GeoTIFF DEM files to hillshade MBTiles for offline map viewing
 """
 
-import tkinter as tk
-from tkinter import ttk, filedialog, messagebox, scrolledtext
-import subprocess
 import os
 import sys
-import tempfile
-import shutil
 import webbrowser
 from pathlib import Path
 import threading
-from PIL import Image, ImageTk
+import multiprocessing
+
+from hillshade import cli, discovery, gdalprofile, jobqueue, pipeline, pyramid
+from hillshade.lazy import lazy_import
+from hillshade.logsink import QueueSink
+from hillshade.progress import format_update
+
+# GUI toolkits load on first use so `hillshade_converter convert ...` never pays for them
+tk = lazy_import('tkinter')
+ttk = lazy_import('tkinter.ttk')
+filedialog = lazy_import('tkinter.filedialog')
+messagebox = lazy_import('tkinter.messagebox')
+scrolledtext = lazy_import('tkinter.scrolledtext')
+Image = lazy_import('PIL.Image')
+ImageTk = lazy_import('PIL.ImageTk')
+engine = lazy_import('hillshade.engine')
 
 
 # Setup PATH for bundled GDAL (when running as PyInstaller executable)
@@ -36,6 +46,19 @@ if getattr(sys, 'frozen', False):
         os.environ['PROJ_LIB'] = proj_data
 
 
+PREVIEW_DISPLAY_SIZE = pipeline.PREVIEW_DISPLAY_SIZE
+# Preview zoom: wheel step and the largest magnification of a preview pixel
+PREVIEW_ZOOM_STEP = 1.25
+PREVIEW_MAX_MAGNIFICATION = 8.0
+# Scrollback kept in the log widget, and how often worker output is drained
+MAX_LOG_LINES = 5000
+LOG_DRAIN_MS = 100
+# How often the queue window re-reads job states
+QUEUE_REFRESH_MS = 1000
+# Suggested tile encodings; any png[:level], webp[:quality] or jpeg[:quality] is accepted
+TILE_FORMAT_CHOICES = ('png', 'webp', 'webp:90', 'webp:75', 'jpeg:90', 'jpeg:75')
+
+
 class HillshadeConverter:
     def __init__(self, root):
         self.root = root
@@ -47,15 +70,46 @@ class HillshadeConverter:
         self.z_factor = tk.DoubleVar(value=1.0)
         self.azimuth = tk.DoubleVar(value=315.0)
         self.altitude = tk.DoubleVar(value=45.0)
+        self.multidirectional = tk.BooleanVar(value=False)
+        self.slope_weight = tk.DoubleVar(value=0.0)
         self.min_zoom = tk.IntVar(value=10)
         self.max_zoom = tk.IntVar(value=17)
+        self.stream_pipeline = tk.BooleanVar(value=True)
+        self.native_tiler = tk.BooleanVar(value=True)
+        self.resumable = tk.BooleanVar(value=True)
+        self.stage_cache = tk.BooleanVar(value=True)
+        self.vacuum = tk.BooleanVar(value=False)
+        self.max_memory = tk.StringVar(value="")  # e.g. 2G; blank means no limit
+        self.tile_format = tk.StringVar(value="png")  # png[:level], webp[:quality], jpeg[:quality]
         self.is_processing = False
         self.preview_window = None
-        self.preview_hillshade_path = None
-        self.preview_image = None  # Full-resolution PIL image for export
+        self.preview_pyramid = None  # Finest preview level, used for export
+        self.preview_scale = None  # Screen pixels per preview pixel; None fits the window
+        self.preview_center = (0.0, 0.0)
+        self.preview_drag = (0, 0)
+        self.preview_source_size = None
+        self.preview_running = False
+        self.preview_cancel = threading.Event()
+        # Worker threads never touch Tk; they post here and drain_log() applies it
+        self.log_sink = QueueSink(max_lines=MAX_LOG_LINES)
         
         self.create_ui()
-        self.check_gdal()
+        # All processing lives in the GUI-free pipeline; this class only drives it
+        self.pipeline = pipeline.Pipeline(log=self.log_sink.log,
+                                          progress=self.log_sink.progress,
+                                          status=self.log_sink.status)
+        self.root.after(LOG_DRAIN_MS, self.drain_log)
+        # Queued conversions run as separate processes, several at a time
+        self.job_queue = jobqueue.JobQueue()
+        self.scheduler = jobqueue.Scheduler(self.job_queue, log=self.log_sink.log)
+        self.queue_window = None
+        self.performance_window = None
+        # tileserver.TileServer while "Serve Tiles" is on
+        self.tile_server = None
+        self.root.protocol("WM_DELETE_WINDOW", self.quit_app)
+        self.root.after_idle(self.resume_queue)
+        # Let the window draw before probing for GDAL
+        self.root.after_idle(self.check_gdal)
         # Show promotional popup shortly after launch
         self.root.after(800, self.show_promo_popup)
     
@@ -66,11 +120,12 @@ class HillshadeConverter:
         title.pack(pady=10)
         
         # Input file selection
-        input_frame = ttk.LabelFrame(self.root, text="Input GeoTIFF (DEM)", padding=10)
+        input_frame = ttk.LabelFrame(self.root, text="Input GeoTIFF (DEM), or folder/glob of DEM tiles", padding=10)
         input_frame.pack(fill="x", padx=10, pady=5)
         
         ttk.Entry(input_frame, textvariable=self.input_path, width=60).pack(side="left", padx=5)
         ttk.Button(input_frame, text="Browse...", command=self.browse_input).pack(side="left")
+        ttk.Button(input_frame, text="Folder...", command=self.browse_input_folder).pack(side="left", padx=5)
         
         # Output file selection
         output_frame = ttk.LabelFrame(self.root, text="Output MBTiles", padding=10)
@@ -104,6 +159,15 @@ class HillshadeConverter:
         alt_scale.grid(row=2, column=1, padx=5)
         ttk.Label(params_frame, textvariable=self.altitude).grid(row=2, column=2)
         
+        # Blended lighting
+        light_frame = ttk.Frame(params_frame)
+        light_frame.grid(row=7, column=0, columnspan=3, pady=5, sticky="w")
+        ttk.Checkbutton(light_frame, text="Multidirectional (4 lights, 225°-360°)",
+                        variable=self.multidirectional).pack(side="left", padx=5)
+        ttk.Label(light_frame, text="Slope shading weight:").pack(side="left", padx=(20, 5))
+        ttk.Spinbox(light_frame, from_=0.0, to=4.0, increment=0.25,
+                    textvariable=self.slope_weight, width=5).pack(side="left")
+        
         # Zoom levels
         zoom_frame = ttk.Frame(params_frame)
         zoom_frame.grid(row=3, column=0, columnspan=3, pady=5, sticky="w")
@@ -112,11 +176,30 @@ class HillshadeConverter:
         ttk.Spinbox(zoom_frame, from_=0, to=24, textvariable=self.min_zoom, width=5).pack(side="left")
         ttk.Label(zoom_frame, text="Max Zoom:").pack(side="left", padx=(20, 5))
         ttk.Spinbox(zoom_frame, from_=0, to=24, textvariable=self.max_zoom, width=5).pack(side="left")
+        ttk.Label(zoom_frame, text="Memory limit (e.g. 2G):").pack(side="left", padx=(20, 5))
+        ttk.Entry(zoom_frame, textvariable=self.max_memory, width=7).pack(side="left")
+        ttk.Label(zoom_frame, text="Tiles:").pack(side="left", padx=(20, 5))
+        ttk.Combobox(zoom_frame, textvariable=self.tile_format, width=8,
+                     values=TILE_FORMAT_CHOICES).pack(side="left")
+        
+        # Pipeline mode
+        ttk.Checkbutton(params_frame, text="Stream without intermediate files (saves disk space)",
+                        variable=self.stream_pipeline).grid(row=4, column=0, columnspan=3, sticky="w", pady=5)
+        ttk.Checkbutton(params_frame, text="Use built-in parallel tiler (all CPU cores)",
+                        variable=self.native_tiler).grid(row=5, column=0, columnspan=3, sticky="w")
+        ttk.Checkbutton(params_frame, text="Resumable (checkpoint progress so a failed run can continue)",
+                        variable=self.resumable).grid(row=6, column=0, columnspan=3, sticky="w", pady=5)
+        ttk.Checkbutton(params_frame, text="Reuse intermediate rasters across runs (stage cache)",
+                        variable=self.stage_cache).grid(row=8, column=0, columnspan=3, sticky="w")
+        ttk.Checkbutton(params_frame, text="Compact the finished MBTiles (VACUUM; slower, smaller file)",
+                        variable=self.vacuum).grid(row=9, column=0, columnspan=3, sticky="w", pady=5)
         
         # Progress
         self.progress_var = tk.DoubleVar()
         self.progress = ttk.Progressbar(self.root, variable=self.progress_var, maximum=100)
-        self.progress.pack(fill="x", padx=10, pady=10)
+        self.progress.pack(fill="x", padx=10, pady=(10, 0))
+        self.status_var = tk.StringVar()
+        ttk.Label(self.root, textvariable=self.status_var).pack(anchor="w", padx=10, pady=(2, 5))
         
         # Log output
         log_frame = ttk.LabelFrame(self.root, text="Processing Log", padding=10)
@@ -137,9 +220,18 @@ class HillshadeConverter:
                                       command=self.start_conversion, style="Accent.TButton")
         self.convert_btn.pack(side="left", padx=5)
         
+        ttk.Button(button_frame, text="Add to Queue", 
+                   command=self.add_to_queue).pack(side="left", padx=5)
+        ttk.Button(button_frame, text="Queue...", 
+                   command=self.show_queue_window).pack(side="left", padx=5)
+        ttk.Button(button_frame, text="Performance...", 
+                   command=self.show_performance_window).pack(side="left", padx=5)
+        self.serve_btn = ttk.Button(button_frame, text="Serve Tiles", 
+                                    command=self.toggle_tile_server)
+        self.serve_btn.pack(side="left", padx=5)
         ttk.Button(button_frame, text="Clear Log", command=self.clear_log).pack(side="left", padx=5)
         ttk.Button(button_frame, text="About", command=self.show_promo_popup).pack(side="left", padx=5)
-        ttk.Button(button_frame, text="Exit", command=self.root.quit).pack(side="right", padx=5)
+        ttk.Button(button_frame, text="Exit", command=self.quit_app).pack(side="right", padx=5)
     
     def show_promo_popup(self):
         """Show a promotional popup for DetectLogPro and pagetech.co.uk"""
@@ -198,43 +290,12 @@ class HillshadeConverter:
 
     def check_gdal(self):
         """Check if GDAL is available and add Homebrew paths if needed"""
-        # Common GDAL installation paths
-        possible_gdaldem_paths = [
-            '/opt/homebrew/bin/gdaldem',  # Apple Silicon
-            '/usr/local/bin/gdaldem',     # Intel Mac
-            '/opt/homebrew/opt/gdal/bin/gdaldem',
-            '/usr/local/opt/gdal/bin/gdaldem',
-            'gdaldem'  # Try system PATH as fallback
-        ]
-        
-        # Find the first working gdaldem
-        for path in possible_gdaldem_paths:
-            try:
-                # For absolute paths, check if file exists first
-                if path.startswith('/') and not os.path.exists(path):
-                    continue
-                    
-                result = subprocess.run([path, '--version'], 
-                                      capture_output=True, text=True, timeout=5)
-                # Check if output contains "GDAL" (check both stdout and stderr)
-                output = result.stdout + result.stderr
-                if result.returncode == 0 or "GDAL" in output or result.returncode == 1:
-                    # Update PATH to include this directory
-                    if path.startswith('/'):
-                        gdal_dir = os.path.dirname(os.path.abspath(path))
-                        if gdal_dir not in os.environ.get('PATH', ''):
-                            os.environ['PATH'] = gdal_dir + os.pathsep + os.environ.get('PATH', '')
-                    
-                    version_text = output.strip() if output.strip() else "GDAL"
-                    self.log(f"✓ GDAL found: {version_text}")
-                    self.log(f"  Using: {path}")
-                    return
-                    
-            except FileNotFoundError:
-                # Command not found, try next path
-                continue
-            except Exception as e:
-                continue
+        # Probe results are cached on disk, keyed by executable path and mtime
+        install = discovery.ensure_gdal_cli()
+        if install is not None:
+            self.log(f"✓ GDAL found: {install.version}")
+            self.log(f"  Using: {install.path}")
+            return
         
         # GDAL not found
         self.log("⚠ GDAL not found in common locations")
@@ -258,20 +319,48 @@ class HillshadeConverter:
             output = output.with_name(output.stem + '_hillshade.mbtiles')
             self.output_path.set(str(output))
     
+    def browse_input_folder(self):
+        dirname = filedialog.askdirectory(title="Select Folder of DEM Tiles")
+        if dirname:
+            self.input_path.set(dirname)
+            # Auto-generate output path next to the folder
+            folder = Path(dirname)
+            self.output_path.set(str(folder.parent / (folder.name + '_hillshade.mbtiles')))
+    
     def browse_output(self):
         filename = filedialog.asksaveasfilename(
-            title="Save MBTiles As",
+            title="Save Tiles As",
             defaultextension=".mbtiles",
-            filetypes=[("MBTiles files", "*.mbtiles"), ("All files", "*.*")]
+            filetypes=[("MBTiles files", "*.mbtiles"), ("PMTiles files", "*.pmtiles"),
+                       ("All files", "*.*")]
         )
         if filename:
             self.output_path.set(filename)
     
     def log(self, message):
-        """Add message to log"""
-        self.log_text.insert(tk.END, message + "\n")
-        self.log_text.see(tk.END)
-        self.root.update_idletasks()
+        """Add message to log (safe from any thread)"""
+        self.log_sink.log(message)
+    
+    def drain_log(self):
+        """Apply queued log lines, progress and status in one batch"""
+        try:
+            drained = self.log_sink.drain()
+            if drained.lines:
+                text = "\n".join(drained.lines) + "\n"
+                if drained.dropped:
+                    text = f"... {drained.dropped} earlier lines not shown ...\n" + text
+                self.log_text.insert(tk.END, text)
+                # Bounded scrollback: drop the oldest lines
+                line_count = int(self.log_text.index('end-1c').split('.')[0])
+                if line_count > MAX_LOG_LINES:
+                    self.log_text.delete('1.0', f'{line_count - MAX_LOG_LINES + 1}.0')
+                self.log_text.see(tk.END)
+            if drained.progress is not None:
+                self.progress_var.set(drained.progress)
+            if drained.status is not None:
+                self.status_var.set(format_update(drained.status))
+        finally:
+            self.root.after(LOG_DRAIN_MS, self.drain_log)
     
     def clear_log(self):
         self.log_text.delete(1.0, tk.END)
@@ -284,128 +373,233 @@ class HillshadeConverter:
         if not self.input_path.get():
             messagebox.showerror("Error", "Please select an input file")
             return
+        try:
+            options = self.options()
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
         
         self.is_processing = True
+        self.preview_running = True
+        self.preview_cancel = threading.Event()
         self.preview_btn.config(state="disabled")
         self.convert_btn.config(state="disabled")
         self.progress_var.set(0)
+        self.status_var.set("")
         
-        thread = threading.Thread(target=self.generate_preview)
+        # Tk variables are read here, on the Tk thread; the worker only gets plain values
+        thread = threading.Thread(target=self.generate_preview,
+                                  args=(self.input_path.get(), options, self.preview_cancel))
         thread.daemon = True
         thread.start()
     
-    def generate_preview(self):
-        """Generate hillshade preview"""
-        temp_dir = None
+    def regenerate_preview(self):
+        """Restart the preview, abandoning any refinement still in progress"""
+        if self.preview_running:
+            self.preview_cancel.set()
+        if self.preview_window and self.preview_window.winfo_exists():
+            self.preview_window.destroy()
+        self.start_preview_when_idle()
+    
+    def start_preview_when_idle(self):
+        if self.preview_running:
+            # Wait for the cancelled refinement level to finish
+            self.root.after(100, self.start_preview_when_idle)
+        else:
+            self.start_preview()
+    
+    def generate_preview(self, input_path, options, cancel):
+        """Generate a decimated hillshade preview, coarse level first (background thread)"""
         try:
-            temp_dir = tempfile.mkdtemp(prefix='hillshade_preview_')
-            self.log("\nGenerating hillshade preview...")
-            
-            hillshade_path = os.path.join(temp_dir, 'hillshade_preview.tif')
-            self.preview_hillshade_path = hillshade_path
-            
-            self.progress_var.set(50)
-            self.run_command([
-                'gdaldem', 'hillshade',
-                self.input_path.get(),
-                hillshade_path,
-                '-z', str(self.z_factor.get()),
-                '-az', str(self.azimuth.get()),
-                '-alt', str(self.altitude.get()),
-                '-compute_edges'
-            ])
-            
-            self.progress_var.set(100)
-            self.log("✓ Preview generated successfully!")
-            
-            # Show preview window
-            self.show_preview_window(hillshade_path)
+            for index, count, shaded, full_size in self.pipeline.preview(
+                    input_path, options, cancel=cancel):
+                # Cut the pyramid here so the Tk thread only ever decodes tiles
+                preview = pyramid.Pyramid(shaded)
+                del shaded
+                if index == 0:
+                    # Show the coarse level immediately
+                    self.root.after(0, self.show_preview_window, preview, full_size)
+                else:
+                    self.root.after(0, self.update_preview_image, preview)
+            
+            if not cancel.is_set():
+                self.log_sink.progress(100)
+                self.log("✓ Preview generated successfully!")
             
         except Exception as e:
             self.log(f"\n✗ ERROR: {str(e)}")
-            messagebox.showerror("Error", f"Preview generation failed:\n{str(e)}")
+            self.root.after(0, messagebox.showerror, "Error",
+                            f"Preview generation failed:\n{str(e)}")
         finally:
-            self.is_processing = False
-            self.preview_btn.config(state="normal")
-            self.convert_btn.config(state="normal")
+            self.root.after(0, self.preview_finished)
     
-    def show_preview_window(self, hillshade_path):
-        """Display the hillshade preview in a new window"""
+    def preview_finished(self):
+        self.is_processing = False
+        self.preview_running = False
+        self.preview_btn.config(state="normal")
+        self.convert_btn.config(state="normal")
+    
+    def show_preview_window(self, preview, source_size):
+        """Display the hillshade preview in a new pan/zoom window"""
         if self.preview_window and self.preview_window.winfo_exists():
             self.preview_window.destroy()
         
         self.preview_window = tk.Toplevel(self.root)
         self.preview_window.title("Hillshade Preview")
         self.preview_window.geometry("800x750")
+        self.preview_source_size = source_size
+        self.preview_pyramid = None
         
-        # Read and display the hillshade using PIL
         try:
-            # Use gdal_translate to convert to PNG first for easier reading
-            temp_png = hillshade_path.replace('.tif', '_preview.png')
-            subprocess.run([
-                'gdal_translate',
-                '-of', 'PNG',
-                '-scale',
-                hillshade_path,
-                temp_png
-            ], check=True, capture_output=True)
-            
-            # Open with PIL
-            img = Image.open(temp_png)
-            width, height = img.size
-            self.preview_image = img.copy()  # Save full-res copy for export
-            
-            # Resize for display if too large (leave room for info + buttons)
-            max_display_size = 580
-            display_img = img
-            if width > max_display_size or height > max_display_size:
-                scale = min(max_display_size / width, max_display_size / height)
-                new_width = int(width * scale)
-                new_height = int(height * scale)
-                display_img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            # Convert to PhotoImage
-            photo = ImageTk.PhotoImage(display_img)
-            
-            # Display in label
-            preview_label = ttk.Label(self.preview_window, image=photo)
-            preview_label.image = photo  # Keep reference
-            preview_label.pack(padx=10, pady=10)
-            
-            # Clean up temp PNG
-            try:
-                os.remove(temp_png)
-            except:
-                pass
-            
-            # Info label
-            info_text = (f"Size: {width} x {height} pixels\n"
-                        f"Z-Factor: {self.z_factor.get()}, "
-                        f"Azimuth: {self.azimuth.get()}°, "
-                        f"Altitude: {self.altitude.get()}°")
-            info_label = ttk.Label(self.preview_window, text=info_text, 
-                                  font=("Arial", 10), justify="center")
-            info_label.pack(pady=5)
-            
-            # Buttons
+            # Buttons and info are packed first so they keep their space when resized
             btn_frame = ttk.Frame(self.preview_window)
-            btn_frame.pack(pady=10)
+            btn_frame.pack(side="bottom", pady=10)
             
             ttk.Button(btn_frame, text="Regenerate with New Parameters", 
-                      command=lambda: [self.preview_window.destroy(), self.start_preview()]).pack(side="left", padx=5)
+                      command=self.regenerate_preview).pack(side="left", padx=5)
+            ttk.Button(btn_frame, text="Fit", 
+                      command=self.fit_preview).pack(side="left", padx=5)
+            ttk.Button(btn_frame, text="1:1", 
+                      command=lambda: self.zoom_preview_to(1.0)).pack(side="left", padx=5)
             ttk.Button(btn_frame, text="Export PNG", 
                       command=self.export_preview_png).pack(side="left", padx=5)
             ttk.Button(btn_frame, text="Close", 
                       command=self.preview_window.destroy).pack(side="left", padx=5)
             
+            self.preview_info = ttk.Label(self.preview_window, font=("Arial", 10),
+                                          justify="center")
+            self.preview_info.pack(side="bottom", pady=5)
+            
+            # Drag to pan, wheel to zoom about the cursor
+            self.preview_canvas = tk.Canvas(self.preview_window, background="#202020",
+                                            highlightthickness=0, cursor="fleur")
+            self.preview_canvas.pack(fill="both", expand=True, padx=10, pady=10)
+            self.preview_canvas.bind("<Configure>", lambda e: self.render_preview())
+            self.preview_canvas.bind("<ButtonPress-1>", self.start_preview_pan)
+            self.preview_canvas.bind("<B1-Motion>", self.pan_preview)
+            self.preview_canvas.bind("<MouseWheel>", self.wheel_preview)
+            self.preview_canvas.bind("<Button-4>", self.wheel_preview)
+            self.preview_canvas.bind("<Button-5>", self.wheel_preview)
+            self.update_preview_image(preview)
+            
         except Exception as e:
             messagebox.showerror("Error", f"Failed to display preview:\n{str(e)}")
             if self.preview_window and self.preview_window.winfo_exists():
                 self.preview_window.destroy()
     
+    def update_preview_image(self, preview):
+        """Swap in a finer preview level, keeping the part of the DEM in view"""
+        if not (self.preview_window and self.preview_window.winfo_exists()):
+            return
+        previous = self.preview_pyramid
+        self.preview_pyramid = preview  # Finest level so far, used for export
+        if previous is None:
+            self.preview_scale = None  # Fit on first render
+        else:
+            ratio = preview.width / previous.width
+            self.preview_scale /= ratio
+            self.preview_center = (self.preview_center[0] * ratio,
+                                   self.preview_center[1] * ratio)
+        self.render_preview()
+    
+    def preview_canvas_size(self):
+        return (max(1, self.preview_canvas.winfo_width()),
+                max(1, self.preview_canvas.winfo_height()))
+    
+    def fit_scale(self):
+        width, height = self.preview_canvas_size()
+        preview = self.preview_pyramid
+        return min(width / preview.width, height / preview.height)
+    
+    def fit_preview(self):
+        self.preview_scale = None
+        self.render_preview()
+    
+    def zoom_preview_to(self, scale, anchor=None):
+        """Zoom to scale (screen pixels per preview pixel), keeping anchor still"""
+        if self.preview_pyramid is None or self.preview_scale is None:
+            return
+        scale = min(max(scale, min(self.fit_scale(), 1.0)), PREVIEW_MAX_MAGNIFICATION)
+        width, height = self.preview_canvas_size()
+        ax, ay = anchor if anchor is not None else (width / 2, height / 2)
+        cx, cy = self.preview_center
+        # The image point under the anchor stays under it
+        px = cx + (ax - width / 2) / self.preview_scale
+        py = cy + (ay - height / 2) / self.preview_scale
+        self.preview_center = (px - (ax - width / 2) / scale,
+                               py - (ay - height / 2) / scale)
+        self.preview_scale = scale
+        self.render_preview()
+    
+    def wheel_preview(self, event):
+        if getattr(event, 'num', None) == 5 or getattr(event, 'delta', 0) < 0:
+            factor = 1 / PREVIEW_ZOOM_STEP
+        else:
+            factor = PREVIEW_ZOOM_STEP
+        if self.preview_scale is not None:
+            self.zoom_preview_to(self.preview_scale * factor, (event.x, event.y))
+    
+    def start_preview_pan(self, event):
+        self.preview_drag = (event.x, event.y)
+    
+    def pan_preview(self, event):
+        if self.preview_pyramid is None or self.preview_scale is None:
+            return
+        dx, dy = event.x - self.preview_drag[0], event.y - self.preview_drag[1]
+        self.preview_drag = (event.x, event.y)
+        cx, cy = self.preview_center
+        self.preview_center = (cx - dx / self.preview_scale, cy - dy / self.preview_scale)
+        self.render_preview()
+    
+    def render_preview(self):
+        """Draw the viewport from the pyramid level matching the zoom"""
+        preview = self.preview_pyramid
+        if preview is None or not self.preview_canvas.winfo_exists():
+            return
+        if self.preview_canvas.winfo_width() <= 1:
+            return  # Not laid out yet; <Configure> renders it
+        width, height = self.preview_canvas_size()
+        if self.preview_scale is None:
+            self.preview_scale = self.fit_scale()
+            self.preview_center = (preview.width / 2, preview.height / 2)
+        scale = self.preview_scale
+        # Keep the centre on the image so it cannot be dragged out of view
+        cx = min(max(self.preview_center[0], 0), preview.width)
+        cy = min(max(self.preview_center[1], 0), preview.height)
+        self.preview_center = (cx, cy)
+        x0, y0 = cx - width / (2 * scale), cy - height / (2 * scale)
+        
+        level = preview.level_for(scale)
+        factor = 2 ** level
+        level_width, level_height = preview.sizes[level]
+        lx0 = max(0, int(x0 // factor))
+        ly0 = max(0, int(y0 // factor))
+        lx1 = min(level_width, int(-(-(x0 + width / scale) // factor)))
+        ly1 = min(level_height, int(-(-(y0 + height / scale) // factor)))
+        self.preview_canvas.delete("preview")
+        if lx1 > lx0 and ly1 > ly0:
+            pixels = preview.region(level, lx0, ly0, lx1, ly1)
+            size = (max(1, round((lx1 - lx0) * factor * scale)),
+                    max(1, round((ly1 - ly0) * factor * scale)))
+            resample = Image.Resampling.NEAREST if factor * scale > 1 else Image.Resampling.BILINEAR
+            photo = ImageTk.PhotoImage(Image.fromarray(pixels, mode='L').resize(size, resample))
+            self.preview_canvas.create_image(round((lx0 * factor - x0) * scale),
+                                             round((ly0 * factor - y0) * scale),
+                                             anchor="nw", image=photo, tags="preview")
+            self.preview_canvas.image = photo  # Keep reference
+        
+        source_width, source_height = self.preview_source_size
+        info_text = (f"Size: {source_width} x {source_height} pixels "
+                    f"(preview {preview.width} x {preview.height}, "
+                    f"zoom {100 * scale * preview.width / source_width:.3g}% of source)\n"
+                    f"Z-Factor: {self.z_factor.get()}, "
+                    f"Azimuth: {'225-360' if self.multidirectional.get() else self.azimuth.get()}°, "
+                    f"Altitude: {self.altitude.get()}°")
+        self.preview_info.configure(text=info_text)
+    
     def export_preview_png(self):
         """Save the current preview image as a PNG file"""
-        if self.preview_image is None:
+        if self.preview_pyramid is None:
             messagebox.showerror("Error", "No preview image available to export")
             return
 
@@ -426,7 +620,7 @@ class HillshadeConverter:
             return
 
         try:
-            self.preview_image.save(save_path, format="PNG")
+            self.preview_pyramid.write_png(save_path)
             self.log(f"✓ Preview exported to: {save_path}")
             messagebox.showinfo("Exported", f"Preview saved to:\n{save_path}")
         except Exception as e:
@@ -441,189 +635,338 @@ class HillshadeConverter:
         if not self.input_path.get() or not self.output_path.get():
             messagebox.showerror("Error", "Please select input and output files")
             return
+        try:
+            options = self.options()
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
         
         self.is_processing = True
         self.convert_btn.config(state="disabled")
         self.progress_var.set(0)
+        self.status_var.set("")
         
-        thread = threading.Thread(target=self.convert)
+        thread = threading.Thread(target=self.convert,
+                                  args=(self.input_path.get(), self.output_path.get(), options))
         thread.daemon = True
         thread.start()
     
-    def convert(self):
-        """Perform the conversion"""
+    def options(self):
+        """Snapshot the UI parameters for the pipeline"""
+        return pipeline.ConversionOptions(
+            z_factor=self.z_factor.get(),
+            azimuth=self.azimuth.get(),
+            altitude=self.altitude.get(),
+            lights=(engine.multidirectional_lights(self.altitude.get())
+                    if self.multidirectional.get() else None),
+            slope_weight=self.slope_weight.get(),
+            min_zoom=self.min_zoom.get(),
+            max_zoom=self.max_zoom.get(),
+            stream=self.stream_pipeline.get(),
+            native_tiler=self.native_tiler.get(),
+            resumable=self.resumable.get(),
+            stage_cache=self.stage_cache.get(),
+            vacuum=self.vacuum.get(),
+            max_memory=pipeline.parse_memory(self.max_memory.get().strip() or None),
+            tile_format=self.tile_format.get().strip() or 'png')
+    
+    def convert(self, input_path, output_path, options):
+        """Perform the conversion (background thread)"""
         try:
-            # Ensure output directory exists and is writable
-            output_path = self.output_path.get()
-            output_dir = os.path.dirname(output_path)
-            
-            if output_dir and not os.path.exists(output_dir):
-                self.log(f"Creating output directory: {output_dir}")
-                os.makedirs(output_dir, exist_ok=True)
+            self.pipeline.convert(input_path, output_path, options)
             
-            # Check if we can write to the output location
-            if output_dir:
-                test_file = os.path.join(output_dir, '.write_test')
-                try:
-                    with open(test_file, 'w') as f:
-                        f.write('test')
-                    os.remove(test_file)
-                except (PermissionError, OSError) as e:
-                    raise PermissionError(
-                        f"Cannot write to directory: {output_dir}\n"
-                        f"Error: {e}\n\n"
-                        f"This directory may have restricted permissions.\n"
-                        f"Try saving to a different location like:\n"
-                        f"  • Desktop\n"
-                        f"  • Documents\n"
-                        f"  • A folder you created"
-                    )
+            self.root.after(0, messagebox.showinfo, "Success",
+                f"Hillshade conversion completed successfully!\n\n"
+                f"Output: {output_path}")
             
-            # Remove existing output file if present
-            if os.path.exists(output_path):
-                self.log(f"Removing existing file: {output_path}")
-                try:
-                    os.remove(output_path)
-                except OSError as e:
-                    raise PermissionError(f"Cannot remove existing file: {output_path}\nError: {e}")
+        except Exception as e:
+            self.log(f"\n✗ ERROR: {str(e)}")
+            self.root.after(0, messagebox.showerror, "Error", f"Conversion failed:\n{str(e)}")
+        finally:
+            self.root.after(0, self.conversion_finished)
+    
+    def conversion_finished(self):
+        self.is_processing = False
+        self.convert_btn.config(state="normal")
 
-            
-            temp_dir = tempfile.mkdtemp(prefix='hillshade_')
-            self.log(f"Created temporary directory: {temp_dir}")
-            
-            # Step 1: Generate hillshade
-            self.progress_var.set(10)
-            self.log("\nStep 1/4: Analyzing input and generating hillshade...")
-            
-            # Check input resolution to understand appropriate zoom levels
-            self.log("\nInput file information:")
-            self.run_command(['gdalinfo', self.input_path.get()])
-            self.log("")
-            
-            hillshade_path = os.path.join(temp_dir, 'hillshade_raw.tif')
-            self.run_command([
-                'gdaldem', 'hillshade',
-                self.input_path.get(),
-                hillshade_path,
-                '-z', str(self.z_factor.get()),
-                '-az', str(self.azimuth.get()),
-                '-alt', str(self.altitude.get()),
-                '-compute_edges'
-            ])
-            
-            # Convert to explicit greyscale to ensure no color tinting
-            self.log("\nConverting to greyscale...")
-            greyscale_path = os.path.join(temp_dir, 'hillshade_grey.tif')
-            self.run_command([
-                'gdal_translate',
-                '-ot', 'Byte',
-                '-co', 'PHOTOMETRIC=MINISBLACK',
-                hillshade_path,
-                greyscale_path
-            ])
-            hillshade_path = greyscale_path
-            
-            # Step 2: Warp to Web Mercator
-            self.progress_var.set(30)
-            self.log("\nStep 2/4: Reprojecting to Web Mercator EPSG:3857...")
-            warped_path = os.path.join(temp_dir, 'hillshade_mercator.tif')
-            self.run_command([
-                'gdalwarp',
-                '-t_srs', 'EPSG:3857',
-                '-r', 'bilinear',
-                '-co', 'TILED=YES',
-                '-co', 'COMPRESS=DEFLATE',
-                hillshade_path,
-                warped_path
-            ])
-            
-           # Step 3: Convert to MBTiles with proper zoom levels
-            self.progress_var.set(60)
-            self.log("\nStep 3/4: Converting to MBTiles format...")
-            self.log(f"Zoom levels: {self.min_zoom.get()} to {self.max_zoom.get()}")
-            self.log("")
-            self.log("IMPORTANT: Using UPPER zoom strategy to create tiles at all zoom levels.")
-            self.log("Tiles may appear stretched at higher zoom if input resolution is insufficient.")
-            self.log("")
-            
-            # Calculate the zoom level span for overview generation
-            zoom_span = self.max_zoom.get() - self.min_zoom.get()
-            
-            self.run_command([
-                'gdal_translate',
-                '-of', 'MBTiles',
-                '-co', 'TILE_FORMAT=PNG',
-                '-co', 'RESAMPLING=AVERAGE',
-                '-co', f'MINZOOM={self.min_zoom.get()}',
-                '-co', f'MAXZOOM={self.max_zoom.get()}',
-                '-co', 'ZOOM_LEVEL_STRATEGY=UPPER',
-                warped_path,
-                self.output_path.get()
-            ])
-            
-            # Step 4: Verify output
-            self.progress_var.set(90)
-            self.log("\nStep 4/4: Verifying MBTiles output...")
-            self.log("Checking zoom levels in generated MBTiles...")
-            
-            # Query the MBTiles to show what zoom levels were created
+    # ── Tile server ──
+    
+    def toggle_tile_server(self):
+        """Start or stop serving tiles rendered on demand with the current parameters"""
+        if self.tile_server is not None:
+            server, self.tile_server = self.tile_server, None
+            self.serve_btn.config(text="Serve Tiles")
+            threading.Thread(target=server.stop, daemon=True).start()
+            self.log("Tile server stopped")
+            return
+        if not self.input_path.get():
+            messagebox.showerror("Error", "Please select an input file")
+            return
+        try:
+            options = self.options()
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        self.serve_btn.config(state="disabled")
+        thread = threading.Thread(target=self.start_tile_server,
+                                  args=(self.input_path.get(), options))
+        thread.daemon = True
+        thread.start()
+    
+    def start_tile_server(self, input_path, options):
+        """Open the DEM and start the server (background thread)"""
+        from hillshade import tileserver
+        try:
+            service = self.pipeline.tile_service(input_path, options)
             try:
-                import sqlite3
-                conn = sqlite3.connect(self.output_path.get())
-                cursor = conn.cursor()
-                cursor.execute("SELECT DISTINCT zoom_level FROM tiles ORDER BY zoom_level")
-                zoom_levels = [row[0] for row in cursor.fetchall()]
-                conn.close()
-                self.log(f"Created tiles at zoom levels: {zoom_levels}")
-                
-                if len(zoom_levels) < zoom_span + 1:
-                    self.log("WARNING: Not all zoom levels have tiles. This may cause visibility issues.")
-                    self.log("Try using a higher resolution input file or reducing MAXZOOM.")
-            except Exception as e:
-                self.log(f"Could not verify zoom levels: {e}")
-            
-            # Cleanup
-            self.log("\nCleaning up temporary files...")
-            shutil.rmtree(temp_dir)
-            
-            self.progress_var.set(100)
-            self.log("\n✓ Conversion complete!")
-            self.log(f"Output saved to: {self.output_path.get()}")
-            
-            messagebox.showinfo("Success", 
-                f"Hillshade conversion completed successfully!\n\n"
-                f"Output: {self.output_path.get()}")
-            
+                self.tile_server = tileserver.TileServer(service).start()
+            except BaseException:
+                service.close()
+                raise
+            url = self.tile_server.url
+            self.log(f"Serving tiles at {url}/{{z}}/{{x}}/{{y}}.{service.tile_encoding.format} "
+                     f"(zoom {options.min_zoom}-{options.max_zoom}, TileJSON: {url}/tilejson.json)")
+            self.root.after(0, lambda: self.serve_btn.config(text="Stop Serving"))
         except Exception as e:
             self.log(f"\n✗ ERROR: {str(e)}")
-            messagebox.showerror("Error", f"Conversion failed:\n{str(e)}")
+            self.root.after(0, messagebox.showerror, "Error",
+                            f"Could not start the tile server:\n{str(e)}")
         finally:
-            self.is_processing = False
-            self.convert_btn.config(state="normal")
-    
-    def run_command(self, cmd):
-        """Run a command and log output"""
-        self.log(f"Running: {' '.join(cmd)}")
-        
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1
-        )
-        
-        for line in process.stdout:
-            line = line.strip()
-            if line:
-                self.log(line)
+            self.root.after(0, lambda: self.serve_btn.config(state="normal"))
+    
+    # ── GDAL performance profile ──
+    
+    def show_performance_window(self):
+        """GDAL block cache, threads and warp memory: detected, calibrated or overridden"""
+        if self.performance_window and self.performance_window.winfo_exists():
+            self.performance_window.lift()
+            return
+        window = self.performance_window = tk.Toplevel(self.root)
+        window.title("GDAL Performance")
+        window.geometry("560x260")
+        
+        overrides = gdalprofile.load_settings()['overrides']
+        gigabytes = lambda name: (f"{overrides[name] / 1073741824.0:g}G"
+                                  if name in overrides else "")
+        self.gdal_cache = tk.StringVar(value=gigabytes('cache_max'))
+        self.gdal_threads = tk.StringVar(value=str(overrides.get('threads', "")))
+        self.warp_memory = tk.StringVar(value=gigabytes('warp_memory'))
+        
+        settings_frame = ttk.LabelFrame(window, text="Saved for every conversion (blank: automatic)",
+                                        padding=5)
+        settings_frame.pack(fill="x", padx=10, pady=5)
+        ttk.Label(settings_frame, text="Block cache:").pack(side="left", padx=5)
+        ttk.Entry(settings_frame, textvariable=self.gdal_cache, width=7).pack(side="left")
+        ttk.Label(settings_frame, text="Threads:").pack(side="left", padx=(20, 5))
+        ttk.Spinbox(settings_frame, from_=1, to=512, textvariable=self.gdal_threads,
+                    width=5).pack(side="left")
+        ttk.Label(settings_frame, text="Warp memory:").pack(side="left", padx=(20, 5))
+        ttk.Entry(settings_frame, textvariable=self.warp_memory, width=7).pack(side="left")
+        
+        self.performance_info = ttk.Label(window, justify="left")
+        self.performance_info.pack(fill="x", padx=15, pady=10)
+        
+        btn_frame = ttk.Frame(window)
+        btn_frame.pack(pady=5)
+        ttk.Button(btn_frame, text="Save", command=self.save_performance).pack(side="left", padx=5)
+        self.calibrate_btn = ttk.Button(btn_frame, text="Calibrate", 
+                                        command=self.start_calibration)
+        self.calibrate_btn.pack(side="left", padx=5)
+        ttk.Button(btn_frame, text="Reset", command=self.reset_performance).pack(side="left", padx=5)
+        ttk.Button(btn_frame, text="Close", command=window.destroy).pack(side="left", padx=5)
+        self.refresh_performance_window()
+    
+    def refresh_performance_window(self):
+        if not (self.performance_window and self.performance_window.winfo_exists()):
+            return
+        summary = gdalprofile.summary()
+        machine = gdalprofile.Machine(**summary['machine'])
+        profile = gdalprofile.GdalProfile(**summary['profile'])
+        text = f"Machine: {machine.describe()}\nIn use: {profile.describe()}"
+        if summary['calibrated']:
+            text += f"\nCalibration: {summary['calibrated']['seconds']} s per test warp"
+        self.performance_info.configure(text=text)
+    
+    def save_performance(self):
+        try:
+            threads = self.gdal_threads.get().strip()
+            gdalprofile.save_overrides(
+                cache_max=pipeline.parse_memory(self.gdal_cache.get().strip() or None),
+                threads=int(threads) if threads else None,
+                warp_memory=pipeline.parse_memory(self.warp_memory.get().strip() or None))
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        self.refresh_performance_window()
+    
+    def reset_performance(self):
+        gdalprofile.reset()
+        for var in (self.gdal_cache, self.gdal_threads, self.warp_memory):
+            var.set("")
+        self.refresh_performance_window()
+    
+    def start_calibration(self):
+        """Time test warps in the background; the fastest settings are saved"""
+        self.calibrate_btn.config(state="disabled")
+        output_dir = os.path.dirname(self.output_path.get()) or None
         
-        process.wait()
+        def calibrate():
+            try:
+                gdalprofile.calibrate(output_dir, log=self.log_sink.log,
+                                      progress=self.log_sink.progress)
+            except Exception as e:
+                self.log(f"\n✗ Calibration failed: {str(e)}")
+                self.root.after(0, messagebox.showerror, "Error",
+                                f"Calibration failed:\n{str(e)}")
+            finally:
+                self.root.after(0, self.calibration_finished)
         
-        if process.returncode != 0:
-            raise RuntimeError(f"Command failed with exit code {process.returncode}")
+        threading.Thread(target=calibrate, daemon=True).start()
+    
+    def calibration_finished(self):
+        if self.performance_window and self.performance_window.winfo_exists():
+            self.calibrate_btn.config(state="normal")
+            self.refresh_performance_window()
+    
+    # ── Job queue ──
+    
+    def resume_queue(self):
+        """Pick up jobs left queued (or running) when the app last closed"""
+        waiting = [job for job in self.job_queue.jobs()
+                   if job.state in (jobqueue.QUEUED, jobqueue.RUNNING)]
+        if waiting:
+            self.log(f"Resuming {len(waiting)} queued conversion(s)")
+            self.scheduler.start()
+    
+    def add_to_queue(self):
+        """Queue a conversion with the current parameters"""
+        if not self.input_path.get() or not self.output_path.get():
+            messagebox.showerror("Error", "Please select input and output files")
+            return
+        try:
+            options = self.options()
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        job = self.job_queue.add(self.input_path.get(), self.output_path.get(), options)
+        self.log(f"Queued job {job.id}: {job.input} -> {job.output}")
+        self.scheduler.start()
+        self.scheduler.wake()
+        self.refresh_queue_window()
+    
+    def show_queue_window(self):
+        """Jobs with their state and progress, and the scheduler's limits"""
+        if self.queue_window and self.queue_window.winfo_exists():
+            self.queue_window.lift()
+            return
+        window = self.queue_window = tk.Toplevel(self.root)
+        window.title("Conversion Queue")
+        window.geometry("900x420")
+        
+        limits = self.job_queue.limits()
+        self.queue_cores = tk.StringVar(value=str(limits.cores or ""))
+        self.queue_memory = tk.StringVar(
+            value="" if limits.memory is None else f"{limits.memory / 1073741824.0:g}G")
+        self.queue_scratch = tk.StringVar(
+            value="" if limits.scratch is None else f"{limits.scratch / 1073741824.0:g}G")
+        limits_frame = ttk.LabelFrame(window, text="Limits for all running jobs (blank: automatic)",
+                                      padding=5)
+        limits_frame.pack(fill="x", padx=10, pady=5)
+        ttk.Label(limits_frame, text="Cores:").pack(side="left", padx=5)
+        ttk.Spinbox(limits_frame, from_=1, to=512, textvariable=self.queue_cores,
+                    width=5).pack(side="left")
+        ttk.Label(limits_frame, text="Memory:").pack(side="left", padx=(20, 5))
+        ttk.Entry(limits_frame, textvariable=self.queue_memory, width=7).pack(side="left")
+        ttk.Label(limits_frame, text="Scratch disk:").pack(side="left", padx=(20, 5))
+        ttk.Entry(limits_frame, textvariable=self.queue_scratch, width=7).pack(side="left")
+        ttk.Button(limits_frame, text="Apply", command=self.apply_queue_limits).pack(side="left", padx=20)
+        
+        columns = ("state", "priority", "progress", "input", "output")
+        self.queue_tree = ttk.Treeview(window, columns=columns, show="headings", height=12)
+        for column, width in zip(columns, (90, 60, 240, 220, 220)):
+            self.queue_tree.heading(column, text=column.capitalize())
+            self.queue_tree.column(column, width=width, anchor="w")
+        self.queue_tree.pack(fill="both", expand=True, padx=10, pady=5)
+        
+        btn_frame = ttk.Frame(window)
+        btn_frame.pack(pady=5)
+        for text, command in (("Cancel", self.job_queue.cancel),
+                              ("Retry", self.job_queue.retry),
+                              ("Raise Priority", lambda job_id: self.shift_priority(job_id, 1)),
+                              ("Lower Priority", lambda job_id: self.shift_priority(job_id, -1))):
+            ttk.Button(btn_frame, text=text,
+                       command=lambda c=command: self.on_selected_jobs(c)).pack(side="left", padx=5)
+        ttk.Button(btn_frame, text="Remove", 
+                   command=lambda: self.job_queue.remove(set(self.queue_tree.selection()))
+                   ).pack(side="left", padx=5)
+        ttk.Button(btn_frame, text="Clear Finished", 
+                   command=self.job_queue.clear_finished).pack(side="left", padx=5)
+        ttk.Button(btn_frame, text="Close", command=window.destroy).pack(side="left", padx=5)
+        self.refresh_queue_window(repeat=True)
+    
+    def on_selected_jobs(self, action):
+        for job_id in self.queue_tree.selection():
+            action(job_id)
+        self.scheduler.start()
+        self.scheduler.wake()
+        self.refresh_queue_window()
+    
+    def shift_priority(self, job_id, step):
+        self.job_queue.update(job_id, lambda job: setattr(job, 'priority', job.priority + step))
+    
+    def apply_queue_limits(self):
+        try:
+            cores = self.queue_cores.get().strip()
+            self.job_queue.set_limits(
+                cores=int(cores) if cores else None,
+                memory=pipeline.parse_memory(self.queue_memory.get().strip() or None),
+                scratch=pipeline.parse_memory(self.queue_scratch.get().strip() or None))
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        self.scheduler.wake()
+    
+    def refresh_queue_window(self, repeat=False):
+        if not (self.queue_window and self.queue_window.winfo_exists()):
+            return
+        jobs = self.job_queue.jobs()
+        ids = {job.id for job in jobs}
+        for item in self.queue_tree.get_children():
+            if item not in ids:
+                self.queue_tree.delete(item)
+        for index, job in enumerate(jobs):
+            progress = ""
+            if job.id in self.scheduler.progress:
+                percent, message = self.scheduler.progress[job.id]
+                progress = f"{percent:.0f}%  {message}"
+            elif job.error:
+                progress = job.error
+            values = (job.state, job.priority, progress, job.input, job.output)
+            if self.queue_tree.exists(job.id):
+                self.queue_tree.item(job.id, values=values)
+                self.queue_tree.move(job.id, "", index)
+            else:
+                self.queue_tree.insert("", index, iid=job.id, values=values)
+        if repeat:
+            self.root.after(QUEUE_REFRESH_MS, self.refresh_queue_window, True)
+    
+    def quit_app(self):
+        """Exit; running queued jobs are stopped and resume on the next start"""
+        if self.scheduler.running() and not messagebox.askyesno(
+                "Exit", "Queued conversions are still running. Stop them and exit?\n\n"
+                        "They resume from their checkpoints when the app is reopened."):
+            return
+        self.scheduler.shutdown()
+        if self.tile_server is not None:
+            self.tile_server.stop()
+        self.root.quit()
 
 def main():
+    # Worker processes of the built-in tiler re-enter here when frozen
+    multiprocessing.freeze_support()
+    # `hillshade_converter convert ...` runs headless, without creating a window
+    if len(sys.argv) > 1 and sys.argv[1] in cli.COMMANDS:
+        sys.exit(cli.main(sys.argv[1:]))
     root = tk.Tk()
     
     # Style
@@ -56,7 +56,11 @@ a = Analysis(
     pathex=[],
     binaries=osgeo_binaries + gdal_binaries,
     datas=osgeo_datas + extra_datas,
-    hiddenimports=["PIL"],
+    # Loaded through hillshade.lazy, which PyInstaller cannot trace
+    hiddenimports=["PIL", "PIL.Image", "PIL.ImageTk", "numpy",
+                   "tkinter", "tkinter.ttk", "tkinter.filedialog",
+                   "tkinter.messagebox", "tkinter.scrolledtext",
+                   "hillshade.engine", "hillshade.tiler"],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -9,7 +9,11 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[],
-    hiddenimports=["PIL"],
+    # Loaded through hillshade.lazy, which PyInstaller cannot trace
+    hiddenimports=["PIL", "PIL.Image", "PIL.ImageTk", "numpy",
+                   "tkinter", "tkinter.ttk", "tkinter.filedialog",
+                   "tkinter.messagebox", "tkinter.scrolledtext",
+                   "hillshade.engine", "hillshade.tiler"],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -0,0 +1,37 @@
+"""Shared fixtures"""
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture(scope='session')
+def mercator_dem(tmp_path_factory):
+    """Factory: write a rough synthetic Web Mercator DEM aligned to the tile grid
+
+    make(zoom, west_x, north_y, tiles_wide, tiles_high, tile_pixels) covers
+    XYZ tile columns from west_x and rows from north_y (fractional values
+    allowed) with tile_pixels source pixels per tile edge. Needs GDAL.
+    """
+    gdal = pytest.importorskip('osgeo.gdal')
+    from osgeo import osr
+    from hillshade import tiler
+    gdal.UseExceptions()
+
+    def make(zoom, west_x, north_y, tiles_wide, tiles_high, tile_pixels):
+        span = tiler.tile_span(zoom)
+        west, _, _, north = tiler.tile_bounds(zoom, west_x, north_y)
+        width, height = int(tiles_wide * tile_pixels), int(tiles_high * tile_pixels)
+        r, c = np.mgrid[0:height, 0:width].astype(np.float64)
+        elevation = (800 + 60 * np.sin(c / 9.0) * np.cos(r / 13.0)
+                     + 40 * np.sin((c + 2 * r) / 23.0) + 25 * np.cos((3 * c - r) / 7.0))
+        path = str(tmp_path_factory.mktemp('dem') / 'dem.tif')
+        ds = gdal.GetDriverByName('GTiff').Create(path, width, height, 1, gdal.GDT_Float32)
+        ds.SetGeoTransform((west, span / tile_pixels, 0, north, 0, -span / tile_pixels))
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(3857)
+        ds.SetProjection(srs.ExportToWkt())
+        ds.GetRasterBand(1).WriteArray(elevation.astype(np.float32))
+        ds = None
+        return path
+
+    return make
@@ -0,0 +1,77 @@
+"""Job manifests: saving, resuming, and invalidation when input or parameters change"""
+
+import json
+import os
+
+from hillshade import checkpoint
+
+PARAMS = {'z_factor': 1.0, 'zoom': [5, 12], 'encoding': 'png'}
+
+
+def dem(tmp_path, name='dem.tif', data=b'dem'):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_resume(tmp_path):
+    source = dem(tmp_path)
+    output = str(tmp_path / 'out.mbtiles')
+    manifest = checkpoint.JobManifest.for_output(output, source, PARAMS)
+    assert not manifest.resumed and not manifest.stage_done('hillshade')
+
+    stage_output = os.path.join(manifest.work_dir, 'hillshade.tif')
+    os.makedirs(manifest.work_dir)
+    open(stage_output, 'wb').close()
+    manifest.complete_stage('hillshade', stage_output)
+    manifest.complete_stage('overviews')
+    manifest.complete_blocks([(10, 0, 0), (10, 1, 0)])
+    assert not os.path.exists(manifest.path + '.tmp')
+
+    again = checkpoint.JobManifest.for_output(output, source, PARAMS)
+    assert again.resumed
+    assert again.stage_done('hillshade') and again.stage_done('overviews')
+    assert again.block_done([10, 1, 0]) and not again.block_done((10, 2, 0))
+
+    # A stage whose output went missing has to run again
+    os.remove(stage_output)
+    assert not again.stage_done('hillshade') and again.stage_done('overviews')
+
+    again.discard()
+    assert not os.path.exists(again.path) and not os.path.exists(again.work_dir)
+    assert not checkpoint.JobManifest.for_output(output, source, PARAMS).resumed
+
+
+def test_invalidation(tmp_path):
+    sources = [dem(tmp_path, 'a.tif'), dem(tmp_path, 'b.tif')]
+    output = str(tmp_path / 'out.mbtiles')
+    key = checkpoint.job_key(sources, PARAMS)
+    assert checkpoint.job_key(sources, dict(reversed(list(PARAMS.items())))) == key
+    assert checkpoint.job_key(sources, dict(PARAMS, z_factor=2.0)) != key
+    assert checkpoint.job_key(sources[:1], PARAMS) != key
+
+    checkpoint.JobManifest.for_output(output, sources, PARAMS).complete_stage('overviews')
+    assert not checkpoint.JobManifest.for_output(
+        output, sources, dict(PARAMS, encoding='webp')).resumed
+
+    # Same size, later mtime: an edited member invalidates the job
+    st = os.stat(sources[1])
+    os.utime(sources[1], ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert checkpoint.job_key(sources, PARAMS) != key
+    manifest = checkpoint.JobManifest.for_output(output, sources, PARAMS)
+    assert not manifest.resumed and manifest.stages == {}
+
+
+def test_unreadable_manifest(tmp_path):
+    source = dem(tmp_path)
+    output = str(tmp_path / 'out.mbtiles')
+    manifest = checkpoint.JobManifest.for_output(output, source, PARAMS)
+    with open(manifest.path, 'w', encoding='utf-8') as f:
+        f.write('{"version": 1, "key"')
+    assert not checkpoint.JobManifest.for_output(output, source, PARAMS).resumed
+
+    # An older manifest format is not trusted even with a matching key
+    with open(manifest.path, 'w', encoding='utf-8') as f:
+        json.dump({'version': checkpoint.MANIFEST_VERSION - 1, 'key': manifest.key,
+                   'stages': {'overviews': {'output': None}}}, f)
+    assert not checkpoint.JobManifest.for_output(output, source, PARAMS).resumed
@@ -0,0 +1,76 @@
+"""Command-line parsing and the options it builds"""
+
+import json
+
+import pytest
+
+from hillshade import cli, mbtiles
+
+
+def parse(*argv):
+    args = cli.build_parser().parse_args(list(argv))
+    return args, cli.options_from_args(args)
+
+
+def test_update_takes_memory_and_gdal_settings():
+    _, options = parse('update', 'dem.tif', 'out.mbtiles', '--bbox', '5.9,45.8,6.0,45.9',
+                       '--max-memory', '2G', '--gdal-cache', '512M',
+                       '--gdal-threads', '3', '--warp-memory', '256M')
+    assert options.max_memory == 2 << 30
+    assert (options.gdal_cache, options.gdal_threads, options.warp_memory) == \
+        (512 << 20, 3, 256 << 20)
+
+
+def test_convert_parsing():
+    args, options = parse('convert', 'tiles/', 'out.pmtiles', '-z', '2', '--light', '300',
+                          '--light', '0,60,0.5', '--altitude', '40', '--staged',
+                          '--no-resume', '--tile-format', 'jpg', '--page-size', '65536')
+    assert (args.input, args.output) == ('tiles/', 'out.pmtiles')
+    assert options.z_factor == 2.0
+    # A light without an altitude takes --altitude
+    assert options.lights == [(300.0, 40.0, 1.0), (0.0, 60.0, 0.5)]
+    assert not options.stream and not options.resumable and options.native_tiler
+    assert options.tile_format == 'jpeg:85' and options.page_size == 65536
+
+    _, options = parse('convert', 'dem.tif', 'out.mbtiles', '--multidirectional')
+    assert len(options.lights) == 4 and options.max_memory is None
+
+
+@pytest.mark.parametrize('argv', [
+    (),
+    ('--light', '270,30,2', '--slope-weight', '0.25', '--min-zoom', '3', '--max-zoom', '9',
+     '--tile-format', 'webp:80', '--gdal-tiler', '--no-coverage-index', '--no-stage-cache',
+     '--workers', '3', '--max-memory', '1.5G', '--gdal-cache', '256M', '--gdal-threads', '2',
+     '--warp-memory', '64M', '--vacuum', '--page-size', '8192', '--profile'),
+    ('--multidirectional', '--altitude', '35.5', '-z', '1.25', '--staged', '--no-resume')])
+def test_convert_arguments_round_trip(argv):
+    _, options = parse('convert', 'dem.tif', 'out.mbtiles', *argv)
+    again = cli.convert_arguments('dem.tif', 'out.mbtiles', options)
+    assert parse(*again)[1] == options
+
+
+def test_exit_codes(tmp_path, capsys):
+    assert cli.main(['--help']) == cli.EXIT_OK
+    assert cli.main(['convert', 'dem.tif']) == cli.EXIT_USAGE
+    assert cli.main(['convert', 'dem.tif', 'out.mbtiles', '--tile-format', 'gif']) == \
+        cli.EXIT_USAGE
+    capsys.readouterr()
+
+    missing = str(tmp_path / 'missing.mbtiles')
+    assert cli.main(['--json', 'inspect', missing]) == cli.EXIT_INPUT_NOT_FOUND
+    error = json.loads(capsys.readouterr().out.splitlines()[-1])
+    assert error['event'] == 'error' and error['exit_code'] == cli.EXIT_INPUT_NOT_FOUND
+
+    empty = tmp_path / 'empty.mbtiles'
+    mbtiles.MBTilesWriter(str(empty), {'name': 'empty'}).close()
+    assert cli.main(['-q', 'pmtiles', str(empty), str(tmp_path / 'out.pmtiles')]) == \
+        cli.EXIT_FAILED
+    assert 'No tiles' in capsys.readouterr().err
+
+    path = tmp_path / 'ok.mbtiles'
+    with mbtiles.MBTilesWriter(str(path), {'name': 'ok', 'minzoom': '0',
+                                           'maxzoom': '0'}) as writer:
+        writer.write_tiles([(0, 0, 0, b'tile')])
+    assert cli.main(['--json', 'inspect', str(path)]) == cli.EXIT_OK
+    result = json.loads(capsys.readouterr().out.splitlines()[-1])
+    assert result['event'] == 'result' and result['output'] == str(path)
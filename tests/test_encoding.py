@@ -0,0 +1,124 @@
+"""Tile encoders, decoded back with Pillow, and in-place MBTiles re-encoding"""
+
+import io
+import sqlite3
+
+import numpy as np
+import pytest
+from PIL import Image, features
+
+from hillshade import encoding, mbtiles
+
+
+def shaded_tile(alpha=None, size=64):
+    """A uint8 (2, N, N) grey/alpha tile with a gradient and some noise"""
+    rng = np.random.default_rng(3)
+    r, c = np.mgrid[0:size, 0:size]
+    grey = np.clip(40 + 2 * r + c + rng.integers(0, 8, (size, size)), 1, 255).astype(np.uint8)
+    if alpha is None:
+        alpha = np.full((size, size), 255, np.uint8)
+    return np.stack([grey, alpha.astype(np.uint8)])
+
+
+@pytest.mark.parametrize('text,expected', [
+    ('png', encoding.PNG), ('png:9', ('png', None, 9)), ('webp', ('webp', None, None)),
+    ('webp:80', ('webp', 80, None)), ('jpg', ('jpeg', 85, None))])
+def test_parse_and_spec(text, expected):
+    parsed = encoding.parse_encoding(text)
+    assert parsed == expected
+    assert encoding.parse_encoding(encoding.spec(parsed)) == parsed
+
+
+@pytest.mark.parametrize('text', ['gif', 'png:10', 'jpeg:0', 'webp:x'])
+def test_parse_rejects(text):
+    with pytest.raises(ValueError):
+        encoding.parse_encoding(text)
+
+
+def test_png_bytes_decode_with_pillow():
+    tile = shaded_tile()
+    for pixels, mode in ((tile[0], 'L'), (np.ascontiguousarray(tile.transpose(1, 2, 0)), 'LA')):
+        for level in (0, 6, 9):
+            with Image.open(io.BytesIO(encoding.png_bytes(pixels, mode, level))) as img:
+                img.load()
+                assert img.mode == mode
+                assert np.array_equal(np.asarray(img), pixels)
+
+
+@pytest.mark.parametrize('alpha,variant', [
+    (None, 'png L'),
+    ('on/off', 'png L+tRNS'),
+    ('partial', 'png LA')])
+def test_png_tile_round_trip(alpha, variant):
+    size = 64
+    if alpha == 'on/off':
+        alpha = np.full((size, size), 255, np.uint8)
+        alpha[:, :20] = 0
+    elif alpha == 'partial':
+        alpha = np.tile(np.arange(size, dtype=np.uint8) * 4, (size, 1))
+    tile = shaded_tile(alpha)
+    # Hidden pixels carry the nodata grey, as tiler.to_tile leaves them
+    tile[0][tile[1] == 0] = encoding.TRANSPARENT_GREY
+    data, written = encoding.encode_tile(tile)
+    assert written == variant
+    assert np.array_equal(encoding.decode_tile(data), tile)
+
+
+def test_lossy_and_lossless_formats():
+    tile = shaded_tile()
+    data, _ = encoding.encode_tile(tile, encoding.parse_encoding('jpeg:90'))
+    decoded = encoding.decode_tile(data)
+    assert (decoded[1] == 255).all()
+    assert np.abs(decoded[0].astype(int) - tile[0]).mean() < 3
+    if features.check('webp'):
+        data, written = encoding.encode_tile(tile, encoding.parse_encoding('webp'))
+        assert written == 'webp lossless'
+        assert np.array_equal(encoding.decode_tile(data), tile)
+
+
+def test_needs_recode():
+    assert not encoding.needs_recode('png')
+    assert not encoding.needs_recode(encoding.PNG)
+    assert encoding.needs_recode('png:9')
+    assert encoding.needs_recode('jpeg')
+
+
+def gdal_like(path, count=40):
+    """Flat MBTiles holding RGBA PNG tiles, as GDAL's MBTiles driver writes them"""
+    conn = sqlite3.connect(str(path))
+    conn.executescript("""
+        CREATE TABLE metadata (name TEXT, value TEXT);
+        CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER,
+                            tile_row INTEGER, tile_data BLOB);""")
+    conn.execute("INSERT INTO metadata VALUES ('format', 'png')")
+    tiles = {}
+    for x in range(count):
+        tile = shaded_tile()
+        tile[0] = np.roll(tile[0], x, axis=1)
+        buf = io.BytesIO()
+        Image.fromarray(tile[0], 'L').convert('RGBA').save(buf, format='PNG')
+        conn.execute("INSERT INTO tiles VALUES (6, ?, 0, ?)", (x, buf.getvalue()))
+        tiles[x] = tile
+    conn.commit()
+    conn.close()
+    return tiles
+
+
+def test_recode_mbtiles(tmp_path):
+    path = tmp_path / 'gdal.mbtiles'
+    tiles = gdal_like(path)
+    stats = encoding.EncodingStats()
+    done = encoding.recode_mbtiles(str(path), encoding.parse_encoding('jpeg:95'),
+                                   workers=2, log=lambda message: None, stats=stats)
+    assert done == len(tiles)
+    assert stats.as_dict()['jpeg q95']['tiles'] == len(tiles)
+
+    conn = sqlite3.connect(str(path))
+    # The metadata table has no unique index, yet format is replaced, not added
+    assert conn.execute("SELECT value FROM metadata WHERE name = 'format'").fetchall() == \
+        [('jpg',)]
+    for x, data in conn.execute("SELECT tile_column, tile_data FROM tiles"):
+        decoded = encoding.decode_tile(bytes(data))
+        assert np.abs(decoded[0].astype(int) - tiles[x][0]).mean() < 3
+    assert mbtiles.tile_report(conn, {})[6]['tiles'] == len(tiles)
+    conn.close()
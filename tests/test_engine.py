@@ -0,0 +1,165 @@
+"""NumPy Horn hillshade against gdaldem, without GDAL
+
+`gdaldem_hillshade` is a scalar transcription of `gdaldem hillshade
+-compute_edges` (GDALGeneric3x3Processing, ComputeVal and GDALHillshadeAlg
+in gdaldem_lib.cpp), evaluated in double precision. The engine works in
+float32 and gdaldem itself uses an approximate inverse square root, so the
+agreement asserted is within TOLERANCE grey levels per pixel. The planar
+cases have exact answers gdaldem also produces (181 for flat ground at the
+default altitude), and those are asserted exactly.
+"""
+
+import math
+
+import numpy as np
+import pytest
+
+from hillshade import engine
+
+# Grey levels; float32 vs double can move a value sitting on .5 by one
+TOLERANCE = 1
+
+GEOTRANSFORM = (500000.0, 30.0, 0.0, 4100000.0, 0.0, -30.0)
+NODATA = -9999.0
+
+
+def gdaldem_hillshade(dem, geotransform, nodata=None, z_factor=1.0,
+                      azimuth=315.0, altitude=45.0):
+    """Reference: gdaldem hillshade -compute_edges, one pixel at a time"""
+    height, width = dem.shape
+    rows = [[float(v) for v in row] for row in dem]
+
+    def is_nodata(value):
+        return nodata is not None and value == nodata
+
+    def interpol(a, b):
+        # Extrapolate one pixel past the edge; nodata if either source is
+        return nodata if is_nodata(a) or is_nodata(b) else 2 * a - b
+
+    def shade(win):
+        if is_nodata(win[4]):
+            return engine.HILLSHADE_NODATA
+        win = [win[4] if is_nodata(v) else v for v in win]
+        x = ((win[0] + 2 * win[3] + win[6]) - (win[2] + 2 * win[5] + win[8])) / (8 * geotransform[1])
+        y = ((win[6] + 2 * win[7] + win[8]) - (win[0] + 2 * win[1] + win[2])) / (8 * geotransform[5])
+        az, alt = math.radians(azimuth), math.radians(altitude)
+        cang = (254 * math.sin(alt) - z_factor * 254 * math.cos(alt)
+                * (y * math.cos(az) - x * math.sin(az))) \
+            / math.sqrt(1 + z_factor ** 2 * (x * x + y * y))
+        # Float32 1 + 254*cos(angle), rounded to nearest when written as Byte
+        return int(math.floor((1.0 if cang <= 0 else 1.0 + cang) + 0.5))
+
+    out = np.zeros((height, width), dtype=np.uint8)
+    for r in range(height):
+        for j in range(width):
+            if r in (0, height - 1):
+                # First and last lines: the corners repeat their own column
+                jmin, jmax = max(j - 1, 0), min(j + 1, width - 1)
+                here = rows[r]
+                inner = rows[1] if r == 0 else rows[r - 1]
+                edge = [interpol(here[k], inner[k]) for k in (jmin, j, jmax)]
+                line = [here[jmin], here[j], here[jmax]]
+                other = [inner[jmin], inner[j], inner[jmax]]
+                win = edge + line + other if r == 0 else other + line + edge
+            else:
+                win = []
+                for line in rows[r - 1:r + 2]:
+                    left = interpol(line[0], line[1]) if j == 0 else line[j - 1]
+                    right = interpol(line[-1], line[-2]) if j == width - 1 else line[j + 1]
+                    win += [left, line[j], right]
+            out[r, j] = shade(win)
+    return out
+
+
+def synthetic_dem(height=24, width=31, seed=7):
+    """A hill and a ridge with some noise, in metres"""
+    rng = np.random.default_rng(seed)
+    r, c = np.mgrid[0:height, 0:width].astype(np.float64)
+    hill = 400 * np.exp(-((r - 10) ** 2 + (c - 12) ** 2) / 60.0)
+    ridge = 150 * np.exp(-((c - 0.8 * r - 18) ** 2) / 8.0)
+    return (1200 + hill + ridge + rng.normal(0, 3, (height, width))).astype(np.float32)
+
+
+def interior(shape):
+    mask = np.zeros(shape, dtype=bool)
+    mask[1:-1, 1:-1] = True
+    return mask
+
+
+def assert_close(actual, expected, where):
+    diff = np.abs(actual.astype(int) - expected.astype(int))[where]
+    assert diff.max() <= TOLERANCE, f"{np.count_nonzero(diff > TOLERANCE)} pixels off"
+
+
+@pytest.mark.parametrize('azimuth,altitude,z_factor', [
+    (315.0, 45.0, 1.0), (90.0, 30.0, 2.5), (200.0, 70.0, 0.5)])
+def test_matches_gdaldem(azimuth, altitude, z_factor):
+    dem = synthetic_dem()
+    expected = gdaldem_hillshade(dem, GEOTRANSFORM, None, z_factor, azimuth, altitude)
+    actual = engine.hillshade(dem, GEOTRANSFORM, None, z_factor, azimuth, altitude)
+    assert_close(actual, expected, interior(dem.shape))
+    assert_close(actual, expected, ~interior(dem.shape))
+    assert (actual != engine.HILLSHADE_NODATA).all()
+
+
+def test_nodata():
+    dem = synthetic_dem()
+    dem[5, 7] = dem[0, 3] = dem[12, -1] = dem[-1, -1] = NODATA
+    dem[15:18, 20:23] = NODATA
+    holes = dem == NODATA
+    expected = gdaldem_hillshade(dem, GEOTRANSFORM, NODATA)
+    actual = engine.hillshade(dem, GEOTRANSFORM, NODATA)
+
+    assert (actual[holes] == engine.HILLSHADE_NODATA).all()
+    assert (actual[~holes] != engine.HILLSHADE_NODATA).all()
+    # Neighbours of a hole are shaded with the centre value in its place
+    grown = holes.copy()
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            grown |= np.roll(np.roll(holes, dy, axis=0), dx, axis=1)
+    assert_close(actual, expected, grown & ~holes)
+    assert_close(actual, expected, ~grown)
+
+
+def test_planes():
+    r, c = np.mgrid[0:9, 0:11].astype(np.float32)
+    flat = np.full(r.shape, 250.0, dtype=np.float32)
+    # cos(45 deg) * 254 + 1 = 180.6
+    assert (engine.hillshade(flat, GEOTRANSFORM) == 181).all()
+
+    # Rising one pixel size per pixel eastwards: a 45 degree slope facing west.
+    # The corners only see half the gradient (see gdaldem_hillshade), so
+    # check the plane's exact values everywhere else.
+    slope = c * GEOTRANSFORM[1]
+    not_corners = np.ones(r.shape, dtype=bool)
+    not_corners[[0, 0, -1, -1], [0, -1, 0, -1]] = False
+    lit = engine.hillshade(slope, GEOTRANSFORM, azimuth=270.0, altitude=45.0)
+    assert (lit[not_corners] == 255).all()
+    away = engine.hillshade(slope, GEOTRANSFORM, azimuth=90.0, altitude=45.0)
+    assert (away[not_corners] == 1).all()
+    assert_close(lit, gdaldem_hillshade(slope, GEOTRANSFORM, azimuth=270.0), ~not_corners)
+
+
+def test_without_compute_edges():
+    dem = synthetic_dem()
+    actual = engine.hillshade(dem, GEOTRANSFORM, compute_edges=False)
+    assert (actual[~interior(dem.shape)] == engine.HILLSHADE_NODATA).all()
+    assert_close(actual, gdaldem_hillshade(dem, GEOTRANSFORM), interior(dem.shape))
+
+
+def test_gradient_cache_keys_on_member_files(tmp_path):
+    members = [tmp_path / 'a.tif', tmp_path / 'b.tif']
+    for member in members:
+        member.write_bytes(b'dem')
+    # Each process writes its own mosaic VRT over the same members
+    vrts = [tmp_path / 'one.vrt', tmp_path / 'two.vrt']
+    for vrt in vrts:
+        vrt.write_text('<VRTDataset/>')
+    key = engine.GradientCache.make_key
+    assert key([str(m) for m in members], 1.0) == key([str(m) for m in members], 1.0)
+    assert key(str(vrts[0]), 1.0) != key(str(vrts[1]), 1.0)
+
+    before = key([str(m) for m in members], 1.0)
+    members[1].write_bytes(b'edited dem')
+    assert key([str(m) for m in members], 1.0) != before
+    assert key([str(m) for m in members], 2.0) != key([str(m) for m in members], 1.0)
@@ -0,0 +1,94 @@
+"""Scheduler lifecycle with dummy jobs in place of conversions"""
+
+import sys
+import time
+
+import pytest
+
+from hillshade import jobqueue, pipeline
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    # A job that just sleeps, so shutdown has something to kill
+    monkeypatch.setattr(jobqueue, 'job_command', lambda job, cores, memory: [
+        sys.executable, '-c', 'import time; time.sleep(60)'])
+    return jobqueue.JobQueue(str(tmp_path / 'queue.json'))
+
+
+def add_job(queue, tmp_path, name, **options):
+    return queue.add(str(tmp_path / f'{name}.tif'), str(tmp_path / f'{name}.mbtiles'),
+                     pipeline.ConversionOptions(**options))
+
+
+def wait_for(condition, seconds=10):
+    deadline = time.time() + seconds
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.05)
+
+
+def test_shutdown_requeues_running_jobs(queue, tmp_path):
+    queue.set_limits(cores=2)
+    for name in ('north', 'south'):
+        add_job(queue, tmp_path, name, workers=1)
+    scheduler = jobqueue.Scheduler(queue, log=lambda message: None, poll_seconds=0.05)
+    scheduler.start()
+    wait_for(lambda: len(scheduler.running()) == 2)
+    scheduler.shutdown()
+    # Give the followers time to record how the killed processes ended
+    wait_for(lambda: not scheduler.running())
+    time.sleep(0.2)
+    jobs = queue.jobs()
+    assert [job.state for job in jobs] == [jobqueue.QUEUED] * 2
+    assert all(job.owner is None and job.error is None for job in jobs)
+
+
+def test_job_that_never_fits_fails_and_wait_returns(queue, tmp_path):
+    queue.set_limits(cores=2, memory=1 << 30)
+    job = add_job(queue, tmp_path, 'big', max_memory=4 << 30)
+    scheduler = jobqueue.Scheduler(queue, log=lambda message: None, poll_seconds=0.05)
+    scheduler.start()
+    try:
+        scheduler.wait()
+    finally:
+        scheduler.shutdown()
+    [stored] = queue.jobs()
+    assert stored.id == job.id
+    assert stored.state == jobqueue.FAILED
+    assert 'memory' in stored.error
+
+
+def test_wait_returns_when_nothing_can_start(queue, tmp_path, monkeypatch):
+    # Fits the limits, but the disk never has room for it
+    monkeypatch.setattr(jobqueue.Scheduler, '_disk_has_room', staticmethod(
+        lambda job, running: False))
+    add_job(queue, tmp_path, 'stuck')
+    scheduler = jobqueue.Scheduler(queue, log=lambda message: None, poll_seconds=0.05)
+    scheduler.start()
+    try:
+        scheduler.wait()
+    finally:
+        scheduler.shutdown()
+    assert [job.state for job in queue.jobs()] == [jobqueue.QUEUED]
+
+
+def test_cancel_kills_once(queue, tmp_path, monkeypatch):
+    # Ignores SIGTERM, so it outlives many ticks until the grace period ends
+    monkeypatch.setattr(jobqueue, 'job_command', lambda job, cores, memory: [
+        sys.executable, '-c',
+        'import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); time.sleep(60)'])
+    monkeypatch.setattr(jobqueue, 'KILL_GRACE_SECONDS', 0.5)
+    messages = []
+    job = add_job(queue, tmp_path, 'stubborn', workers=1)
+    scheduler = jobqueue.Scheduler(queue, log=messages.append, poll_seconds=0.02)
+    scheduler.start()
+    try:
+        wait_for(lambda: scheduler.running())
+        time.sleep(0.2)  # Let the child install its handler
+        queue.cancel(job.id)
+        scheduler.wake()
+        wait_for(lambda: queue.jobs()[0].state == jobqueue.CANCELLED)
+    finally:
+        scheduler.shutdown()
+    assert messages.count(f"Cancelling job {job.id}") == 1
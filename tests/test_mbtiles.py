@@ -0,0 +1,103 @@
+"""MBTilesWriter on small files built in the test"""
+
+import sqlite3
+
+from hillshade import mbtiles
+
+
+def write(path, tiles, **kwargs):
+    with mbtiles.MBTilesWriter(str(path), {'name': 'test'}, **kwargs) as writer:
+        writer.write_tiles(tiles)
+    return writer
+
+
+def test_dedup_counts_only_stored_images(tmp_path):
+    path = tmp_path / 'dedup.mbtiles'
+    blank, ridge = b'blank' * 10, b'ridge' * 20
+    writer = mbtiles.MBTilesWriter(str(path), batch_size=3)
+    # The repeated image spans two batches and a second writer session
+    writer.write_tiles([(3, 0, 0, blank), (3, 1, 0, blank), (3, 2, 0, ridge),
+                        (3, 3, 0, blank)])
+    writer.close()
+    assert (writer.tiles_written, writer.images_written) == (4, 2)
+    assert writer.bytes_written == len(blank) + len(ridge)
+
+    writer = write(path, [(3, 4, 0, blank), (3, 5, 0, ridge)])
+    assert (writer.tiles_written, writer.images_written, writer.bytes_written) == (2, 0, 0)
+
+    conn = sqlite3.connect(str(path))
+    assert conn.execute("SELECT COUNT(*) FROM images").fetchone()[0] == 2
+    assert conn.execute("SELECT COUNT(*) FROM tiles").fetchone()[0] == 6
+    conn.close()
+
+
+def test_flat_layout(tmp_path):
+    path = tmp_path / 'flat.mbtiles'
+    writer = write(path, [(1, 0, 0, b'a'), (1, 1, 0, b'a')], dedup=False)
+    assert (writer.tiles_written, writer.images_written) == (2, 2)
+    conn = sqlite3.connect(str(path))
+    assert not mbtiles.has_dedup_schema(conn)
+    # XYZ row 0 is TMS row 1 at zoom 1
+    assert conn.execute("SELECT tile_row FROM tiles WHERE tile_column = 0").fetchone()[0] == 1
+    conn.close()
+
+
+def gdal_style(path, tiles):
+    """Flat tiles table without the unique index, as GDAL's driver leaves it"""
+    conn = sqlite3.connect(str(path))
+    conn.executescript("""
+        CREATE TABLE metadata (name TEXT, value TEXT);
+        CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER,
+                            tile_row INTEGER, tile_data BLOB);""")
+    conn.execute("INSERT INTO metadata VALUES ('name', 'gdal')")
+    conn.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?)", tiles)
+    conn.commit()
+    conn.close()
+
+
+def test_finalize(tmp_path):
+    path = tmp_path / 'gdal.mbtiles'
+    # (2, 1, 2) is written twice; the later row wins
+    gdal_style(path, [(2, 1, 2, b'old'), (2, 1, 2, b'new'), (2, 2, 1, b'b'), (1, 0, 1, b'c')])
+    done = mbtiles.finalize(str(path), page_size=4096)
+    assert done['duplicates_removed'] == 1
+    assert done['vacuumed'] and done['page_size'] == 4096
+    assert done['metadata']['minzoom'] == 1 and done['metadata']['maxzoom'] == 2
+
+    conn = sqlite3.connect(str(path))
+    assert mbtiles.unique_tile_index(conn, 'tiles') is not None
+    assert conn.execute("SELECT tile_data FROM tiles WHERE zoom_level = 2 AND tile_column = 1"
+                        ).fetchone()[0] == b'new'
+    metadata = mbtiles.read_metadata(conn)
+    west, south, east, north = map(float, metadata['bounds'].split(','))
+    # Zoom 2 TMS rows 1-2 and columns 1-2 are the middle of the world
+    assert (west, east) == (-90.0, 90.0)
+    assert north == -south and 66 < north < 67
+    assert metadata['center'].endswith(',1')
+    conn.close()
+    # A second pass finds nothing left to fix and keeps existing values
+    assert mbtiles.finalize(str(path))['duplicates_removed'] == 0
+
+
+def test_tile_report(tmp_path):
+    path = tmp_path / 'report.mbtiles'
+    write(path, [(3, 0, 0, b'a' * 100), (3, 1, 0, b'a' * 100), (3, 2, 0, b''),
+                 (2, 0, 0, b'b' * 10)])
+    conn = sqlite3.connect(str(path))
+    # A map entry whose image is missing, and one outside the zoom 2 grid
+    conn.execute("INSERT INTO map VALUES (3, 3, 7, 'missing')")
+    conn.execute("INSERT INTO map VALUES (2, 9, 0, ?)", (mbtiles.tile_id(b'b' * 10),))
+    conn.commit()
+
+    report = mbtiles.tile_report(conn, expected={2: 4, 3: 16, 4: 64})
+    assert report[3]['tiles'] == 4 and report[3]['dangling'] == 1
+    assert report[2]['invalid'] == 1 and report[2]['corrupt'] == 1
+    # Sizes are only read on request
+    assert report[3]['bytes'] is None and report[3]['empty'] is None
+    assert report[4] == {'tiles': 0, 'bytes': None, 'expected': 64, 'empty': None,
+                         'dangling': 0, 'invalid': 0, 'corrupt': 0}
+
+    sized = mbtiles.tile_report(conn, expected={}, sizes=True)
+    assert sized[3]['bytes'] == 200 and sized[2]['bytes'] == 20
+    assert sized[3]['empty'] == 1 and sized[3]['corrupt'] == 2
+    conn.close()
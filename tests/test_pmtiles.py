@@ -0,0 +1,91 @@
+"""MBTiles to PMTiles conversion, read back with the reader and the raw directories"""
+
+import functools
+
+import pytest
+
+from hillshade import mbtiles, pmtiles
+
+BLANK = b'blank tile'
+
+
+def source_tiles():
+    """Zoom 2 and 3 in full, with a repeated blank image at zoom 3"""
+    tiles = {}
+    for z in (2, 3):
+        for x in range(1 << z):
+            for y in range(1 << z):
+                # Lengths vary so neighbouring tiles never form a run by accident
+                tiles[z, x, y] = f'{z}/{x}/{y}'.encode() * (1 + (x + y) % 3)
+    for x, y in ((0, 0), (5, 2), (7, 7), (3, 6)):
+        tiles[3, x, y] = BLANK
+    return tiles
+
+
+def all_entries(path, header):
+    """Tile entries of the root and every leaf directory"""
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    def directory(offset, length):
+        return pmtiles.deserialize_directory(pmtiles.gunzip_bytes(data[offset:offset + length]))
+
+    root = directory(header.root_offset, header.root_length)
+    if all(entry.run_length > 0 for entry in root):
+        return root, 0
+    entries = []
+    for leaf in root:
+        assert leaf.run_length == 0
+        entries += directory(header.leaf_offset + leaf.offset, leaf.length)
+    return entries, len(root)
+
+
+@pytest.mark.parametrize('dedup', [True, False])
+def test_mbtiles_round_trip(tmp_path, monkeypatch, dedup):
+    # Small limits so 80 tiles already need a root pointing at several leaves
+    monkeypatch.setattr(pmtiles, 'ROOT_MAX_BYTES', 48)
+    monkeypatch.setattr(pmtiles, 'build_directories',
+                        functools.partial(pmtiles.build_directories, leaf_size=16))
+    tiles = source_tiles()
+    source = tmp_path / 'source.mbtiles'
+    with mbtiles.MBTilesWriter(str(source), {
+            'name': 'test', 'format': 'png', 'bounds': '-90,-40,90,40',
+            'center': '10,20,3'}, dedup=dedup) as writer:
+        writer.write_tiles([key + (data,) for key, data in tiles.items()])
+
+    target = tmp_path / 'out.pmtiles'
+    assert pmtiles.mbtiles_to_pmtiles(str(source), str(target), log=lambda message: None) \
+        == len(tiles)
+
+    with pmtiles.PMTilesReader(target) as reader:
+        header = reader.header
+        assert (header.min_zoom, header.max_zoom) == (2, 3)
+        assert header.tile_type == pmtiles.TILE_TYPES['png']
+        assert header.clustered == 1
+        assert header.internal_compression == pmtiles.COMPRESSION_GZIP
+        assert header.tile_compression == pmtiles.COMPRESSION_NONE
+        assert (header.min_lon, header.min_lat, header.max_lon, header.max_lat) == \
+            (-90.0, -40.0, 90.0, 40.0)
+        assert (header.center_lon, header.center_lat, header.center_zoom) == (10.0, 20.0, 3)
+        assert header.addressed_tiles == len(tiles)
+        # The four blank tiles are stored once
+        assert header.tile_contents == len(tiles) - 3
+        assert header.data_offset == header.leaf_offset + header.leaf_length
+        assert reader.metadata()['maxzoom'] == '3'
+
+        entries, leaf_count = all_entries(target, header)
+        assert leaf_count > 1 and header.leaf_length > 0
+        assert len(entries) == header.tile_entries
+        # Every tile, looked up through its leaf, reads back as written
+        for (z, x, y), data in tiles.items():
+            assert reader.get_tile(z, x, y) == data
+        assert reader.get_tile(4, 0, 0) is None
+
+    offsets = {}
+    for entry in entries:
+        for tile_id in range(entry.tile_id, entry.tile_id + entry.run_length):
+            offsets[tile_id] = (entry.offset, entry.length)
+    assert len(offsets) == len(tiles)
+    blank = {offsets[pmtiles.zxy_to_tileid(3, x, y)]
+             for (z, x, y), data in tiles.items() if data == BLANK}
+    assert len(blank) == 1
@@ -0,0 +1,38 @@
+"""Built-in tiler windows on a synthetic Web Mercator DEM (needs GDAL)"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip('osgeo.gdal')
+
+from hillshade import tiler
+
+ZOOM = 12
+TILE_X, TILE_Y = 2100, 1400
+# Source pixels per tile edge; decimated 4x when reading with MAX_WINDOW_PIXELS
+TILE_PIXELS = 512
+MAX_WINDOW_PIXELS = 134 * 134
+SHADING = {'z_factor': 1.0, 'azimuth': 315.0, 'altitude': 45.0}
+
+
+@pytest.fixture(scope='module')
+def dem(mercator_dem):
+    """Covers a 4x3 tile area around the tiles under test"""
+    return mercator_dem(ZOOM, TILE_X - 1, TILE_Y - 1, 4, 3, TILE_PIXELS)
+
+
+def render(dem, x):
+    """One tile at column x (fractional columns straddle two tiles) of row TILE_Y"""
+    return tiler.render_window(dem, tiler.tile_bounds(ZOOM, x, TILE_Y), tiler.TILE_SIZE,
+                               tiler.TILE_SIZE, SHADING, MAX_WINDOW_PIXELS).astype(int)
+
+
+def test_decimated_windows_agree_on_shared_edge(dem):
+    half = tiler.TILE_SIZE // 2
+    left, right = render(dem, TILE_X), render(dem, TILE_X + 1)
+    # Same size and decimation, but the shared edge runs through its middle
+    middle = render(dem, TILE_X + 0.5)
+    assert (left > 0).all() and (right > 0).all()
+    # Within a grey level on average: an extrapolated edge is off by far more
+    assert np.abs(left[:, -4:] - middle[:, half - 4:half]).mean() < 1.0
+    assert np.abs(right[:, :4] - middle[:, half:half + 4]).mean() < 1.0
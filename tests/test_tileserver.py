@@ -0,0 +1,31 @@
+"""Tiles served on demand from a synthetic Web Mercator DEM (needs GDAL)"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip('osgeo.gdal')
+
+from hillshade import encoding, tiler, tileserver
+
+ZOOM = 11
+TILE_X, TILE_Y = 1050, 700
+# Over MAX_WINDOW_PIXELS per tile, so every served tile reads the DEM averaged
+TILE_PIXELS = 1280
+SHADING = {'z_factor': 1.0, 'azimuth': 315.0, 'altitude': 45.0}
+
+
+def served(dem, x):
+    data = tileserver.render_tile(dem, ZOOM, x, TILE_Y, SHADING, encoding.PNG)
+    grey, alpha = encoding.decode_tile(data).astype(int)
+    assert (alpha == 255).all()
+    return grey
+
+
+def test_adjacent_decimated_tiles_line_up(mercator_dem):
+    dem = mercator_dem(ZOOM, TILE_X - 0.25, TILE_Y - 0.25, 2.5, 1.5, TILE_PIXELS)
+    half = tiler.TILE_SIZE // 2
+    left, right = served(dem, TILE_X), served(dem, TILE_X + 1)
+    # A tile-sized render centred on the shared edge
+    middle = served(dem, TILE_X + 0.5)
+    assert np.abs(left[:, -4:] - middle[:, half - 4:half]).mean() < 1.0
+    assert np.abs(right[:, :4] - middle[:, half:half + 4]).mean() < 1.0